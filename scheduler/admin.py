@@ -1,5 +1,6 @@
 from django.contrib import admin
 from .models import Contact, Group, MessageTemplate, ScheduledMessage, MessageLog, EvolutionConfig
+from .services.bulk_schedules import bulk_set_status
 
 @admin.register(Contact)
 class ContactAdmin(admin.ModelAdmin):
@@ -25,8 +26,8 @@ class MessageTemplateAdmin(admin.ModelAdmin):
 
 @admin.register(ScheduledMessage)
 class ScheduledMessageAdmin(admin.ModelAdmin):
-    list_display = ('title', 'recipient_display', 'frequency', 'next_execution', 'status')
-    list_filter = ('status', 'frequency', 'recipient_type')
+    list_display = ('title', 'recipient_display', 'frequency', 'next_execution', 'status', 'priority')
+    list_filter = ('status', 'frequency', 'recipient_type', 'priority')
     search_fields = ('title',)
     readonly_fields = ('id', 'last_sent', 'created_at', 'updated_at')
     actions = ['activate_schedules', 'pause_schedules']
@@ -42,7 +43,7 @@ class ScheduledMessageAdmin(admin.ModelAdmin):
             'fields': ('frequency', 'start_date', 'end_date', 'day_of_week', 'day_of_month')
         }),
         ('Status e Controle', {
-            'fields': ('status', 'next_execution', 'last_sent')
+            'fields': ('status', 'priority', 'next_execution', 'last_sent')
         }),
     )
 
@@ -56,18 +57,21 @@ class ScheduledMessageAdmin(admin.ModelAdmin):
 
     @admin.action(description='Ativar agendamentos selecionados')
     def activate_schedules(self, request, queryset):
-        queryset.update(status='active')
-        self.message_user(request, f"{queryset.count()} agendamentos foram ativados com sucesso.")
+        # bulk_set_status também sincroniza as PeriodicTasks (queryset.update() não dispara os signals)
+        results = bulk_set_status(list(queryset.values_list('id', flat=True)), 'active')
+        updated = sum(1 for item in results if item['result'] == 'updated')
+        self.message_user(request, f"{updated} agendamentos foram ativados com sucesso.")
 
     @admin.action(description='Pausar agendamentos selecionados')
     def pause_schedules(self, request, queryset):
-        queryset.update(status='paused')
-        self.message_user(request, f"{queryset.count()} agendamentos foram pausados com sucesso.")
+        results = bulk_set_status(list(queryset.values_list('id', flat=True)), 'paused')
+        updated = sum(1 for item in results if item['result'] == 'updated')
+        self.message_user(request, f"{updated} agendamentos foram pausados com sucesso.")
 
 @admin.register(MessageLog)
 class MessageLogAdmin(admin.ModelAdmin):
-    list_display = ('scheduled_message', 'recipient', 'status', 'sent_at', 'evolution_message_id')
-    list_filter = ('status',)
+    list_display = ('scheduled_message', 'recipient', 'status', 'sent_at', 'instance_name', 'evolution_message_id')
+    list_filter = ('status', 'instance_name')
     search_fields = ('recipient', 'evolution_message_id', 'scheduled_message__title')
     readonly_fields = [field.name for field in MessageLog._meta.fields]
 
@@ -82,7 +86,7 @@ class MessageLogAdmin(admin.ModelAdmin):
 
 @admin.register(EvolutionConfig)
 class EvolutionConfigAdmin(admin.ModelAdmin):
-    list_display = ('instance_name', 'base_url', 'is_active', 'is_connected', 'last_check')
+    list_display = ('instance_name', 'base_url', 'weight', 'is_active', 'is_connected', 'last_check')
     list_filter = ('is_active', 'is_connected')
     search_fields = ('instance_name', 'base_url')
     readonly_fields = ('id', 'created_at', 'updated_at', 'last_check', 'is_connected')
@@ -0,0 +1,270 @@
+# scheduler/benchmarks.py
+"""
+Microbenchmarks dos caminhos quentes do agendamento (comando run_benchmarks).
+
+Cada benchmark é uma função de preparação registrada com @benchmark: ela recebe a
+escala, monta os dados e devolve (callable, operações por chamada). O callable é
+cronometrado em várias rodadas e vale a melhor; o resultado (µs por operação e
+consultas ao banco por operação) é gravado em um baseline JSON e comparado com ele
+nas execuções seguintes. Os benchmarks que gravam no banco rodam dentro de uma
+transação desfeita no final.
+"""
+import platform
+import random
+import statistics
+import time
+import uuid
+from datetime import datetime, timedelta
+from typing import Callable, Dict, List, Tuple
+
+import django
+from django.db import connection, transaction
+from django.test.utils import override_settings
+from django.utils import timezone
+
+from .models import Contact, MessageLog, MessageTemplate, ScheduledMessage
+from .serializers import MessageLogSerializer, ScheduledMessageSerializer
+from .services.template_renderer import TemplateRenderer, send_context
+from .utils.scheduler_utils import format_phone_number
+
+BENCHMARKS: Dict[str, Callable] = {}
+
+
+def benchmark(name: str):
+    def register(setup):
+        BENCHMARKS[name] = setup
+        return setup
+    return register
+
+
+def _scaled(count: int, scale: float) -> int:
+    return max(int(count * scale), 1)
+
+
+# --- recorrência ---
+
+def _edge_schedules() -> List[ScheduledMessage]:
+    """Todas as frequências com datas de borda: fim de mês, 29/02, virada de ano."""
+    tz = timezone.get_current_timezone()
+    starts = [
+        datetime(2024, 1, 31, 23, 59, tzinfo=tz),
+        datetime(2024, 2, 29, 12, 0, tzinfo=tz),
+        datetime(2023, 12, 31, 23, 30, tzinfo=tz),
+        datetime(2025, 3, 31, 8, 0, tzinfo=tz),
+        datetime(2025, 6, 15, 0, 0, tzinfo=tz),
+    ]
+    variants = [('once', None, None), ('daily', None, None), ('yearly', None, None)]
+    variants += [('weekly', day, None) for day in range(7)]
+    variants += [('monthly', None, day) for day in (1, 15, 28, 29, 30, 31)]
+    now = timezone.now()
+    schedules = []
+    for start in starts:
+        for frequency, day_of_week, day_of_month in variants:
+            # sem execução pendente, pendente no passado (atrasada) e no futuro
+            for next_execution in (None, now - timedelta(days=400), now + timedelta(days=3)):
+                schedules.append(ScheduledMessage(
+                    frequency=frequency, start_date=start, status='active', next_execution=next_execution,
+                    day_of_week=day_of_week, day_of_month=day_of_month,
+                ))
+    return schedules
+
+
+@benchmark('calculate_next_execution')
+def bench_next_execution(scale: float):
+    cases = _edge_schedules()
+    schedules = (cases * (_scaled(20_000, scale) // len(cases) + 1))[:_scaled(20_000, scale)]
+
+    def run():
+        for schedule in schedules:
+            schedule.calculate_next_execution()
+    return run, len(schedules)
+
+
+# --- signal de sincronização com o beat ---
+
+def _fixtures(count: int):
+    template = MessageTemplate.objects.create(title='Benchmark', content='Olá {first_name}')
+    contacts = Contact.objects.bulk_create([
+        Contact(name=f'Benchmark {index}', phone_number=f'5599{index:09d}') for index in range(count)
+    ])
+    return template, contacts
+
+
+@benchmark('periodic_task_signal')
+def bench_periodic_task_signal(scale: float):
+    from .signals import create_or_update_periodic_task
+
+    template, contacts = _fixtures(_scaled(500, scale))
+    frequencies = ('once', 'daily', 'weekly', 'monthly', 'yearly')
+    start = timezone.now() + timedelta(days=1)
+    schedules = ScheduledMessage.objects.bulk_create([
+        ScheduledMessage(
+            title=f'Benchmark {index}', message_template=template, recipient_type='contact', contact=contact,
+            frequency=frequencies[index % len(frequencies)], start_date=start, next_execution=start,
+            day_of_week=index % 7, day_of_month=index % 28 + 1,
+        )
+        for index, contact in enumerate(contacts)
+    ])
+
+    def run():
+        # Custo por save de um agendamento já existente (PeriodicTask criada na primeira rodada)
+        with override_settings(SCHEDULER_DISPATCH_MODE='periodic_task'):
+            for schedule in schedules:
+                create_or_update_periodic_task(ScheduledMessage, schedule, created=False)
+    return run, len(schedules)
+
+
+# --- serializers ---
+
+def _memory_schedules(count: int) -> List[ScheduledMessage]:
+    now = timezone.now()
+    template = MessageTemplate(id=uuid.uuid4(), title='Benchmark', content='Olá {first_name}',
+                               created_at=now, updated_at=now)
+    schedules = []
+    for index in range(count):
+        contact = Contact(id=uuid.uuid4(), name=f'Contato {index}', phone_number=f'5511{index:09d}',
+                          created_at=now, updated_at=now)
+        schedules.append(ScheduledMessage(
+            id=uuid.uuid4(), title=f'Agendamento {index}', message_template=template, recipient_type='contact',
+            contact=contact, frequency='daily', start_date=now, next_execution=now + timedelta(days=1),
+            template_variables={'cupom': 'PROMO10'}, created_at=now, updated_at=now,
+        ))
+    return schedules
+
+
+@benchmark('serializer_scheduled_message')
+def bench_scheduled_message_serializer(scale: float):
+    schedules = _memory_schedules(_scaled(2_000, scale))
+
+    def run():
+        ScheduledMessageSerializer(schedules, many=True).data
+    return run, len(schedules)
+
+
+@benchmark('serializer_scheduled_message_validate')
+def bench_scheduled_message_validation(scale: float):
+    start = (timezone.now() + timedelta(days=1)).isoformat()
+    payloads = [
+        {
+            'title': f'Agendamento {index}', 'recipient_type': 'contact', 'frequency': 'weekly',
+            'start_date': start, 'day_of_week': index % 7, 'contact_id': str(uuid.uuid4()),
+            'message_template_id': str(uuid.uuid4()), 'template_variables': {'cupom': 'PROMO10'},
+        }
+        for index in range(_scaled(2_000, scale))
+    ]
+
+    def run():
+        for payload in payloads:
+            ScheduledMessageSerializer(data=payload).is_valid(raise_exception=True)
+    return run, len(payloads)
+
+
+@benchmark('serializer_message_log')
+def bench_message_log_serializer(scale: float):
+    now = timezone.now()
+    schedule_id = uuid.uuid4()
+    logs = [
+        MessageLog(id=uuid.uuid4(), scheduled_message_id=schedule_id, recipient=f'5511{index:09d}',
+                   status='sent', sent_at=now, evolution_message_id=uuid.uuid4().hex[:20].upper(),
+                   instance_name='principal')
+        for index in range(_scaled(10_000, scale))
+    ]
+
+    def run():
+        MessageLogSerializer(logs, many=True).data
+    return run, len(logs)
+
+
+# --- utilitários ---
+
+@benchmark('format_phone_number')
+def bench_format_phone_number(scale: float):
+    rng = random.Random(0)
+    shapes = (
+        lambda: f'55{rng.randint(11, 99)}9{rng.randint(0, 99_999_999):08d}',
+        lambda: f'({rng.randint(11, 99)}) 9{rng.randint(0, 9999):04d}-{rng.randint(0, 9999):04d}',
+        lambda: f'+55 {rng.randint(11, 99)} {rng.randint(0, 9999):04d}-{rng.randint(0, 9999):04d}',
+        lambda: f'{rng.randint(11, 99)}{rng.randint(0, 99_999_999):08d}',
+    )
+    numbers = [shapes[index % len(shapes)]() for index in range(_scaled(1_000_000, scale))]
+
+    def run():
+        for number in numbers:
+            format_phone_number(number)
+    return run, len(numbers)
+
+
+@benchmark('template_render')
+def bench_template_render(scale: float):
+    now = timezone.now()
+    template = MessageTemplate(id=uuid.uuid4(), title='Benchmark', updated_at=now,
+                               content='Olá {first_name}! Lembrete de {title} às {time}. Cupom {cupom}.')
+    schedule = ScheduledMessage(title='Benchmark', message_template=template, template_variables={'cupom': 'PROMO10'})
+    recipients = [{'phone_number': f'5511{index:09d}', 'name': f'Contato {index}'}
+                  for index in range(_scaled(100_000, scale))]
+    context = send_context(schedule, now)
+    renderer = TemplateRenderer(max_entries=8)
+
+    def run():
+        renderer.render_many(template, recipients, context)
+    return run, len(recipients)
+
+
+# --- execução e comparação ---
+
+def run_benchmark(name: str, rounds: int = 5, scale: float = 1.0) -> Dict:
+    """Prepara e cronometra um benchmark; grava no banco só dentro de uma transação desfeita."""
+    queries = {'count': 0}
+
+    def count_queries(execute, sql, params, many, context):
+        queries['count'] += 1
+        return execute(sql, params, many, context)
+
+    with transaction.atomic():
+        func, ops = BENCHMARKS[name](scale)
+        func()  # aquecimento (caches, PeriodicTasks criadas, imports)
+        timings = []
+        with connection.execute_wrapper(count_queries):
+            for _ in range(rounds):
+                started = time.perf_counter()
+                func()
+                timings.append(time.perf_counter() - started)
+        transaction.set_rollback(True)
+
+    best = min(timings)
+    return {
+        'ops': ops,
+        'rounds': rounds,
+        'best_s': round(best, 6),
+        'median_s': round(statistics.median(timings), 6),
+        'us_per_op': round(best / ops * 1e6, 4),
+        'ops_per_sec': round(ops / best, 1) if best else None,
+        'queries_per_op': round(queries['count'] / rounds / ops, 3),
+    }
+
+
+def environment() -> Dict[str, str]:
+    return {
+        'python': platform.python_version(),
+        'django': django.get_version(),
+        'machine': platform.machine(),
+        'processor': platform.processor() or platform.machine(),
+        'created_at': timezone.now().isoformat(),
+    }
+
+
+def compare(results: Dict[str, Dict], baseline: Dict[str, Dict], threshold: float) -> List[Tuple]:
+    """
+    [(nome, µs/op no baseline, µs/op atual, razão, regrediu?)] para os benchmarks
+    presentes nos dois. Regressão: mais lento que o baseline além de `threshold`
+    (0.2 = 20%) ou com mais consultas ao banco por operação.
+    """
+    rows = []
+    for name, current in results.items():
+        previous = baseline.get(name)
+        if not previous:
+            continue
+        ratio = current['us_per_op'] / previous['us_per_op'] if previous['us_per_op'] else 1.0
+        regressed = ratio > 1 + threshold or current['queries_per_op'] > previous.get('queries_per_op', 0)
+        rows.append((name, previous['us_per_op'], current['us_per_op'], round(ratio, 3), regressed))
+    return rows
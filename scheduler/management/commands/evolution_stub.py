@@ -0,0 +1,36 @@
+# scheduler/management/commands/evolution_stub.py
+from django.core.management.base import BaseCommand
+
+from scheduler.services.evolution_stub import EvolutionStubServer
+
+
+class Command(BaseCommand):
+    help = (
+        "Sobe uma Evolution API falsa (sendText, sendMedia, connectionState, fetchAllGroups, "
+        "whatsappNumbers) com latência, taxa de erro e limite de requisições configuráveis. "
+        "Aponte um EvolutionConfig (ou EVOLUTION_API_BASE_URL) para ela e rode beat + workers normalmente."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--host', default='127.0.0.1')
+        parser.add_argument('--port', type=int, default=8081)
+        parser.add_argument('--latency-ms', type=float, default=80.0, help='Latência fixa de cada resposta.')
+        parser.add_argument('--jitter-ms', type=float, default=40.0, help='Latência extra aleatória (0 a N ms).')
+        parser.add_argument('--error-rate', type=float, default=0.0, help='Fração de envios respondidos com 500.')
+        parser.add_argument('--rate-limit', type=float, default=0.0,
+                            help='Requisições por segundo por instância antes de responder 429 (0 = sem limite).')
+        parser.add_argument('--groups', type=int, default=50, help='Grupos devolvidos pelo fetchAllGroups.')
+
+    def handle(self, *args, **options):
+        stub = EvolutionStubServer(
+            host=options['host'], port=options['port'],
+            latency=options['latency_ms'] / 1000, jitter=options['jitter_ms'] / 1000,
+            error_rate=options['error_rate'], rate_limit=options['rate_limit'], groups=options['groups'],
+        )
+        self.stdout.write(self.style.SUCCESS(f"Evolution stub em http://{options['host']}:{options['port']} (Ctrl+C para parar)"))
+        try:
+            stub.serve_forever()
+        except KeyboardInterrupt:
+            pass
+        finally:
+            self.stdout.write(f"Estatísticas: {stub.stats()}")
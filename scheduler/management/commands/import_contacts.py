@@ -0,0 +1,51 @@
+# scheduler/management/commands/import_contacts.py
+
+import json
+import sys
+
+from django.core.management.base import BaseCommand, CommandError
+
+from scheduler.services.contact_import import FORMATS, detect_format, import_contacts
+
+
+class Command(BaseCommand):
+    help = (
+        "Importa contatos em massa de um arquivo CSV (name,phone_number[,is_active]) ou JSONL, "
+        "com upsert pelo número normalizado. Use '-' para ler da entrada padrão."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('path', help="Arquivo a importar, ou '-' para stdin.")
+        parser.add_argument('--format', dest='file_format', choices=FORMATS,
+                            help='Formato da entrada (padrão: pela extensão, ou csv).')
+        parser.add_argument('--chunk-size', type=int, help='Linhas por upsert.')
+        parser.add_argument('--max-errors', type=int, help='Máximo de erros detalhados no relatório.')
+        parser.add_argument('--report', help='Grava o relatório completo (JSON) neste arquivo.')
+
+    def handle(self, *args, **options):
+        path = options['path']
+        file_format = options['file_format'] or detect_format(path)
+        try:
+            if path == '-':
+                report = self._import(sys.stdin.buffer, file_format, options)
+            else:
+                with open(path, 'rb') as stream:
+                    report = self._import(stream, file_format, options)
+        except OSError as e:
+            raise CommandError(f'Não foi possível ler {path}: {e}')
+
+        for error in report['errors']:
+            self.stderr.write(f"Linha {error['row']}: {error['error']}")
+        if report['errors_truncated']:
+            self.stderr.write(f"... e mais {report['error_count'] - len(report['errors'])} erros.")
+        if options['report']:
+            with open(options['report'], 'w', encoding='utf-8') as output:
+                json.dump(report, output, ensure_ascii=False, indent=2)
+
+        self.stdout.write(self.style.SUCCESS(
+            f"{report['processed']} linhas processadas: {report['created']} criados, "
+            f"{report['updated']} atualizados, {report['error_count']} com erro."
+        ))
+
+    def _import(self, stream, file_format, options):
+        return import_contacts(stream, file_format, options['chunk_size'], options['max_errors'])
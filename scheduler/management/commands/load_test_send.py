@@ -0,0 +1,210 @@
+# scheduler/management/commands/load_test_send.py
+import json
+import logging
+import math
+import time
+import uuid
+from datetime import timedelta
+from unittest import mock
+
+from celery.signals import task_postrun, task_prerun
+from django.conf import settings
+from django.core.management.base import BaseCommand
+from django.db import connection, transaction
+from django.db.models import Count
+from django.test.utils import override_settings
+from django.utils import timezone
+
+from scheduler.models import Contact, EvolutionConfig, MessageLog, MessageTemplate, ScheduledMessage
+from scheduler.services.async_sender import AsyncEvolutionSender
+from scheduler.services.evolution_stub import EvolutionStubServer
+from scheduler.services.instance_router import instance_router
+from scheduler.services.rate_limiter import rate_limiter
+from scheduler.tasks import dispatch_due_messages
+from whatsapp_scheduler.celery import app
+
+DEFAULT_CONTENT = "Olá {first_name}! Lembrete de {title} em {date} às {time}."
+
+
+def percentile(values, fraction):
+    """Percentil pelo método nearest-rank (valores já ordenados)."""
+    if not values:
+        return None
+    return values[max(math.ceil(fraction * len(values)) - 1, 0)]
+
+
+class Command(BaseCommand):
+    help = (
+        "Teste de carga ponta a ponta do envio: cria agendamentos vencidos, roda o tick do "
+        "dispatcher (beat) e os lotes de process_scheduled_batch (worker, em modo eager) contra "
+        "uma Evolution API falsa, e mede mensagens/s, latência p50/p95/p99 por mensagem, duração "
+        "dos lotes e consultas ao banco por envio. Os envios passam pelo caminho do dispatcher "
+        "(AsyncEvolutionSender/httpx), não pelo EvolutionAPIService síncrono dos envios "
+        "recorrentes. Tudo o que é gravado no banco é desfeito no final."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--messages', type=int, default=500, help='Agendamentos (um envio cada).')
+        parser.add_argument('--instances', type=int, default=2, help='Instâncias Evolution falsas.')
+        parser.add_argument('--latency-ms', type=float, default=50.0, help='Latência fixa da API falsa.')
+        parser.add_argument('--jitter-ms', type=float, default=20.0, help='Latência extra aleatória (0 a N ms).')
+        parser.add_argument('--error-rate', type=float, default=0.0, help='Fração de envios respondidos com 500.')
+        parser.add_argument('--rate-limit', type=float, default=0.0,
+                            help='Requisições por segundo por instância na API falsa (0 = sem limite).')
+        parser.add_argument('--batch-size', type=int,
+                            help='Agendamentos por lote de envio (padrão: SCHEDULER_SEND_BATCH_SIZE).')
+        parser.add_argument('--stub-url', help='Usa uma API falsa já no ar (comando evolution_stub).')
+        parser.add_argument('--keep-rate-limits', action='store_true',
+                            help='Mantém o rate limiter do Redis (por padrão fica desligado durante o teste).')
+        parser.add_argument('--json', action='store_true', help='Imprime o relatório em JSON.')
+
+    def handle(self, *args, **options):
+        stub = None
+        if not options['stub_url']:
+            stub = EvolutionStubServer(
+                latency=options['latency_ms'] / 1000, jitter=options['jitter_ms'] / 1000,
+                error_rate=options['error_rate'], rate_limit=options['rate_limit'], seed=0,
+            ).start()
+        base_url = options['stub_url'] or stub.base_url
+
+        rates = (rate_limiter.instance_rate, rate_limiter.recipient_rate)
+        eager = app.conf.task_always_eager
+        if not options['keep_rate_limits']:
+            rate_limiter.instance_rate = rate_limiter.recipient_rate = 0
+        app.conf.task_always_eager = True
+        if options['verbosity'] < 2:
+            logging.disable(logging.WARNING)
+        try:
+            batch_size = options['batch_size'] or settings.SCHEDULER_SEND_BATCH_SIZE
+            with transaction.atomic(), override_settings(SCHEDULER_SEND_BATCH_SIZE=batch_size):
+                report = self._run(base_url, options)
+                transaction.set_rollback(True)
+        finally:
+            logging.disable(logging.NOTSET)
+            app.conf.task_always_eager = eager
+            rate_limiter.instance_rate, rate_limiter.recipient_rate = rates
+            instance_router.invalidate()
+            if stub is not None:
+                stub.stop()
+        if stub is not None:
+            report['stub'] = stub.stats()
+
+        if options['json']:
+            self.stdout.write(json.dumps(report, indent=2))
+            return
+        latency = {key: value or 0.0 for key, value in report['latency_ms'].items()}
+        batch = {key: value or 0.0 for key, value in report['batch_ms'].items()}
+        self.stdout.write(f"Envios: {report['sends']} ({report['statuses']}) em {report['elapsed_s']:.2f}s")
+        self.stdout.write(self.style.SUCCESS(f"Throughput: {report['messages_per_second']:.1f} mensagens/s (um worker)"))
+        self.stdout.write(
+            f"Latência por mensagem: p50 {latency['p50']:.1f} ms, p95 {latency['p95']:.1f} ms, "
+            f"p99 {latency['p99']:.1f} ms, máx {latency['max']:.1f} ms"
+        )
+        self.stdout.write(
+            f"Duração por lote ({report['batches']} lotes de até {report['batch_size']}): p50 {batch['p50']:.1f} ms, "
+            f"máx {batch['max']:.1f} ms"
+        )
+        self.stdout.write(
+            f"Consultas ao banco: {report['queries_per_send']:.1f} por envio, "
+            f"{report['dispatcher_queries']} no tick do dispatcher"
+        )
+        if 'stub' in report:
+            self.stdout.write(f"API falsa: {report['stub']}")
+
+    def _run(self, base_url, options):
+        now = timezone.now()
+        run_id = uuid.uuid4().hex[:8]
+        count = options['messages']
+
+        # Só as instâncias falsas ficam no rodízio (desfeito no rollback)
+        EvolutionConfig.objects.update(is_active=False)
+        EvolutionConfig.objects.bulk_create([
+            EvolutionConfig(instance_name=f'loadtest-{run_id}-{index}', api_key='loadtest',
+                            base_url=base_url, is_connected=True)
+            for index in range(options['instances'])
+        ])
+        instance_router.invalidate()
+
+        template = MessageTemplate.objects.create(title=f'Load test {run_id}', content=DEFAULT_CONTENT)
+        contacts = Contact.objects.bulk_create([
+            Contact(name=f'Contato {index}', phone_number=f'5500{index:09d}') for index in range(count)
+        ], batch_size=1000)
+        due = now - timedelta(seconds=1)
+        schedules = ScheduledMessage.objects.bulk_create([
+            ScheduledMessage(
+                title=f'Load test {index}', message_template=template, recipient_type='contact',
+                contact=contact, frequency='once', start_date=due, next_execution=due,
+            )
+            for index, contact in enumerate(contacts)
+        ], batch_size=1000)
+
+        queries = {'count': 0}
+        started_at = {}
+        durations, task_queries, send_durations = [], [], []
+        send_job = AsyncEvolutionSender._send_job
+
+        async def timed_send_job(sender, client, semaphore, job):
+            # Latência de cada mensagem: espera do rate limiter e do semáforo + requisição HTTP
+            started = time.perf_counter()
+            try:
+                return await send_job(sender, client, semaphore, job)
+            finally:
+                send_durations.append(round((time.perf_counter() - started) * 1000, 2))
+
+        def count_queries(execute, sql, params, many, context):
+            queries['count'] += 1
+            return execute(sql, params, many, context)
+
+        def on_prerun(task_id=None, task=None, **kwargs):
+            if task.name == 'scheduler.tasks.process_scheduled_batch':
+                started_at[task_id] = (time.perf_counter(), queries['count'])
+
+        def on_postrun(task_id=None, task=None, **kwargs):
+            if task_id in started_at:
+                started, queries_before = started_at.pop(task_id)
+                durations.append(round((time.perf_counter() - started) * 1000, 2))
+                task_queries.append(queries['count'] - queries_before)
+
+        task_prerun.connect(on_prerun, weak=False)
+        task_postrun.connect(on_postrun, weak=False)
+        try:
+            with connection.execute_wrapper(count_queries), \
+                    mock.patch.object(AsyncEvolutionSender, '_send_job', timed_send_job):
+                started = time.perf_counter()
+                # Tick do beat: o dispatcher enfileira os lotes e o worker (eager) envia cada um
+                dispatch_due_messages()
+                elapsed = time.perf_counter() - started
+        finally:
+            task_prerun.disconnect(on_prerun)
+            task_postrun.disconnect(on_postrun)
+
+        statuses = dict(
+            MessageLog.objects.filter(scheduled_message__in=schedules)
+            .order_by().values_list('status').annotate(total=Count('id'))
+        )
+        sends = sum(statuses.values())
+        durations.sort()
+        send_durations.sort()
+        return {
+            'messages': count,
+            'instances': options['instances'],
+            'batch_size': settings.SCHEDULER_SEND_BATCH_SIZE,
+            'batches': len(task_queries),
+            'sends': sends,
+            'statuses': statuses,
+            'elapsed_s': round(elapsed, 3),
+            'messages_per_second': round(sends / elapsed, 2) if elapsed else 0.0,
+            'latency_samples': len(send_durations),
+            'latency_ms': {
+                'p50': percentile(send_durations, 0.50),
+                'p95': percentile(send_durations, 0.95),
+                'p99': percentile(send_durations, 0.99),
+                'max': send_durations[-1] if send_durations else None,
+            },
+            'batch_ms': {
+                'p50': percentile(durations, 0.50),
+                'max': durations[-1] if durations else None,
+            },
+            'queries_per_send': round(sum(task_queries) / sends, 2) if sends else 0.0,
+            'dispatcher_queries': queries['count'] - sum(task_queries),
+        }
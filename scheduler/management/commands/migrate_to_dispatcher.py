@@ -0,0 +1,55 @@
+# scheduler/management/commands/migrate_to_dispatcher.py
+
+from django.conf import settings
+from django.core.management.base import BaseCommand
+from django.db import transaction
+from django_celery_beat.models import PeriodicTask, PeriodicTasks, CrontabSchedule, ClockedSchedule
+
+
+class Command(BaseCommand):
+    help = (
+        "Remove as PeriodicTasks criadas por agendamento (whatsapp-schedule-*) "
+        "ao migrar para SCHEDULER_DISPATCH_MODE='dispatcher'."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--dry-run', action='store_true', help='Apenas mostra o que seria removido.')
+        parser.add_argument(
+            '--purge-schedules', action='store_true',
+            help='Remove também Crontab/ClockedSchedules que ficarem sem nenhuma PeriodicTask.'
+        )
+        parser.add_argument(
+            '--force', action='store_true',
+            help='Executa mesmo que SCHEDULER_DISPATCH_MODE não seja "dispatcher".'
+        )
+
+    def handle(self, *args, **options):
+        if settings.SCHEDULER_DISPATCH_MODE != 'dispatcher' and not options['force']:
+            self.stderr.write(self.style.ERROR(
+                "SCHEDULER_DISPATCH_MODE não é 'dispatcher'. Sem as PeriodicTasks nenhum agendamento "
+                "seria disparado. Ajuste a configuração ou use --force."
+            ))
+            return
+
+        tasks = PeriodicTask.objects.filter(
+            name__startswith='whatsapp-schedule-',
+            task='scheduler.tasks.process_scheduled_message',
+        )
+        total = tasks.count()
+
+        if options['dry_run']:
+            self.stdout.write(f"{total} PeriodicTasks de agendamento seriam removidas.")
+            return
+
+        with transaction.atomic():
+            deleted = tasks.delete()[0]
+            purged = 0
+            if options['purge_schedules']:
+                purged += CrontabSchedule.objects.filter(periodictask__isnull=True).delete()[0]
+                purged += ClockedSchedule.objects.filter(periodictask__isnull=True).delete()[0]
+            # Avisa o DatabaseScheduler para recarregar a lista de tarefas
+            PeriodicTasks.update_changed()
+
+        self.stdout.write(self.style.SUCCESS(f"{deleted} PeriodicTasks de agendamento removidas."))
+        if options['purge_schedules']:
+            self.stdout.write(f"{purged} schedules órfãos removidos.")
@@ -0,0 +1,58 @@
+# scheduler/management/commands/migrate_to_periodic_tasks.py
+
+from django.conf import settings
+from django.core.management.base import BaseCommand
+from django.db import transaction
+from django_celery_beat.models import PeriodicTask, PeriodicTasks
+
+from scheduler.models import ScheduledMessage
+from scheduler.services.beat_sync import SYNC_FIELDS, sync_periodic_tasks
+
+# Nome da entrada de CELERY_BEAT_SCHEDULE que o DatabaseScheduler grava como PeriodicTask
+DISPATCHER_TASK_NAME = 'dispatch-due-messages'
+
+
+class Command(BaseCommand):
+    help = (
+        "Volta de SCHEDULER_DISPATCH_MODE='dispatcher' para 'periodic_task': remove a PeriodicTask "
+        "do dispatcher (dispatch-due-messages), que o DatabaseScheduler mantém no banco mesmo fora de "
+        "CELERY_BEAT_SCHEDULE, e recria as PeriodicTasks dos agendamentos ativos (whatsapp-schedule-*)."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--dry-run', action='store_true', help='Apenas mostra o que seria feito.')
+        parser.add_argument('--batch-size', type=int, default=500, help='Agendamentos sincronizados por lote.')
+
+    def handle(self, *args, **options):
+        if settings.SCHEDULER_DISPATCH_MODE != 'periodic_task':
+            self.stderr.write(self.style.ERROR(
+                "SCHEDULER_DISPATCH_MODE não é 'periodic_task'. Ajuste a configuração (e reinicie o beat) "
+                "antes de recriar as PeriodicTasks, senão os agendamentos seriam disparados duas vezes."
+            ))
+            return
+
+        dispatcher_tasks = PeriodicTask.objects.filter(name=DISPATCHER_TASK_NAME)
+        schedule_ids = list(
+            ScheduledMessage.objects.filter(status='active').order_by('id').values_list('id', flat=True)
+        )
+
+        if options['dry_run']:
+            self.stdout.write(
+                f"{dispatcher_tasks.count()} PeriodicTask do dispatcher seria removida e "
+                f"{len(schedule_ids)} agendamentos seriam sincronizados."
+            )
+            return
+
+        batch_size = options['batch_size']
+        with transaction.atomic():
+            removed = dispatcher_tasks.delete()[0]
+            for start in range(0, len(schedule_ids), batch_size):
+                sync_periodic_tasks(list(
+                    ScheduledMessage.objects.filter(id__in=schedule_ids[start:start + batch_size]).only(*SYNC_FIELDS)
+                ))
+            # Avisa o DatabaseScheduler para recarregar a lista de tarefas
+            PeriodicTasks.update_changed()
+
+        self.stdout.write(self.style.SUCCESS(
+            f"{removed} PeriodicTask do dispatcher removida; {len(schedule_ids)} agendamentos sincronizados."
+        ))
@@ -0,0 +1,50 @@
+# scheduler/management/commands/recompute_next_executions.py
+
+from django.core.management.base import BaseCommand
+from django.utils import timezone
+
+from scheduler.models import ScheduledMessage
+from scheduler.utils.recurrence import next_occurrence_batch
+
+
+class Command(BaseCommand):
+    help = (
+        "Recalcula em lote o next_execution dos agendamentos recorrentes ativos que ficaram "
+        "para trás (ex.: após uma indisponibilidade), pulando as execuções perdidas."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=2000, help='Agendamentos por lote.')
+        parser.add_argument('--dry-run', action='store_true', help='Apenas calcula, sem gravar.')
+
+    def handle(self, *args, **options):
+        now = timezone.now()
+        batch_size = options['batch_size']
+        overdue_ids = list(
+            ScheduledMessage.objects.filter(status='active', next_execution__lt=now)
+            .exclude(frequency='once')
+            .values_list('id', flat=True)
+        )
+
+        updated = 0
+        for start in range(0, len(overdue_ids), batch_size):
+            schedules = list(
+                ScheduledMessage.objects.filter(id__in=overdue_ids[start:start + batch_size])
+                .only('id', 'frequency', 'start_date', 'next_execution', 'day_of_week', 'day_of_month')
+            )
+            next_runs = next_occurrence_batch(
+                [schedule.frequency for schedule in schedules],
+                [schedule.start_date for schedule in schedules],
+                # mesma base de calculate_next_execution: a execução pendente, se ainda no futuro, ou agora
+                [max(schedule.next_execution or schedule.start_date, now) for schedule in schedules],
+                [schedule.day_of_week for schedule in schedules],
+                [schedule.day_of_month for schedule in schedules],
+            )
+            for schedule, next_run in zip(schedules, next_runs):
+                schedule.next_execution = next_run
+            if not options['dry_run']:
+                ScheduledMessage.objects.bulk_update(schedules, ['next_execution'], batch_size=batch_size)
+            updated += len(schedules)
+
+        verb = 'seriam recalculados' if options['dry_run'] else 'recalculados'
+        self.stdout.write(self.style.SUCCESS(f"{updated} agendamentos {verb}."))
@@ -0,0 +1,72 @@
+# scheduler/management/commands/run_benchmarks.py
+import json
+from pathlib import Path
+
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+
+from scheduler.benchmarks import BENCHMARKS, compare, environment, run_benchmark
+
+DEFAULT_BASELINE = Path(settings.BASE_DIR) / 'benchmarks' / 'baseline.json'
+
+
+class Command(BaseCommand):
+    help = (
+        "Microbenchmarks dos caminhos quentes (recorrência, signal do beat, serializers, "
+        "format_phone_number, templates). Grava os resultados como baseline JSON (--save) "
+        "e compara com ele (--compare), falhando se algum ficar mais lento que o limite."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('names', nargs='*', help=f"Benchmarks a rodar (padrão: todos): {', '.join(BENCHMARKS)}")
+        parser.add_argument('--rounds', type=int, default=5, help='Rodadas cronometradas (vale a melhor).')
+        parser.add_argument('--scale', type=float, default=1.0, help='Multiplica o tamanho das entradas.')
+        parser.add_argument('--save', nargs='?', const=str(DEFAULT_BASELINE),
+                            help=f'Grava os resultados como baseline (padrão: {DEFAULT_BASELINE}).')
+        parser.add_argument('--compare', nargs='?', const=str(DEFAULT_BASELINE),
+                            help='Compara com um baseline salvo.')
+        parser.add_argument('--threshold', type=float, default=0.2,
+                            help='Aumento máximo de µs/op aceito na comparação (0.2 = 20%%).')
+        parser.add_argument('--json', action='store_true', help='Imprime os resultados em JSON.')
+
+    def handle(self, *args, **options):
+        names = options['names'] or list(BENCHMARKS)
+        unknown = set(names) - set(BENCHMARKS)
+        if unknown:
+            raise CommandError(f"Benchmarks desconhecidos: {', '.join(sorted(unknown))}")
+
+        baseline = None
+        if options['compare']:
+            try:
+                baseline = json.loads(Path(options['compare']).read_text())['results']
+            except (OSError, ValueError, KeyError) as e:
+                raise CommandError(f"Baseline inválido em {options['compare']}: {e}")
+
+        results = {}
+        for name in names:
+            results[name] = result = run_benchmark(name, rounds=options['rounds'], scale=options['scale'])
+            if not options['json']:
+                self.stdout.write(
+                    f"{name:<40} {result['us_per_op']:>10.3f} µs/op {result['ops_per_sec']:>14,.0f} ops/s "
+                    f"{result['queries_per_op']:>6.2f} consultas/op ({result['ops']} ops)"
+                )
+        if options['json']:
+            self.stdout.write(json.dumps(results, indent=2))
+
+        if options['save']:
+            path = Path(options['save'])
+            path.parent.mkdir(parents=True, exist_ok=True)
+            previous = json.loads(path.read_text())['results'] if path.exists() else {}
+            # Rodar só alguns benchmarks atualiza só esses no baseline
+            path.write_text(json.dumps({'environment': environment(), 'results': {**previous, **results}}, indent=2))
+            self.stdout.write(self.style.SUCCESS(f"Baseline salvo em {path}"))
+
+        if baseline is not None:
+            rows = compare(results, baseline, options['threshold'])
+            for name, before, after, ratio, regressed in rows:
+                line = f"{name:<40} {before:>10.3f} -> {after:>10.3f} µs/op ({ratio:.2f}x)"
+                self.stdout.write(self.style.ERROR(line + ' REGRESSÃO') if regressed else line)
+            regressions = [row[0] for row in rows if row[4]]
+            if regressions:
+                raise CommandError(f"Regressão de desempenho em: {', '.join(regressions)}")
+            self.stdout.write(self.style.SUCCESS(f"{len(rows)} benchmarks dentro do limite de {options['threshold']:.0%}."))
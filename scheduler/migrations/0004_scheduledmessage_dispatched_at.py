@@ -0,0 +1,18 @@
+# Generated by Django 5.0.6 on 2026-10-18 06:47
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('scheduler', '0003_alter_messagetemplate_options_remove_group_members_and_more'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='scheduledmessage',
+            name='dispatched_at',
+            field=models.DateTimeField(blank=True, null=True, verbose_name='Despachado em'),
+        ),
+    ]
@@ -0,0 +1,23 @@
+# Generated by Django 5.0.6 on 2026-10-18 06:51
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('scheduler', '0004_scheduledmessage_dispatched_at'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='evolutionconfig',
+            name='weight',
+            field=models.PositiveIntegerField(default=1, verbose_name='Peso no Balanceamento'),
+        ),
+        migrations.AddField(
+            model_name='messagelog',
+            name='instance_name',
+            field=models.CharField(blank=True, max_length=100, null=True, verbose_name='Instância Evolution'),
+        ),
+    ]
@@ -0,0 +1,30 @@
+# Generated by Django 5.0.6 on 2026-10-18 06:54
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('scheduler', '0005_evolutionconfig_weight_messagelog_instance_name'),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name='messagelog',
+            name='evolution_message_id',
+            field=models.CharField(blank=True, db_index=True, max_length=100, null=True, verbose_name='ID da Mensagem Evolution'),
+        ),
+        migrations.AddIndex(
+            model_name='messagelog',
+            index=models.Index(fields=['status', 'sent_at'], name='log_status_sent_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='messagelog',
+            index=models.Index(fields=['scheduled_message', 'sent_at'], name='log_sched_sent_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='scheduledmessage',
+            index=models.Index(fields=['status', 'next_execution'], name='sched_status_next_idx'),
+        ),
+    ]
@@ -0,0 +1,17 @@
+# Generated by Django 5.0.6 on 2026-10-18 07:07
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('scheduler', '0006_hot_path_indexes'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='messagelog',
+            index=models.Index(fields=['sent_at', 'id'], name='log_sent_id_idx'),
+        ),
+    ]
@@ -0,0 +1,49 @@
+# Generated by Django 5.0.6 on 2026-10-18 07:10
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('scheduler', '0007_message_log_cursor_index'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='RollupCheckpoint',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('name', models.CharField(max_length=50, unique=True, verbose_name='Nome')),
+                ('position', models.DateTimeField(verbose_name='Posição')),
+                ('updated_at', models.DateTimeField(auto_now=True, verbose_name='Atualizado em')),
+            ],
+            options={
+                'verbose_name': 'Checkpoint de Consolidação',
+                'verbose_name_plural': 'Checkpoints de Consolidação',
+            },
+        ),
+        migrations.CreateModel(
+            name='SendRollup',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('granularity', models.CharField(choices=[('minute', 'Minuto'), ('hour', 'Hora'), ('day', 'Dia')], max_length=6, verbose_name='Granularidade')),
+                ('dimension', models.CharField(choices=[('all', 'Total'), ('schedule', 'Agendamento'), ('instance', 'Instância')], max_length=8, verbose_name='Dimensão')),
+                ('key', models.CharField(blank=True, default='', max_length=100, verbose_name='Chave')),
+                ('bucket_start', models.DateTimeField(verbose_name='Início do Intervalo')),
+                ('total', models.PositiveIntegerField(default=0, verbose_name='Total')),
+                ('sent', models.PositiveIntegerField(default=0, verbose_name='Enviados')),
+                ('failed', models.PositiveIntegerField(default=0, verbose_name='Falhas')),
+                ('delivered', models.PositiveIntegerField(default=0, verbose_name='Entregues')),
+                ('read', models.PositiveIntegerField(default=0, verbose_name='Lidos')),
+            ],
+            options={
+                'verbose_name': 'Consolidado de Envios',
+                'verbose_name_plural': 'Consolidados de Envios',
+            },
+        ),
+        migrations.AddConstraint(
+            model_name='sendrollup',
+            constraint=models.UniqueConstraint(fields=('granularity', 'dimension', 'key', 'bucket_start'), name='rollup_series_bucket_uniq'),
+        ),
+    ]
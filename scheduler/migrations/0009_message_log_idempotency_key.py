@@ -0,0 +1,18 @@
+# Generated by Django 5.0.6 on 2026-10-18 07:16
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('scheduler', '0008_send_rollups'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='messagelog',
+            name='idempotency_key',
+            field=models.CharField(blank=True, editable=False, max_length=150, null=True, unique=True, verbose_name='Chave de Idempotência'),
+        ),
+    ]
@@ -0,0 +1,18 @@
+# Generated by Django 5.0.6 on 2026-10-18 07:17
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('scheduler', '0009_message_log_idempotency_key'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='scheduledmessage',
+            name='template_variables',
+            field=models.JSONField(blank=True, default=dict, verbose_name='Variáveis do Template'),
+        ),
+    ]
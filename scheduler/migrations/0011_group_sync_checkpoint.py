@@ -0,0 +1,27 @@
+# Generated by Django 5.0.6 on 2026-10-18 07:21
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('scheduler', '0010_scheduled_message_template_variables'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='GroupSyncCheckpoint',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('instance_name', models.CharField(max_length=100, unique=True, verbose_name='Instância Evolution')),
+                ('payload_hash', models.CharField(max_length=64, verbose_name='Hash da Lista de Grupos')),
+                ('group_count', models.PositiveIntegerField(default=0, verbose_name='Quantidade de Grupos')),
+                ('synced_at', models.DateTimeField(auto_now=True, verbose_name='Sincronizado em')),
+            ],
+            options={
+                'verbose_name': 'Checkpoint de Sincronização de Grupos',
+                'verbose_name_plural': 'Checkpoints de Sincronização de Grupos',
+            },
+        ),
+    ]
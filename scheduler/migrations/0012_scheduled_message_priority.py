@@ -0,0 +1,18 @@
+# Generated by Django 5.0.6 on 2026-10-18 07:23
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('scheduler', '0011_group_sync_checkpoint'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='scheduledmessage',
+            name='priority',
+            field=models.CharField(choices=[('high', 'Alta'), ('normal', 'Normal'), ('low', 'Baixa')], default='normal', max_length=10, verbose_name='Prioridade'),
+        ),
+    ]
@@ -1,8 +1,7 @@
 from django.db import models
 from django.utils import timezone
-from datetime import timedelta
 import uuid
-import calendar
+from .utils.recurrence import next_occurrence
 
 class Contact(models.Model):
     id = models.UUIDField(primary_key=True, default=uuid.uuid4, editable=False)
@@ -79,6 +78,11 @@ class ScheduledMessage(models.Model):
         ('contact', 'Contato'),
         ('group', 'Grupo'),
     ]
+    PRIORITY_CHOICES = [
+        ('high', 'Alta'),
+        ('normal', 'Normal'),
+        ('low', 'Baixa'),
+    ]
     id = models.UUIDField(primary_key=True, default=uuid.uuid4, editable=False)
     title = models.CharField(max_length=100, verbose_name="Título do Agendamento")
     message_template = models.ForeignKey(MessageTemplate, on_delete=models.CASCADE, verbose_name="Template da Mensagem")
@@ -91,8 +95,13 @@ class ScheduledMessage(models.Model):
     day_of_week = models.IntegerField(blank=True, null=True, verbose_name="Dia da Semana (0-6)")
     day_of_month = models.IntegerField(blank=True, null=True, verbose_name="Dia do Mês")
     status = models.CharField(max_length=10, choices=STATUS_CHOICES, default='active', verbose_name="Status")
+    # define a fila do Celery do envio (ver services/send_routing.py)
+    priority = models.CharField(max_length=10, choices=PRIORITY_CHOICES, default='normal', verbose_name="Prioridade")
     last_sent = models.DateTimeField(blank=True, null=True, verbose_name="Último Envio")
     next_execution = models.DateTimeField(blank=True, null=True, verbose_name="Próxima Execução")
+    dispatched_at = models.DateTimeField(blank=True, null=True, verbose_name="Despachado em")
+    # variáveis personalizadas do template ({chave} -> valor), comuns a todos os destinatários
+    template_variables = models.JSONField(default=dict, blank=True, verbose_name="Variáveis do Template")
     created_at = models.DateTimeField(auto_now_add=True, verbose_name="Criado em")
     updated_at = models.DateTimeField(auto_now=True, verbose_name="Atualizado em")
 
@@ -106,55 +115,7 @@ class ScheduledMessage(models.Model):
         base_time = self.next_execution or self.start_date
         if base_time < now:
             base_time = now
-        if self.frequency == 'once':
-            return None
-        elif self.frequency == 'daily':
-            next_time = base_time + timedelta(days=1)
-            return next_time.replace(hour=self.start_date.hour, minute=self.start_date.minute, second=0, microsecond=0)
-        elif self.frequency == 'weekly':
-            if self.day_of_week is None:
-                return None
-            next_time = base_time
-            while True:
-                next_time += timedelta(days=1)
-                if next_time.weekday() == self.day_of_week:
-                    return next_time.replace(hour=self.start_date.hour, minute=self.start_date.minute, second=0, microsecond=0)
-        elif self.frequency == 'monthly':
-            if not self.day_of_month:
-                return None
-            next_time = base_time
-            year, month = next_time.year, next_time.month
-            last_day_this_month = calendar.monthrange(year, month)[1]
-            day = min(self.day_of_month, last_day_this_month)
-            potential_date = next_time.replace(day=day)
-            if potential_date <= base_time:
-                month += 1
-                if month > 12:
-                    month = 1
-                    year += 1
-                last_day_next_month = calendar.monthrange(year, month)[1]
-                day = min(self.day_of_month, last_day_next_month)
-                next_time = potential_date.replace(year=year, month=month, day=day)
-            else:
-                next_time = potential_date
-            return next_time.replace(hour=self.start_date.hour, minute=self.start_date.minute, second=0, microsecond=0)
-        elif self.frequency == 'yearly':
-            next_time = base_time
-            target_year = next_time.year
-            try:
-                potential_date = next_time.replace(month=self.start_date.month, day=self.start_date.day)
-                if potential_date <= base_time:
-                    target_year += 1
-            except ValueError:
-                if base_time.month > self.start_date.month:
-                    target_year += 1
-            while True:
-                try:
-                    return next_time.replace(year=target_year, month=self.start_date.month, day=self.start_date.day,
-                                            hour=self.start_date.hour, minute=self.start_date.minute, second=0, microsecond=0)
-                except ValueError:
-                    target_year += 1
-        return None
+        return next_occurrence(self.frequency, self.start_date, base_time, self.day_of_week, self.day_of_month)
 
     def save(self, *args, **kwargs):
         if not self.pk or not self.next_execution:
@@ -168,6 +129,10 @@ class ScheduledMessage(models.Model):
         verbose_name = "Mensagem Agendada"
         verbose_name_plural = "Mensagens Agendadas"
         ordering = ['-created_at']
+        indexes = [
+            # upcoming/overdue e varredura do dispatcher: status = ? AND next_execution <|>= ?
+            models.Index(fields=['status', 'next_execution'], name='sched_status_next_idx'),
+        ]
 
 class MessageLog(models.Model):
     STATUS_CHOICES = [
@@ -184,7 +149,10 @@ class MessageLog(models.Model):
     sent_at = models.DateTimeField(auto_now_add=True, verbose_name="Enviado em")
     delivered_at = models.DateTimeField(blank=True, null=True, verbose_name="Entregue em")
     error_message = models.TextField(blank=True, null=True, verbose_name="Mensagem de Erro")
-    evolution_message_id = models.CharField(max_length=100, blank=True, null=True, verbose_name="ID da Mensagem Evolution")
+    evolution_message_id = models.CharField(max_length=100, blank=True, null=True, db_index=True, verbose_name="ID da Mensagem Evolution")
+    instance_name = models.CharField(max_length=100, blank=True, null=True, verbose_name="Instância Evolution")
+    # agendamento:ocorrência:destinatário; impede dois envios da mesma ocorrência
+    idempotency_key = models.CharField(max_length=150, unique=True, blank=True, null=True, editable=False, verbose_name="Chave de Idempotência")
 
     def __str__(self):
         return f"{self.scheduled_message.title} - {self.recipient} - {self.status}"
@@ -193,6 +161,14 @@ class MessageLog(models.Model):
         verbose_name = "Log de Mensagem"
         verbose_name_plural = "Logs de Mensagens"
         ordering = ['-sent_at']
+        indexes = [
+            # filtros do dashboard/logs por status dentro de um período
+            models.Index(fields=['status', 'sent_at'], name='log_status_sent_idx'),
+            # histórico de um agendamento, já ordenado por data
+            models.Index(fields=['scheduled_message', 'sent_at'], name='log_sched_sent_idx'),
+            # paginação por cursor da listagem de logs: ORDER BY sent_at DESC, id DESC
+            models.Index(fields=['sent_at', 'id'], name='log_sent_id_idx'),
+        ]
 
 class EvolutionConfig(models.Model):
     id = models.UUIDField(primary_key=True, default=uuid.uuid4, editable=False)
@@ -200,6 +176,7 @@ class EvolutionConfig(models.Model):
     api_key = models.CharField(max_length=255, verbose_name="Chave da API")
     base_url = models.URLField(verbose_name="URL Base da API")
     webhook_url = models.URLField(blank=True, null=True, verbose_name="URL do Webhook")
+    weight = models.PositiveIntegerField(default=1, verbose_name="Peso no Balanceamento")
     is_active = models.BooleanField(default=True, verbose_name="Ativo")
     is_connected = models.BooleanField(default=False, verbose_name="Conectado")
     last_check = models.DateTimeField(blank=True, null=True, verbose_name="Última Verificação")
@@ -213,3 +190,64 @@ class EvolutionConfig(models.Model):
         verbose_name = "Configuração Evolution"
         verbose_name_plural = "Configurações Evolution"
         ordering = ['instance_name']
+
+class SendRollup(models.Model):
+    """Contagem de envios por intervalo (minuto/hora/dia), no total, por agendamento e por instância."""
+    GRANULARITY_CHOICES = [
+        ('minute', 'Minuto'),
+        ('hour', 'Hora'),
+        ('day', 'Dia'),
+    ]
+    DIMENSION_CHOICES = [
+        ('all', 'Total'),
+        ('schedule', 'Agendamento'),
+        ('instance', 'Instância'),
+    ]
+    granularity = models.CharField(max_length=6, choices=GRANULARITY_CHOICES, verbose_name="Granularidade")
+    dimension = models.CharField(max_length=8, choices=DIMENSION_CHOICES, verbose_name="Dimensão")
+    key = models.CharField(max_length=100, blank=True, default='', verbose_name="Chave")
+    bucket_start = models.DateTimeField(verbose_name="Início do Intervalo")
+    total = models.PositiveIntegerField(default=0, verbose_name="Total")
+    sent = models.PositiveIntegerField(default=0, verbose_name="Enviados")
+    failed = models.PositiveIntegerField(default=0, verbose_name="Falhas")
+    delivered = models.PositiveIntegerField(default=0, verbose_name="Entregues")
+    read = models.PositiveIntegerField(default=0, verbose_name="Lidos")
+
+    def __str__(self):
+        return f"{self.granularity} {self.dimension}:{self.key} {self.bucket_start}"
+
+    class Meta:
+        verbose_name = "Consolidado de Envios"
+        verbose_name_plural = "Consolidados de Envios"
+        constraints = [
+            # também é o índice das consultas por série: (granularidade, dimensão, chave) + período
+            models.UniqueConstraint(fields=['granularity', 'dimension', 'key', 'bucket_start'], name='rollup_series_bucket_uniq'),
+        ]
+
+class RollupCheckpoint(models.Model):
+    """Até onde (sent_at) os logs já foram consolidados em SendRollup."""
+    name = models.CharField(max_length=50, unique=True, verbose_name="Nome")
+    position = models.DateTimeField(verbose_name="Posição")
+    updated_at = models.DateTimeField(auto_now=True, verbose_name="Atualizado em")
+
+    def __str__(self):
+        return f"{self.name} @ {self.position}"
+
+    class Meta:
+        verbose_name = "Checkpoint de Consolidação"
+        verbose_name_plural = "Checkpoints de Consolidação"
+
+
+class GroupSyncCheckpoint(models.Model):
+    """Hash da última lista de grupos sincronizada de cada instância Evolution."""
+    instance_name = models.CharField(max_length=100, unique=True, verbose_name="Instância Evolution")
+    payload_hash = models.CharField(max_length=64, verbose_name="Hash da Lista de Grupos")
+    group_count = models.PositiveIntegerField(default=0, verbose_name="Quantidade de Grupos")
+    synced_at = models.DateTimeField(auto_now=True, verbose_name="Sincronizado em")
+
+    def __str__(self):
+        return f"{self.instance_name} ({self.group_count} grupos)"
+
+    class Meta:
+        verbose_name = "Checkpoint de Sincronização de Grupos"
+        verbose_name_plural = "Checkpoints de Sincronização de Grupos"
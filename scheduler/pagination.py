@@ -0,0 +1,133 @@
+# scheduler/pagination.py
+import base64
+import json
+from urllib import parse
+
+from django.core.exceptions import ValidationError as DjangoValidationError
+from django.db.models import Q
+from rest_framework.exceptions import NotFound
+from rest_framework.pagination import BasePagination
+from rest_framework.response import Response
+from rest_framework.settings import api_settings
+from rest_framework.utils.urls import replace_query_param
+
+
+class KeysetPagination(BasePagination):
+    """
+    Paginação por cursor (keyset) sobre a ordenação da view (`view.ordering`).
+
+    O cursor guarda os valores de todos os campos da ordenação do último item, e a
+    página seguinte é um WHERE (a, b) > (x, y) + LIMIT: sem OFFSET nem COUNT(*), o
+    custo é o mesmo em qualquer profundidade. A ordenação deve terminar em um campo
+    único (ex.: id) e não pode ter campos nulos.
+    """
+    ordering = ('-id',)
+    page_size = api_settings.PAGE_SIZE
+    page_size_query_param = 'page_size'
+    max_page_size = 200
+    cursor_query_param = 'cursor'
+    invalid_cursor_message = 'Cursor inválido.'
+
+    def paginate_queryset(self, queryset, request, view=None):
+        self.request = request
+        self.base_url = request.build_absolute_uri()
+        self.ordering = tuple(getattr(view, 'ordering', None) or self.ordering)
+        self.page_size = self.get_page_size(request)
+        self.model = queryset.model
+        reverse, values = self.decode_cursor(request)
+
+        order = [self._invert(field) for field in self.ordering] if reverse else list(self.ordering)
+        queryset = queryset.order_by(*order)
+        if values is not None:
+            queryset = queryset.filter(self._after(order, values))
+
+        results = list(queryset[:self.page_size + 1])
+        has_more = len(results) > self.page_size
+        results = results[:self.page_size]
+        if reverse:
+            results.reverse()
+
+        # Navegando para trás, "mais resultados" fica antes; o que existe depois é de onde viemos
+        has_next, has_previous = (values is not None, has_more) if reverse else (has_more, values is not None)
+        self.next_position = self._position(results[-1]) if has_next and results else None
+        self.previous_position = self._position(results[0]) if has_previous and results else None
+        return results
+
+    def get_paginated_response(self, data):
+        return Response({
+            'next': self.get_next_link(),
+            'previous': self.get_previous_link(),
+            'results': data,
+        })
+
+    def get_paginated_response_schema(self, schema):
+        return {
+            'type': 'object',
+            'required': ['results'],
+            'properties': {
+                'next': {'type': 'string', 'nullable': True, 'format': 'uri'},
+                'previous': {'type': 'string', 'nullable': True, 'format': 'uri'},
+                'results': schema,
+            },
+        }
+
+    def get_page_size(self, request):
+        try:
+            size = int(request.query_params.get(self.page_size_query_param, self.page_size))
+        except (TypeError, ValueError):
+            return self.page_size
+        return max(1, min(size, self.max_page_size))
+
+    def get_next_link(self):
+        return self.encode_cursor(False, self.next_position) if self.next_position is not None else None
+
+    def get_previous_link(self):
+        return self.encode_cursor(True, self.previous_position) if self.previous_position is not None else None
+
+    def encode_cursor(self, reverse, position):
+        payload = json.dumps({'r': int(reverse), 'p': position}, separators=(',', ':'))
+        token = base64.urlsafe_b64encode(payload.encode()).decode()
+        return replace_query_param(self.base_url, self.cursor_query_param, token)
+
+    def decode_cursor(self, request):
+        token = request.query_params.get(self.cursor_query_param)
+        if not token:
+            return False, None
+        try:
+            payload = json.loads(base64.urlsafe_b64decode(parse.unquote(token).encode()))
+            position = payload['p']
+            if len(position) != len(self.ordering):
+                raise ValueError
+            values = [
+                self.model._meta.get_field(field.lstrip('-')).to_python(value)
+                for field, value in zip(self.ordering, position)
+            ]
+        except (TypeError, ValueError, KeyError, DjangoValidationError):
+            raise NotFound(self.invalid_cursor_message)
+        return bool(payload.get('r')), values
+
+    def _position(self, instance):
+        position = []
+        for field in self.ordering:
+            value = getattr(instance, self.model._meta.get_field(field.lstrip('-')).attname)
+            position.append(value.isoformat() if hasattr(value, 'isoformat') else str(value))
+        return position
+
+    @staticmethod
+    def _invert(field):
+        return field[1:] if field.startswith('-') else f'-{field}'
+
+    @staticmethod
+    def _after(order, values):
+        """(a, b, ...) estritamente depois de `values` na ordenação `order`, como um Q."""
+        condition = Q()
+        equal = Q()
+        for field, value in zip(order, values):
+            name = field.lstrip('-')
+            lookup = 'lt' if field.startswith('-') else 'gt'
+            condition |= equal & Q(**{f'{name}__{lookup}': value})
+            equal &= Q(**{name: value})
+        # Limite explícito no primeiro campo para o banco usar um range scan no índice
+        first = order[0]
+        bound = Q(**{f"{first.lstrip('-')}__{'lte' if first.startswith('-') else 'gte'}": values[0]})
+        return bound & condition
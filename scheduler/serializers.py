@@ -3,6 +3,49 @@
 from rest_framework import serializers
 from .models import Contact, Group, MessageTemplate, ScheduledMessage, MessageLog, EvolutionConfig
 
+def _query_list(request, name):
+    """Lista separada por vírgulas de um parâmetro da query string, ou None se ausente."""
+    value = request.query_params.get(name) if request is not None else None
+    if value is None:
+        return None
+    return {item.strip() for item in value.split(',') if item.strip()}
+
+
+def expanded_relations(request, expandable):
+    """
+    Relações a serializar aninhadas: as de ?expand= (vazio = nenhuma) ou,
+    sem o parâmetro, todas de `expandable`.
+    """
+    requested = _query_list(request, 'expand')
+    if requested is None:
+        return set(expandable)
+    return requested & set(expandable)
+
+
+class SparseFieldsMixin:
+    """
+    Sparse fieldsets nas leituras: ?fields=a,b devolve só esses campos e ?expand=x,y
+    aninha só essas relações (as demais de `expandable_fields` vêm apenas com o ID).
+    """
+    expandable_fields = ()
+
+    def get_fields(self):
+        fields = super().get_fields()
+        request = self.context.get('request')
+        if request is None or request.method not in ('GET', 'HEAD', 'OPTIONS'):
+            return fields
+
+        expanded = expanded_relations(request, self.expandable_fields)
+        for name in self.expandable_fields:
+            if name in fields and name not in expanded:
+                fields[name] = serializers.PrimaryKeyRelatedField(read_only=True)
+
+        requested = _query_list(request, 'fields')
+        if requested:
+            fields = {name: field for name, field in fields.items() if name in requested}
+        return fields
+
+
 class ContactSerializer(serializers.ModelSerializer):
     class Meta:
         model = Contact
@@ -18,8 +61,9 @@ class MessageTemplateSerializer(serializers.ModelSerializer):
         model = MessageTemplate
         fields = '__all__'
 
-class ScheduledMessageSerializer(serializers.ModelSerializer):
+class ScheduledMessageSerializer(SparseFieldsMixin, serializers.ModelSerializer):
     # Usar serializers aninhados para mostrar os detalhes, não apenas o ID.
+    expandable_fields = ('contact', 'group', 'message_template')
     contact = ContactSerializer(read_only=True)
     group = GroupSerializer(read_only=True)
     message_template = MessageTemplateSerializer(read_only=True)
@@ -34,12 +78,22 @@ class ScheduledMessageSerializer(serializers.ModelSerializer):
         fields = [
             'id', 'title', 'message_template', 'recipient_type', 'contact', 'group',
             'frequency', 'start_date', 'end_date', 'day_of_week', 'day_of_month',
-            'status', 'last_sent', 'next_execution', 'created_at', 'updated_at',
+            'status', 'priority', 'last_sent', 'next_execution', 'created_at', 'updated_at', 'template_variables',
             # Campos de escrita
             'contact_id', 'group_id', 'message_template_id'
         ]
         read_only_fields = ('id', 'created_at', 'updated_at', 'last_sent', 'next_execution')
 
+    def validate_template_variables(self, value):
+        if not isinstance(value, dict):
+            raise serializers.ValidationError('Deve ser um objeto {variável: valor}.')
+        for key, item in value.items():
+            if not key.isidentifier():
+                raise serializers.ValidationError(f"Nome de variável inválido: '{key}'.")
+            if not isinstance(item, (str, int, float, bool)) and item is not None:
+                raise serializers.ValidationError(f"O valor de '{key}' deve ser texto ou número.")
+        return value
+
     def create(self, validated_data):
         # Lógica para associar os IDs recebidos aos campos de ForeignKey
         validated_data['contact_id'] = validated_data.pop('contact_id', None)
@@ -0,0 +1,126 @@
+# scheduler/services/async_sender.py
+import asyncio
+import logging
+import time
+from typing import Dict, Any, List, Tuple
+
+import httpx
+from django.conf import settings
+
+from .metrics import observe_evolution_request
+from .rate_limiter import rate_limiter as default_rate_limiter
+
+logger = logging.getLogger(__name__)
+
+
+class AsyncEvolutionSender:
+    """
+    Motor de envio assíncrono dos lotes do dispatcher: envia para vários destinatários
+    ao mesmo tempo, limitado por um semáforo. Os resultados seguem o mesmo formato de
+    EvolutionAPIService._make_request ({'success', 'data'|'error', 'status_code'}).
+    """
+
+    def __init__(self, base_url: str = None, api_key: str = None, instance_name: str = None,
+                 concurrency: int = None, rate_limiter=None):
+        self.base_url = base_url or settings.EVOLUTION_API_BASE_URL
+        self.api_key = api_key or settings.EVOLUTION_API_KEY
+        self.instance_name = instance_name or settings.EVOLUTION_INSTANCE_NAME
+        self.concurrency = concurrency or settings.EVOLUTION_ASYNC_CONCURRENCY
+        self.rate_limiter = rate_limiter or default_rate_limiter
+
+    def _build_client(self) -> httpx.AsyncClient:
+        timeout = httpx.Timeout(settings.EVOLUTION_HTTP_READ_TIMEOUT, connect=settings.EVOLUTION_HTTP_CONNECT_TIMEOUT)
+        limits = httpx.Limits(max_connections=self.concurrency, max_keepalive_connections=self.concurrency)
+        # retries do transporte só repetem falhas de conexão, nunca um envio já entregue à API
+        transport = httpx.AsyncHTTPTransport(retries=settings.EVOLUTION_HTTP_MAX_RETRIES, limits=limits)
+        return httpx.AsyncClient(
+            base_url=self.base_url,
+            headers={'apikey': self.api_key},
+            timeout=timeout,
+            transport=transport,
+        )
+
+    async def _post(self, client: httpx.AsyncClient, endpoint: str, json: Dict = None,
+                    data: Dict = None, files: Dict = None) -> Dict[str, Any]:
+        started = time.perf_counter()
+        try:
+            response = await client.post(f"/{endpoint}", json=json, data=data, files=files)
+            observe_evolution_request(endpoint, self.instance_name, time.perf_counter() - started, response.status_code)
+            response.raise_for_status()
+            return {
+                'success': True,
+                'data': response.json() if response.content else {},
+                'status_code': response.status_code
+            }
+        except httpx.HTTPStatusError as e:
+            logger.error(f"Evolution API Error: {str(e)}")
+            return {'success': False, 'error': str(e), 'status_code': e.response.status_code}
+        except httpx.HTTPError as e:
+            logger.error(f"Evolution API Error: {str(e)}")
+            observe_evolution_request(endpoint, self.instance_name, time.perf_counter() - started, 'error')
+            return {
+                'success': False,
+                'error': str(e),
+                'status_code': 500,
+                'connection_error': isinstance(e, httpx.TransportError),
+            }
+
+    async def send_text(self, client: httpx.AsyncClient, number: str, message: str) -> Dict[str, Any]:
+        """Envia mensagem de texto"""
+        endpoint = f"message/sendText/{self.instance_name}"
+        return await self._post(client, endpoint, json={"number": number, "text": message})
+
+    async def send_media(self, client: httpx.AsyncClient, number: str, caption: str,
+                         media_payload: Dict[str, Any]) -> Dict[str, Any]:
+        """Envia mídia já preparada pelo media_cache (o arquivo é lido/codificado uma única vez)"""
+        endpoint = f"message/sendMedia/{self.instance_name}"
+        data = {
+            'number': number,
+            'caption': caption if media_payload['mediatype'] != 'audio' else '',
+            **media_payload
+        }
+        return await self._post(client, endpoint, json=data)
+
+    async def _send_job(self, client: httpx.AsyncClient, semaphore: asyncio.Semaphore, job: Dict) -> Dict[str, Any]:
+        try:
+            # O token é aguardado antes de ocupar uma vaga: um envio limitado não segura os demais
+            await self.rate_limiter.acquire_async(self.instance_name, job['number'])
+            async with semaphore:
+                if job.get('media') is not None:
+                    return await self.send_media(client, job['number'], job.get('text', ''), job['media'])
+                return await self.send_text(client, job['number'], job['text'])
+        except Exception as e:
+            logger.error(f"Unexpected error sending to {job.get('number')}: {e}", exc_info=True)
+            return {'success': False, 'error': str(e), 'status_code': 500}
+
+    async def send_many(self, jobs: List[Dict]) -> List[Dict[str, Any]]:
+        """
+        Envia todos os jobs concorrentemente e devolve os resultados na mesma ordem.
+
+        Cada job é um dict com 'number' e 'text' e, para mídia, 'media' com o
+        payload preparado pelo media_cache.
+        """
+        semaphore = asyncio.Semaphore(self.concurrency)
+        async with self._build_client() as client:
+            return await asyncio.gather(*(self._send_job(client, semaphore, job) for job in jobs))
+
+
+def _run_sync(coro):
+    try:
+        asyncio.get_running_loop()
+    except RuntimeError:
+        return asyncio.run(coro)
+    coro.close()
+    raise RuntimeError("O motor assíncrono não pode ser dirigido de dentro de um event loop em execução; use send_many().")
+
+
+async def _send_batches(batches: List[Tuple[AsyncEvolutionSender, List[Dict]]]) -> List[List[Dict[str, Any]]]:
+    return await asyncio.gather(*(sender.send_many(jobs) for sender, jobs in batches))
+
+
+def run_routed_fanout(batches: List[Tuple[AsyncEvolutionSender, List[Dict]]]) -> List[List[Dict[str, Any]]]:
+    """
+    Executa vários lotes (um por instância Evolution) ao mesmo tempo.
+    Devolve a lista de resultados de cada lote, na mesma ordem dos lotes.
+    """
+    return _run_sync(_send_batches(batches))
@@ -0,0 +1,178 @@
+# scheduler/services/beat_sync.py
+"""
+Sincronização dos agendamentos com as PeriodicTasks do django-celery-beat.
+
+O signal de ScheduledMessage cuida de um agendamento por vez; as funções daqui
+fazem o mesmo para um conjunto inteiro com poucas consultas (bulk_create/bulk_update),
+para uso nas operações em massa, que não disparam signals.
+"""
+import json
+import threading
+from contextlib import contextmanager
+from functools import reduce
+from operator import or_
+from typing import Dict, Iterable, List, Optional, Tuple
+
+from django.conf import settings
+from django.db.models import Q
+from django.utils import timezone
+from django_celery_beat.models import PeriodicTask, PeriodicTasks, CrontabSchedule, ClockedSchedule
+
+from .send_routing import schedule_routes, send_route
+
+TASK_NAME_PREFIX = 'whatsapp-schedule-'
+CRONTAB_FIELDS = ('minute', 'hour', 'day_of_week', 'day_of_month', 'month_of_year')
+SCHEDULE_FIELDS = ('interval', 'crontab', 'solar', 'clocked')
+TASK_UPDATE_FIELDS = ['task', 'kwargs', 'args', 'enabled', 'one_off', *SCHEDULE_FIELDS]
+LOOKUP_CHUNK_SIZE = 200
+# Campos do agendamento usados por schedule_spec/task_fields (para .only() nas sincronizações em lote)
+SYNC_FIELDS = ('id', 'status', 'frequency', 'start_date', 'day_of_week', 'day_of_month',
+               'priority', 'message_template_id')
+
+_state = threading.local()
+
+
+def task_name(schedule_id) -> str:
+    return f'{TASK_NAME_PREFIX}{schedule_id}'
+
+
+@contextmanager
+def suppress_schedule_signals():
+    """Desliga os handlers por instância de ScheduledMessage na thread atual (operações em massa)."""
+    previous = getattr(_state, 'suppressed', False)
+    _state.suppressed = True
+    try:
+        yield
+    finally:
+        _state.suppressed = previous
+
+
+def signals_suppressed() -> bool:
+    return getattr(_state, 'suppressed', False)
+
+
+def schedule_spec(instance) -> Tuple[Optional[str], Optional[Dict]]:
+    """
+    Tipo ('clocked'/'crontab') e campos do schedule do beat para um agendamento,
+    ou (None, None) se a frequência não tiver os dados necessários.
+    """
+    if instance.frequency == 'once':
+        return 'clocked', {'clocked_time': instance.start_date}
+
+    # O crontab roda no CELERY_TIMEZONE: usa o horário local, e não o fuso em que a data
+    # veio (UTC quando lida do banco, local quando vem do serializer)
+    start = timezone.localtime(instance.start_date)
+    crontab = {'minute': str(start.minute), 'hour': str(start.hour),
+               'day_of_week': '*', 'day_of_month': '*', 'month_of_year': '*'}
+    if instance.frequency == 'daily':
+        return 'crontab', crontab
+    if instance.frequency == 'weekly' and instance.day_of_week is not None:
+        return 'crontab', {**crontab, 'day_of_week': str(instance.day_of_week)}
+    if instance.frequency == 'monthly' and instance.day_of_month is not None:
+        return 'crontab', {**crontab, 'day_of_month': str(instance.day_of_month)}
+    if instance.frequency == 'yearly':
+        return 'crontab', {**crontab, 'day_of_month': str(start.day), 'month_of_year': str(start.month)}
+    return None, None
+
+
+def task_fields(instance, schedule_type: str, schedule, route: str = None) -> Dict:
+    """Campos da PeriodicTask de um agendamento ativo (a rota vai nos kwargs, para o roteador do Celery)."""
+    if route is None:
+        route = send_route(instance.priority, instance.message_template.media_type)
+    fields = {
+        'task': 'scheduler.tasks.process_scheduled_message',
+        'kwargs': json.dumps({'schedule_id': str(instance.id), 'route': route}),
+        'args': '[]',
+        'enabled': True,
+        'one_off': instance.frequency == 'once',
+        # Limpa os campos de agendamento antes de definir o correto
+        **{field: None for field in SCHEDULE_FIELDS},
+    }
+    fields[schedule_type] = schedule
+    return fields
+
+
+def _get_or_create_many(model, lookups: Iterable[Dict], fields: Tuple[str, ...]) -> Dict[Tuple, object]:
+    """get_or_create em lote: devolve {chave: schedule}, criando de uma vez os que faltam."""
+    wanted = {tuple(lookup[field] for field in fields): lookup for lookup in lookups}
+
+    def fetch(keys):
+        found = {}
+        keys = list(keys)
+        for start in range(0, len(keys), LOOKUP_CHUNK_SIZE):
+            condition = reduce(or_, (Q(**wanted[key]) for key in keys[start:start + LOOKUP_CHUNK_SIZE]))
+            for schedule in model.objects.filter(condition):
+                found.setdefault(tuple(getattr(schedule, field) for field in fields), schedule)
+        return found
+
+    if not wanted:
+        return {}
+    found = fetch(wanted)
+    missing = [key for key in wanted if key not in found]
+    if missing:
+        model.objects.bulk_create([model(**wanted[key]) for key in missing])
+        # No MySQL o bulk_create não devolve as PKs: relê os recém-criados
+        found.update(fetch(missing))
+    return found
+
+
+def sync_periodic_tasks(schedules: List) -> None:
+    """
+    Equivalente em lote do signal create_or_update_periodic_task: cria/atualiza as
+    PeriodicTasks dos agendamentos ativos e desabilita as dos demais.
+    """
+    if settings.SCHEDULER_DISPATCH_MODE == 'dispatcher' or not schedules:
+        return
+
+    specs = {instance.id: schedule_spec(instance) if instance.status == 'active' else (None, None)
+             for instance in schedules}
+    crontabs = _get_or_create_many(
+        CrontabSchedule, [lookup for kind, lookup in specs.values() if kind == 'crontab'], CRONTAB_FIELDS
+    )
+    clocked = _get_or_create_many(
+        ClockedSchedule, [lookup for kind, lookup in specs.values() if kind == 'clocked'], ('clocked_time',)
+    )
+    existing = {
+        task.name: task
+        for task in PeriodicTask.objects.filter(name__in=[task_name(instance.id) for instance in schedules])
+    }
+    routes = schedule_routes(instance for instance in schedules if specs[instance.id][0] is not None)
+
+    to_create, to_update = [], []
+    for instance in schedules:
+        name = task_name(instance.id)
+        task = existing.get(name)
+        schedule_type, lookup = specs[instance.id]
+        if schedule_type is None:
+            if task is not None and task.enabled:
+                task.enabled = False
+                to_update.append(task)
+            continue
+
+        if schedule_type == 'crontab':
+            schedule = crontabs[tuple(lookup[field] for field in CRONTAB_FIELDS)]
+        else:
+            schedule = clocked[(lookup['clocked_time'],)]
+        fields = task_fields(instance, schedule_type, schedule, routes[instance.id])
+        if task is None:
+            to_create.append(PeriodicTask(name=name, **fields))
+            continue
+        for field, value in fields.items():
+            setattr(task, field, value)
+        to_update.append(task)
+
+    PeriodicTask.objects.bulk_create(to_create)
+    PeriodicTask.objects.bulk_update(to_update, TASK_UPDATE_FIELDS)
+    # bulk_create/bulk_update não passam por PeriodicTask.save: avisa o DatabaseScheduler
+    PeriodicTasks.update_changed()
+
+
+def delete_periodic_tasks(schedule_ids: Iterable) -> int:
+    """Remove as PeriodicTasks dos agendamentos informados e avisa o beat uma única vez."""
+    tasks = PeriodicTask.objects.filter(name__in=[task_name(schedule_id) for schedule_id in schedule_ids])
+    # QuerySet.delete() respeita os CASCADE e não chama PeriodicTask.delete(): o aviso ao
+    # DatabaseScheduler sai uma vez para o lote inteiro
+    deleted = tasks.delete()[0]
+    if deleted:
+        PeriodicTasks.update_changed()
+    return deleted
@@ -0,0 +1,161 @@
+# scheduler/services/bulk_schedules.py
+"""
+Operações em massa sobre agendamentos (criar, pausar/retomar, excluir).
+
+Cada operação grava os agendamentos e as PeriodicTasks correspondentes com
+consultas em conjunto, numa única transação, e devolve um resultado por item.
+"""
+import logging
+import uuid
+from typing import Any, Dict, Iterable, List, Optional, Sequence
+
+from django.db import transaction
+from django.db.models import Count, F
+from django.utils import timezone
+
+from ..models import Contact, Group, MessageLog, MessageTemplate, ScheduledMessage
+from ..serializers import ScheduledMessageSerializer
+from .beat_sync import SYNC_FIELDS, delete_periodic_tasks, suppress_schedule_signals, sync_periodic_tasks
+from .dashboard_counters import dashboard_counters
+from .number_validity import number_validity
+from .timeline import invalidate_timeline
+
+logger = logging.getLogger(__name__)
+
+FOREIGN_KEYS = (
+    ('message_template_id', MessageTemplate),
+    ('contact_id', Contact),
+    ('group_id', Group),
+)
+
+
+def _existing_ids(model, ids: Iterable) -> set:
+    ids = {value for value in ids if value}
+    if not ids:
+        return set()
+    return set(model.objects.filter(id__in=ids).values_list('id', flat=True))
+
+
+def _parse_ids(ids: Sequence, results: List[Dict]) -> List[uuid.UUID]:
+    """Converte os ids recebidos para UUID, registrando os inválidos em `results`."""
+    parsed = []
+    for value in ids:
+        try:
+            parsed.append(uuid.UUID(str(value)))
+        except ValueError:
+            results.append({'id': value, 'result': 'error', 'error': 'ID inválido.'})
+    return parsed
+
+
+def bulk_create_schedules(items: Sequence[Dict[str, Any]]) -> List[Dict[str, Any]]:
+    """Valida e cria vários agendamentos; itens inválidos são reportados e os demais criados."""
+    results: List[Optional[Dict]] = [None] * len(items)
+    valid = []
+    for index, item in enumerate(items):
+        serializer = ScheduledMessageSerializer(data=item)
+        if serializer.is_valid():
+            valid.append((index, serializer.validated_data))
+        else:
+            results[index] = {'index': index, 'result': 'error', 'errors': serializer.errors}
+
+    # Valida as chaves estrangeiras com uma consulta por modelo, em vez de uma por item
+    existing = {
+        field: _existing_ids(model, (data.get(field) for _, data in valid)) for field, model in FOREIGN_KEYS
+    }
+    schedules = []
+    for index, data in valid:
+        errors = {
+            field: ['Registro não encontrado.']
+            for field, _ in FOREIGN_KEYS
+            if data.get(field) and data[field] not in existing[field]
+        }
+        if errors:
+            results[index] = {'index': index, 'result': 'error', 'errors': errors}
+            continue
+        schedule = ScheduledMessage(**data)
+        # Mesma regra de ScheduledMessage.save(), que o bulk_create não chama
+        schedule.next_execution = schedule.start_date if schedule.status == 'active' else None
+        schedules.append(schedule)
+        results[index] = {'index': index, 'result': 'created', 'id': str(schedule.id)}
+
+    if schedules:
+        with transaction.atomic():
+            ScheduledMessage.objects.bulk_create(schedules)
+            sync_periodic_tasks(schedules)
+            dashboard_counters.transitions('schedule', [(None, schedule.status) for schedule in schedules])
+            contact_ids = {schedule.contact_id for schedule in schedules if schedule.contact_id}
+            if contact_ids:
+                number_validity.schedule_precheck(
+                    Contact.objects.filter(id__in=contact_ids).values_list('phone_number', flat=True)
+                )
+        invalidate_timeline()
+    logger.info(f"Bulk schedule create: {len(schedules)} created, {len(items) - len(schedules)} rejected")
+    return results
+
+
+def bulk_set_status(ids: Sequence, status: str, from_statuses: Optional[Sequence[str]] = None) -> List[Dict[str, Any]]:
+    """
+    Muda o status de vários agendamentos de uma vez e sincroniza as PeriodicTasks.
+    Com `from_statuses`, só altera os que estão em um desses status (os demais são 'skipped').
+    """
+    results: List[Dict] = []
+    parsed = _parse_ids(ids, results)
+
+    with transaction.atomic():
+        current = dict(
+            ScheduledMessage.objects.select_for_update().filter(id__in=parsed).values_list('id', 'status')
+        )
+        changing = []
+        for schedule_id in parsed:
+            previous = current.get(schedule_id)
+            if previous is None:
+                results.append({'id': str(schedule_id), 'result': 'not_found'})
+            elif previous == status or (from_statuses and previous not in from_statuses):
+                results.append({'id': str(schedule_id), 'result': 'skipped', 'status': previous})
+            else:
+                changing.append(schedule_id)
+                results.append({'id': str(schedule_id), 'result': 'updated', 'status': status})
+
+        if changing:
+            ScheduledMessage.objects.filter(id__in=changing).update(status=status, updated_at=timezone.now())
+            if status == 'active':
+                # Como em save(): um agendamento ativo sem próxima execução parte de start_date
+                ScheduledMessage.objects.filter(id__in=changing, next_execution__isnull=True).update(
+                    next_execution=F('start_date')
+                )
+            sync_periodic_tasks(list(ScheduledMessage.objects.filter(id__in=changing).only(*SYNC_FIELDS)))
+            dashboard_counters.transitions('schedule', [(current[schedule_id], status) for schedule_id in changing])
+
+    if changing:
+        invalidate_timeline()
+    logger.info(f"Bulk schedule status '{status}': {len(changing)} of {len(ids)} updated")
+    return results
+
+
+def bulk_delete_schedules(ids: Sequence) -> List[Dict[str, Any]]:
+    """Exclui vários agendamentos e suas PeriodicTasks."""
+    results: List[Dict] = []
+    parsed = _parse_ids(ids, results)
+
+    with transaction.atomic():
+        statuses = dict(ScheduledMessage.objects.filter(id__in=parsed).values_list('id', 'status'))
+        found = set(statuses)
+        if found:
+            # Logs removidos pelo CASCADE, para descontar dos contadores do dashboard
+            log_counts = dict(
+                MessageLog.objects.filter(scheduled_message_id__in=found).order_by()
+                .values_list('status').annotate(count=Count('id'))
+            )
+            # Os handlers por instância fariam um DELETE de PeriodicTask para cada agendamento
+            with suppress_schedule_signals():
+                ScheduledMessage.objects.filter(id__in=found).delete()
+            delete_periodic_tasks(found)
+            dashboard_counters.transitions('schedule', [(status, None) for status in statuses.values()])
+            dashboard_counters.removed('log', log_counts)
+    for schedule_id in parsed:
+        results.append({'id': str(schedule_id), 'result': 'deleted' if schedule_id in found else 'not_found'})
+
+    if found:
+        invalidate_timeline()
+    logger.info(f"Bulk schedule delete: {len(found)} of {len(ids)} deleted")
+    return results
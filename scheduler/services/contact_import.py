@@ -0,0 +1,158 @@
+# scheduler/services/contact_import.py
+import codecs
+import csv
+import json
+import logging
+from typing import Any, Dict, Iterable, Iterator, List, Tuple
+
+from django.conf import settings
+from django.db import connection, transaction
+
+from ..models import Contact
+from ..utils.scheduler_utils import format_phone_number
+from .number_validity import number_validity
+
+logger = logging.getLogger(__name__)
+
+FORMATS = ('csv', 'jsonl')
+TRUE_VALUES = {'1', 'true', 't', 'yes', 'y', 'sim', 's'}
+FALSE_VALUES = {'0', 'false', 'f', 'no', 'n', 'nao', 'não'}
+NAME_MAX_LENGTH = Contact._meta.get_field('name').max_length
+PHONE_MAX_LENGTH = Contact._meta.get_field('phone_number').max_length
+
+
+class ContactImportError(ValueError):
+    """Erro de uma linha da importação (vira uma entrada do relatório)."""
+
+
+def detect_format(filename: str, default: str = 'csv') -> str:
+    """Deduz o formato pela extensão do arquivo (.csv, .jsonl/.ndjson)."""
+    name = (filename or '').lower()
+    if name.endswith(('.jsonl', '.ndjson')):
+        return 'jsonl'
+    if name.endswith('.csv'):
+        return 'csv'
+    return default
+
+
+def iter_rows(lines: Iterable[bytes], file_format: str) -> Iterator[Tuple[int, Any]]:
+    """
+    Lê a entrada linha a linha (sem carregá-la inteira) e gera (número da linha, registro).
+    Registros JSONL inválidos são gerados como ContactImportError para entrar no relatório.
+    """
+    text_lines = codecs.iterdecode(lines, 'utf-8-sig')
+    if file_format == 'csv':
+        reader = csv.DictReader(text_lines)
+        for record in reader:
+            yield reader.line_num, record
+        return
+
+    for line_number, line in enumerate(text_lines, start=1):
+        if not line.strip():
+            continue
+        try:
+            yield line_number, json.loads(line)
+        except ValueError as e:
+            yield line_number, ContactImportError(f'JSON inválido: {e}')
+
+
+def _parse_bool(value) -> bool:
+    if value is None or value == '':
+        return True
+    if isinstance(value, bool):
+        return value
+    text = str(value).strip().lower()
+    if text in TRUE_VALUES:
+        return True
+    if text in FALSE_VALUES:
+        return False
+    raise ContactImportError(f'is_active inválido: {value!r}')
+
+
+def parse_contact(record) -> Contact:
+    """Valida e normaliza um registro, devolvendo o Contact (ainda não salvo)."""
+    if isinstance(record, ContactImportError):
+        raise record
+    if not isinstance(record, dict):
+        raise ContactImportError('Registro deve ser um objeto com name e phone_number.')
+
+    name = str(record.get('name') or '').strip()
+    if not name:
+        raise ContactImportError('name é obrigatório.')
+    if len(name) > NAME_MAX_LENGTH:
+        raise ContactImportError(f'name excede {NAME_MAX_LENGTH} caracteres.')
+
+    phone_number = format_phone_number(str(record.get('phone_number') or ''))
+    if not 10 <= len(phone_number) <= PHONE_MAX_LENGTH:
+        raise ContactImportError(f'phone_number inválido: {record.get("phone_number")!r}')
+
+    return Contact(name=name, phone_number=phone_number, is_active=_parse_bool(record.get('is_active')))
+
+
+def _upsert(contacts: List[Contact]) -> int:
+    """Grava um lote com INSERT ... ON CONFLICT/ON DUPLICATE KEY UPDATE; devolve quantos eram novos."""
+    phones = [contact.phone_number for contact in contacts]
+    existing = set(Contact.objects.filter(phone_number__in=phones).values_list('phone_number', flat=True))
+    options = {}
+    # MySQL não aceita unique_fields: o ON DUPLICATE KEY UPDATE vale para qualquer chave única
+    if connection.features.supports_update_conflicts_with_target:
+        options['unique_fields'] = ['phone_number']
+    with transaction.atomic():
+        Contact.objects.bulk_create(
+            contacts, update_conflicts=True, update_fields=['name', 'is_active', 'updated_at'], **options
+        )
+    return len(contacts) - len(existing)
+
+
+def import_contacts(lines: Iterable[bytes], file_format: str = 'csv', chunk_size: int = None,
+                    max_errors: int = None) -> Dict[str, Any]:
+    """
+    Importa contatos de CSV (cabeçalho name,phone_number[,is_active]) ou JSONL em lotes
+    de `chunk_size`, fazendo upsert pelo phone_number normalizado.
+
+    Só um lote fica em memória por vez; o relatório guarda no máximo `max_errors`
+    erros por linha (o total continua sendo contado).
+    """
+    if file_format not in FORMATS:
+        raise ValueError(f"Formato não suportado: {file_format}. Use {', '.join(FORMATS)}.")
+    chunk_size = chunk_size or settings.CONTACT_IMPORT_CHUNK_SIZE
+    max_errors = max_errors if max_errors is not None else settings.CONTACT_IMPORT_MAX_ERRORS
+    report = {'processed': 0, 'created': 0, 'updated': 0, 'error_count': 0, 'errors': []}
+
+    def add_error(row, message):
+        report['error_count'] += 1
+        if len(report['errors']) < max_errors:
+            report['errors'].append({'row': row, 'error': message})
+
+    # Por telefone, para que números repetidos no mesmo lote não colidam no mesmo INSERT (vale o último)
+    chunk: Dict[str, Contact] = {}
+
+    def flush():
+        if not chunk:
+            return
+        contacts = list(chunk.values())
+        chunk.clear()
+        created = _upsert(contacts)
+        number_validity.schedule_precheck(contact.phone_number for contact in contacts)
+        report['created'] += created
+        report['updated'] += len(contacts) - created
+
+    for row, record in iter_rows(lines, file_format):
+        report['processed'] += 1
+        try:
+            contact = parse_contact(record)
+        except ContactImportError as e:
+            add_error(row, str(e))
+            continue
+        chunk.pop(contact.phone_number, None)
+        chunk[contact.phone_number] = contact
+        if len(chunk) >= chunk_size:
+            flush()
+    flush()
+
+    report['errors_truncated'] = report['error_count'] > len(report['errors'])
+    logger.info(
+        f"Contact import finished: {report['processed']} rows, {report['created']} created, "
+        f"{report['updated']} updated, {report['error_count']} errors"
+    )
+    return report
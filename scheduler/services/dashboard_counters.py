@@ -0,0 +1,148 @@
+# scheduler/services/dashboard_counters.py
+"""
+Contadores do dashboard mantidos de forma incremental no Redis.
+
+Um hash guarda a quantidade de agendamentos e de logs por status
+('schedule:<status>' / 'log:<status>'). Signals, o buffer de logs e as operações
+em massa aplicam deltas a cada mudança de status (após o commit da transação), e
+a task reconcile_dashboard_counters recalcula tudo a partir do banco de tempos em
+tempos. A leitura do dashboard vira um HGETALL; sem o hash (ou sem Redis) o
+cálculo volta a ser feito no banco.
+"""
+import logging
+from collections import Counter
+from typing import Dict, Iterable, Optional
+
+from django.db import transaction
+from django.db.models import Count
+from django.utils import timezone
+from redis.exceptions import RedisError
+
+from ..models import MessageLog, ScheduledMessage
+from .redis_client import get_redis
+
+logger = logging.getLogger(__name__)
+
+COUNTERS_KEY = 'dashboard:counters'
+RECONCILED_AT_FIELD = 'meta:reconciled_at'
+
+# Só incrementa se o hash já existir: sem uma base reconciliada, um HINCRBY
+# criaria contadores parciais que pareceriam totais válidos.
+_INCR_SCRIPT = """
+if redis.call('EXISTS', KEYS[1]) == 0 then
+    return 0
+end
+for i = 1, #ARGV, 2 do
+    redis.call('HINCRBY', KEYS[1], ARGV[i], ARGV[i + 1])
+end
+return 1
+"""
+
+
+def _field(kind: str, status: str) -> str:
+    return f'{kind}:{status}'
+
+
+class DashboardCounters:
+    """Contadores de status de ScheduledMessage e MessageLog no Redis."""
+
+    def __init__(self, client=None):
+        self._client = client
+
+    @property
+    def client(self):
+        return self._client or get_redis()
+
+    # --- deltas ---
+
+    def apply(self, deltas: Dict[str, int]):
+        """Aplica deltas {'log:sent': 3, ...} quando a transação atual for confirmada."""
+        deltas = {field: delta for field, delta in deltas.items() if delta}
+        if deltas:
+            transaction.on_commit(lambda: self._apply_now(deltas))
+
+    def _apply_now(self, deltas: Dict[str, int]):
+        args = []
+        for field, delta in deltas.items():
+            args.extend((field, delta))
+        try:
+            self.client.eval(_INCR_SCRIPT, 1, COUNTERS_KEY, *args)
+        except RedisError as e:
+            # A próxima reconciliação corrige a diferença
+            logger.warning(f"Failed to update dashboard counters: {e}")
+
+    def transition(self, kind: str, old: Optional[str], new: Optional[str], count: int = 1):
+        """Um (ou `count`) registro(s) de `kind` mudou de status `old` para `new` (None = criado/removido)."""
+        if old == new:
+            return
+        deltas = Counter()
+        if old:
+            deltas[_field(kind, old)] -= count
+        if new:
+            deltas[_field(kind, new)] += count
+        self.apply(deltas)
+
+    def transitions(self, kind: str, changes: Iterable):
+        """Versão em lote de transition: `changes` é uma sequência de pares (old, new)."""
+        deltas = Counter()
+        for old, new in changes:
+            if old == new:
+                continue
+            if old:
+                deltas[_field(kind, old)] -= 1
+            if new:
+                deltas[_field(kind, new)] += 1
+        self.apply(deltas)
+
+    def removed(self, kind: str, counts: Dict[str, int]):
+        """Desconta registros removidos, com as contagens por status."""
+        self.apply({_field(kind, status): -count for status, count in counts.items()})
+
+    # --- leitura e reconciliação ---
+
+    def compute(self) -> Dict[str, int]:
+        """Contagens por status direto do banco (fonte da verdade)."""
+        counts = {}
+        for kind, model in (('schedule', ScheduledMessage), ('log', MessageLog)):
+            for row in model.objects.order_by().values('status').annotate(count=Count('id')):
+                counts[_field(kind, row['status'])] = row['count']
+        return counts
+
+    def reconcile(self) -> Dict[str, int]:
+        """
+        Recalcula os contadores no banco e substitui o hash de uma vez. Deltas aplicados
+        durante o cálculo podem se perder; a reconciliação seguinte corrige.
+        """
+        counts = self.compute()
+        mapping = {**counts, RECONCILED_AT_FIELD: timezone.now().isoformat()}
+        pipe = self.client.pipeline(transaction=True)
+        pipe.delete(COUNTERS_KEY)
+        pipe.hset(COUNTERS_KEY, mapping=mapping)
+        pipe.execute()
+        return counts
+
+    def snapshot(self) -> Dict:
+        """Estatísticas no formato do dashboard, lidas do Redis (ou do banco, como fallback)."""
+        try:
+            raw = self.client.hgetall(COUNTERS_KEY)
+            counts = {field: int(value) for field, value in raw.items() if field != RECONCILED_AT_FIELD}
+            if not raw:
+                counts = self.reconcile()
+        except RedisError as e:
+            logger.warning(f"Dashboard counters unavailable, falling back to database: {e}")
+            counts = self.compute()
+
+        summary = {'schedule': {}, 'log': {}}
+        for field, value in counts.items():
+            kind, status = field.split(':', 1)
+            if value > 0 and kind in summary:
+                summary[kind][status] = value
+        return {
+            'schedule_summary': summary['schedule'],
+            'log_summary': summary['log'],
+            'total_schedules': sum(summary['schedule'].values()),
+            'total_logs': sum(summary['log'].values()),
+        }
+
+
+dashboard_counters = DashboardCounters()
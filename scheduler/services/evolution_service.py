@@ -2,32 +2,49 @@
 import requests
 import logging
 from django.conf import settings
-from typing import Dict, Any, Optional
+from typing import Dict, Any, List, Optional
 import os
+import time
+from .http_session import get_session, get_timeout
+from .metrics import observe_evolution_request
 
 logger = logging.getLogger(__name__)
 
 class EvolutionAPIService:
-    def __init__(self):
-        self.base_url = settings.EVOLUTION_API_BASE_URL
-        self.api_key = settings.EVOLUTION_API_KEY
-        self.instance_name = settings.EVOLUTION_INSTANCE_NAME
+    def __init__(self, config=None):
+        """
+        Sem `config` usa a instância definida nas settings; com um EvolutionConfig
+        usa a URL, chave e nome de instância cadastrados nele.
+        """
+        if config is not None:
+            self.base_url = config.base_url.rstrip('/')
+            self.api_key = config.api_key
+            self.instance_name = config.instance_name
+        else:
+            self.base_url = settings.EVOLUTION_API_BASE_URL
+            self.api_key = settings.EVOLUTION_API_KEY
+            self.instance_name = settings.EVOLUTION_INSTANCE_NAME
         self.headers = {
             'Content-Type': 'application/json',
             'apikey': self.api_key
         }
 
-    def _make_request(self, method: str, endpoint: str, data: Dict = None, files: Dict = None) -> Dict[str, Any]:
-        """Faz requisição para a API Evolution"""
+    def _make_request(self, method: str, endpoint: str, data: Dict = None, files: Dict = None,
+                      timeout=None) -> Dict[str, Any]:
+        """Faz requisição para a API Evolution usando a sessão HTTP compartilhada do processo"""
         url = f"{self.base_url}/{endpoint}"
+        session = get_session()
+        timeout = timeout or get_timeout()
+        started = time.perf_counter()
         
         try:
             if files:
                 # Remove Content-Type header para upload de arquivos
                 headers = {'apikey': self.api_key}
-                response = requests.request(method, url, headers=headers, data=data, files=files)
+                response = session.request(method, url, headers=headers, data=data, files=files, timeout=timeout)
             else:
-                response = requests.request(method, url, headers=self.headers, json=data)
+                response = session.request(method, url, headers=self.headers, json=data, timeout=timeout)
+            observe_evolution_request(endpoint, self.instance_name, time.perf_counter() - started, response.status_code)
             
             response.raise_for_status()
             return {
@@ -37,10 +54,15 @@ class EvolutionAPIService:
             }
         except requests.exceptions.RequestException as e:
             logger.error(f"Evolution API Error: {str(e)}")
+            if getattr(e, 'response', None) is None:
+                # Sem resposta (conexão/timeout): a latência observada é a da falha
+                observe_evolution_request(endpoint, self.instance_name, time.perf_counter() - started, 'error')
             return {
                 'success': False,
                 'error': str(e),
-                'status_code': getattr(e.response, 'status_code', 500) if hasattr(e, 'response') else 500
+                'status_code': getattr(e.response, 'status_code', 500) if hasattr(e, 'response') else 500,
+                # A API não respondeu: falha da instância/servidor, não do destinatário
+                'connection_error': isinstance(e, (requests.exceptions.ConnectionError, requests.exceptions.Timeout)),
             }
 
     def check_instance_status(self) -> Dict[str, Any]:
@@ -85,6 +107,16 @@ class EvolutionAPIService:
                 'status_code': 404
             }
 
+    def send_prepared_media(self, number: str, caption: str, media_payload: Dict[str, Any]) -> Dict[str, Any]:
+        """Envia mídia já preparada pelo media_cache (base64), sem reabrir o arquivo"""
+        endpoint = f"message/sendMedia/{self.instance_name}"
+        data = {
+            'number': number,
+            'caption': caption if media_payload['mediatype'] != 'audio' else '',
+            **media_payload
+        }
+        return self._make_request('POST', endpoint, data)
+
     def send_group_text_message(self, group_id: str, message: str) -> Dict[str, Any]:
         """Envia mensagem de texto para grupo"""
         endpoint = f"message/sendText/{self.instance_name}"
@@ -127,10 +159,16 @@ class EvolutionAPIService:
         data = {"number": number}
         return self._make_request('POST', endpoint, data)
 
-    def fetch_groups(self) -> Dict[str, Any]:
-        """Lista todos os grupos"""
-        endpoint = f"group/fetchAllGroups/{self.instance_name}"
-        return self._make_request('GET', endpoint)
+    def check_whatsapp_numbers(self, numbers: List[str]) -> Dict[str, Any]:
+        """Verifica em lote quais números existem no WhatsApp ([{'number', 'jid', 'exists'}, ...])"""
+        endpoint = f"chat/whatsappNumbers/{self.instance_name}"
+        data = {"numbers": numbers}
+        return self._make_request('POST', endpoint, data)
+
+    def fetch_groups(self, timeout=None) -> Dict[str, Any]:
+        """Lista todos os grupos (sem os participantes, que tornariam a resposta enorme)"""
+        endpoint = f"group/fetchAllGroups/{self.instance_name}?getParticipants=false"
+        return self._make_request('GET', endpoint, timeout=timeout)
 
 # Instância global do serviço
 evolution_service = EvolutionAPIService()
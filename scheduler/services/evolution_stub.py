@@ -0,0 +1,211 @@
+# scheduler/services/evolution_stub.py
+"""
+Servidor HTTP local que imita a Evolution API, para medir o pipeline de envio sem
+um número de WhatsApp real (comando evolution_stub e load_test_send).
+
+Rotas imitadas: message/sendText, message/sendMedia, instance/connectionState,
+group/fetchAllGroups e chat/whatsappNumbers. Latência, taxa de erro e limite de
+requisições por segundo (respondido com 429 + Retry-After, como a API atrás de um
+proxy) são configuráveis e podem ser alterados com o servidor no ar.
+"""
+import json
+import logging
+import random
+import threading
+import time
+import uuid
+from collections import Counter
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Any, Dict, Optional, Tuple
+from urllib.parse import urlsplit
+
+logger = logging.getLogger(__name__)
+
+
+class StubHTTPServer(ThreadingHTTPServer):
+    daemon_threads = True
+    # O backlog padrão (5) derruba conexões com muitos workers simultâneos
+    request_queue_size = 128
+
+
+class _StubHandler(BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'
+    # Cabeçalhos e corpo saem em writes separados: sem isso o Nagle soma ~40 ms por resposta
+    disable_nagle_algorithm = True
+
+    def do_GET(self):
+        self.server.stub.handle(self)
+
+    def do_POST(self):
+        self.server.stub.handle(self)
+
+    def log_message(self, format, *args):
+        logger.debug(f"Evolution stub: {format % args}")
+
+
+class EvolutionStubServer:
+    """
+    Evolution API falsa em uma thread. `latency` e `jitter` em segundos; `error_rate`
+    é a fração de envios respondidos com 500; `rate_limit` é o máximo de requisições
+    por segundo por instância (0 = sem limite).
+    """
+
+    def __init__(self, host: str = '127.0.0.1', port: int = 0, latency: float = 0.0, jitter: float = 0.0,
+                 error_rate: float = 0.0, rate_limit: float = 0.0, groups: int = 50, seed: Optional[int] = None):
+        self.host = host
+        self.port = port
+        self.latency = latency
+        self.jitter = jitter
+        self.error_rate = error_rate
+        self.rate_limit = rate_limit
+        self.groups = groups
+        self._random = random.Random(seed)
+        self._lock = threading.Lock()
+        self._windows: Dict[str, Tuple[int, int]] = {}
+        self._stats = Counter()
+        self._server = None
+        self._thread = None
+
+    @property
+    def base_url(self) -> str:
+        host, port = self._server.server_address[:2] if self._server else (self.host, self.port)
+        return f"http://{host}:{port}"
+
+    def _bind(self):
+        self._server = StubHTTPServer((self.host, self.port), _StubHandler)
+        self._server.stub = self
+
+    def start(self) -> 'EvolutionStubServer':
+        self._bind()
+        self._thread = threading.Thread(target=self._server.serve_forever, name='evolution-stub', daemon=True)
+        self._thread.start()
+        return self
+
+    def serve_forever(self):
+        """Roda em primeiro plano (comando evolution_stub)."""
+        self._bind()
+        self._server.serve_forever()
+
+    def stop(self):
+        if self._server is not None:
+            self._server.shutdown()
+            self._server.server_close()
+            self._server = None
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, *exc_info):
+        self.stop()
+
+    def stats(self) -> Dict[str, int]:
+        with self._lock:
+            return dict(self._stats)
+
+    def reset_stats(self):
+        with self._lock:
+            self._stats.clear()
+
+    # --- requisições ---
+
+    def _count(self, *keys: str):
+        with self._lock:
+            self._stats.update(keys)
+
+    def _throttled(self, instance_name: str) -> bool:
+        """Janela fixa de um segundo por instância."""
+        if self.rate_limit <= 0:
+            return False
+        second = int(time.monotonic())
+        with self._lock:
+            window, count = self._windows.get(instance_name, (second, 0))
+            if window != second:
+                window, count = second, 0
+            self._windows[instance_name] = (window, count + 1)
+            return count >= self.rate_limit
+
+    def _delay(self):
+        delay = self.latency + (self._random.uniform(0, self.jitter) if self.jitter else 0)
+        if delay > 0:
+            time.sleep(delay)
+
+    def handle(self, request: BaseHTTPRequestHandler):
+        length = int(request.headers.get('Content-Length') or 0)
+        raw = request.rfile.read(length) if length else b''
+        try:
+            body = json.loads(raw) if raw else {}
+        except ValueError:
+            body = {}
+
+        parts = urlsplit(request.path).path.strip('/').split('/')
+        route = '/'.join(parts[:2])
+        instance_name = parts[2] if len(parts) > 2 else ''
+        handler = self.ROUTES.get((request.command, route))
+        if handler is None or not instance_name:
+            self._count('requests', 'not_found')
+            return self._respond(request, 404, {'status': 404, 'error': 'Not Found', 'response': {'message': [route]}})
+
+        self._count('requests', route)
+        if self._throttled(instance_name):
+            self._count('throttled')
+            return self._respond(request, 429, {'status': 429, 'error': 'Too Many Requests'}, {'Retry-After': '1'})
+        self._delay()
+        if route.startswith('message/') and self.error_rate and self._random.random() < self.error_rate:
+            self._count('errors')
+            return self._respond(request, 500, {'status': 500, 'error': 'Internal Server Error',
+                                                'response': {'message': 'Stub: erro simulado'}})
+        status, payload = handler(self, instance_name, body)
+        return self._respond(request, status, payload)
+
+    @staticmethod
+    def _respond(request, status: int, payload: Any, headers: Optional[Dict[str, str]] = None):
+        encoded = json.dumps(payload).encode()
+        request.send_response(status)
+        request.send_header('Content-Type', 'application/json')
+        request.send_header('Content-Length', str(len(encoded)))
+        for name, value in (headers or {}).items():
+            request.send_header(name, value)
+        request.end_headers()
+        request.wfile.write(encoded)
+
+    # --- rotas ---
+
+    def _message(self, number: str, message: Dict[str, Any]) -> Tuple[int, Dict]:
+        self._count('sent')
+        remote_jid = number if '@' in str(number) else f"{number}@s.whatsapp.net"
+        return 201, {
+            'key': {'remoteJid': remote_jid, 'fromMe': True, 'id': uuid.uuid4().hex[:20].upper()},
+            'message': message,
+            'messageTimestamp': int(time.time()),
+            'status': 'PENDING',
+        }
+
+    def _send_text(self, instance_name, body):
+        return self._message(body.get('number', ''), {'conversation': body.get('text', '')})
+
+    def _send_media(self, instance_name, body):
+        media_type = body.get('mediatype') or body.get('mediaType') or 'image'
+        return self._message(body.get('number', ''), {f'{media_type}Message': {'caption': body.get('caption', '')}})
+
+    def _connection_state(self, instance_name, body):
+        return 200, {'instance': {'instanceName': instance_name, 'state': 'open'}}
+
+    def _fetch_groups(self, instance_name, body):
+        return 200, [
+            {'id': f'1203630000{index:08d}@g.us', 'subject': f'Grupo {index}', 'size': 10, 'desc': None}
+            for index in range(self.groups)
+        ]
+
+    def _whatsapp_numbers(self, instance_name, body):
+        return 200, [
+            {'exists': True, 'jid': f"{number}@s.whatsapp.net", 'number': number}
+            for number in body.get('numbers') or []
+        ]
+
+    ROUTES = {
+        ('POST', 'message/sendText'): _send_text,
+        ('POST', 'message/sendMedia'): _send_media,
+        ('GET', 'instance/connectionState'): _connection_state,
+        ('GET', 'group/fetchAllGroups'): _fetch_groups,
+        ('POST', 'chat/whatsappNumbers'): _whatsapp_numbers,
+    }
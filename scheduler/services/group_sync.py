@@ -0,0 +1,137 @@
+# scheduler/services/group_sync.py
+"""
+Sincronização dos grupos do WhatsApp (fetchAllGroups de cada instância) com Group.
+
+As listas de todas as instâncias são comparadas em memória com os grupos já
+cadastrados (uma consulta) e só as diferenças são gravadas: um bulk_create para
+os novos, um bulk_update para renomeados/reativados e um UPDATE para os que saíram
+de todas as instâncias. O hash da lista de cada instância fica em
+GroupSyncCheckpoint; se nenhuma mudou desde a última sincronização, a tabela de
+grupos nem é lida.
+"""
+import hashlib
+import json
+import logging
+from typing import Any, Dict, Optional, Tuple
+
+from django.conf import settings
+from django.db import transaction
+from django.utils import timezone
+
+from ..models import EvolutionConfig, Group, GroupSyncCheckpoint
+from ..utils.scheduler_utils import format_group_id
+from .evolution_service import EvolutionAPIService
+from .instance_router import instance_router
+
+logger = logging.getLogger(__name__)
+
+NAME_MAX_LENGTH = Group._meta.get_field('name').max_length
+GROUP_ID_MAX_LENGTH = Group._meta.get_field('group_id').max_length
+
+
+def parse_groups(payload: Any) -> Dict[str, Tuple[str, Optional[str]]]:
+    """{group_id: (nome, descrição)} a partir da resposta do fetchAllGroups."""
+    groups = {}
+    for item in payload if isinstance(payload, list) else []:
+        if not isinstance(item, dict) or not item.get('id'):
+            continue
+        group_id = format_group_id(str(item['id']))
+        if len(group_id) > GROUP_ID_MAX_LENGTH:
+            continue
+        name = (item.get('subject') or group_id)[:NAME_MAX_LENGTH]
+        groups[group_id] = (name, item.get('desc') or None)
+    return groups
+
+
+def payload_hash(groups: Dict[str, Tuple[str, Optional[str]]]) -> str:
+    encoded = json.dumps(sorted(groups.items()), ensure_ascii=False, separators=(',', ':'))
+    return hashlib.sha256(encoded.encode()).hexdigest()
+
+
+def fetch_all(instances) -> Tuple[Dict[str, Dict], Dict[str, str]]:
+    """Busca os grupos de cada instância. Devolve ({instância: grupos}, {instância: erro})."""
+    fetched, errors = {}, {}
+    for config in instances:
+        response = EvolutionAPIService(config).fetch_groups(
+            timeout=(settings.EVOLUTION_HTTP_CONNECT_TIMEOUT, settings.GROUP_SYNC_TIMEOUT)
+        )
+        if response.get('success'):
+            fetched[config.instance_name] = parse_groups(response.get('data'))
+        else:
+            errors[config.instance_name] = response.get('error', 'Erro desconhecido')
+            logger.warning(f"Group sync: fetchAllGroups failed for {config.instance_name}: {errors[config.instance_name]}")
+    return fetched, errors
+
+
+def apply_diff(remote: Dict[str, Tuple[str, Optional[str]]], deactivate_missing: bool = True) -> Dict[str, int]:
+    """Aplica ao banco a diferença entre os grupos remotos e os cadastrados."""
+    now = timezone.now()
+    existing = {
+        group.group_id: group
+        for group in Group.objects.only('id', 'group_id', 'name', 'description', 'is_active')
+    }
+
+    to_create, to_update = [], []
+    for group_id, (name, description) in remote.items():
+        group = existing.get(group_id)
+        if group is None:
+            to_create.append(Group(group_id=group_id, name=name, description=description))
+        elif (group.name, group.description, group.is_active) != (name, description, True):
+            group.name, group.description, group.is_active, group.updated_at = name, description, True, now
+            to_update.append(group)
+    missing = [
+        group.pk for group_id, group in existing.items() if group.is_active and group_id not in remote
+    ] if deactivate_missing else []
+
+    with transaction.atomic():
+        # ignore_conflicts: uma sincronização concorrente pode ter inserido o mesmo grupo
+        Group.objects.bulk_create(to_create, batch_size=1000, ignore_conflicts=True)
+        Group.objects.bulk_update(to_update, ['name', 'description', 'is_active', 'updated_at'], batch_size=1000)
+        deactivated = Group.objects.filter(pk__in=missing).update(is_active=False, updated_at=now) if missing else 0
+    return {'created': len(to_create), 'updated': len(to_update), 'deactivated': deactivated}
+
+
+def sync_groups(force: bool = False) -> Dict[str, Any]:
+    """
+    Sincroniza os grupos de todas as instâncias saudáveis. Sem `force`, só aplica a
+    diferença se a lista de alguma instância mudou desde o último checkpoint. Se alguma
+    instância falhar, nenhum grupo é desativado (não dá para saber quais saíram).
+    """
+    instances = instance_router.healthy_instances()
+    fetched, errors = fetch_all(instances)
+    # Instâncias cadastradas mas fora do ar contam como falha: os grupos delas são desconhecidos
+    configured = set(EvolutionConfig.objects.filter(is_active=True).values_list('instance_name', flat=True))
+    for instance_name in configured - {config.instance_name for config in instances}:
+        errors[instance_name] = 'Instância indisponível'
+
+    hashes = {instance_name: payload_hash(groups) for instance_name, groups in fetched.items()}
+    previous = dict(GroupSyncCheckpoint.objects.values_list('instance_name', 'payload_hash'))
+    changed = sorted(name for name, value in hashes.items() if previous.get(name) != value)
+    # Instâncias removidas do cadastro: os grupos delas podem ter que ser desativados
+    removed = set(previous) - set(hashes) - set(errors)
+    report = {
+        'instances': {name: 'changed' if name in changed else 'unchanged' for name in hashes},
+        'errors': errors,
+        'groups': 0, 'created': 0, 'updated': 0, 'deactivated': 0,
+    }
+    if not fetched or (not changed and not removed and not force):
+        return report
+
+    remote = {}
+    for groups in fetched.values():
+        for group_id, values in groups.items():
+            remote.setdefault(group_id, values)
+    report['groups'] = len(remote)
+    report.update(apply_diff(remote, deactivate_missing=not errors))
+
+    GroupSyncCheckpoint.objects.filter(instance_name__in=removed).delete()
+    for instance_name, value in hashes.items():
+        GroupSyncCheckpoint.objects.update_or_create(
+            instance_name=instance_name,
+            defaults={'payload_hash': value, 'group_count': len(fetched[instance_name])},
+        )
+    logger.info(
+        f"Group sync: {report['groups']} remote groups, {report['created']} created, "
+        f"{report['updated']} updated, {report['deactivated']} deactivated, {len(errors)} instance errors"
+    )
+    return report
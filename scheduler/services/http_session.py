@@ -0,0 +1,103 @@
+# scheduler/services/http_session.py
+import os
+import threading
+import logging
+from typing import Tuple
+
+import requests
+from requests.adapters import HTTPAdapter
+from urllib3.connectionpool import HTTPConnectionPool, HTTPSConnectionPool
+from urllib3.util.retry import Retry
+from django.conf import settings
+
+from .metrics import EVOLUTION_HTTP_CONNECTIONS
+
+logger = logging.getLogger(__name__)
+
+_lock = threading.Lock()
+_session = None
+_session_pid = None
+
+
+class _CountingPoolMixin:
+    def _make_request(self, conn, *args, **kwargs):
+        # Sem socket a requisição abre uma conexão nova; com socket, reaproveita a do pool
+        EVOLUTION_HTTP_CONNECTIONS.labels('opened' if conn.sock is None else 'reused').inc()
+        return super()._make_request(conn, *args, **kwargs)
+
+
+class CountingHTTPConnectionPool(_CountingPoolMixin, HTTPConnectionPool):
+    pass
+
+
+class CountingHTTPSConnectionPool(_CountingPoolMixin, HTTPSConnectionPool):
+    pass
+
+
+class CountingHTTPAdapter(HTTPAdapter):
+    """HTTPAdapter cujos pools contam as conexões abertas vs. reaproveitadas (métrica Prometheus)."""
+
+    def init_poolmanager(self, *args, **kwargs):
+        super().init_poolmanager(*args, **kwargs)
+        self.poolmanager.pool_classes_by_scheme = {
+            'http': CountingHTTPConnectionPool,
+            'https': CountingHTTPSConnectionPool,
+        }
+
+
+def _build_session() -> requests.Session:
+    retry = Retry(
+        total=settings.EVOLUTION_HTTP_MAX_RETRIES,
+        connect=settings.EVOLUTION_HTTP_MAX_RETRIES,
+        read=settings.EVOLUTION_HTTP_MAX_RETRIES,
+        status=settings.EVOLUTION_HTTP_MAX_RETRIES,
+        backoff_factor=settings.EVOLUTION_HTTP_BACKOFF_FACTOR,
+        status_forcelist=(429, 502, 503, 504),
+        # Envios (POST) não são idempotentes: só são repetidos em falhas de conexão,
+        # quando a requisição com certeza não chegou à API.
+        allowed_methods=frozenset(['GET', 'HEAD', 'OPTIONS']),
+        respect_retry_after_header=True,
+        raise_on_status=False,
+    )
+    adapter = CountingHTTPAdapter(
+        pool_connections=settings.EVOLUTION_HTTP_POOL_CONNECTIONS,
+        pool_maxsize=settings.EVOLUTION_HTTP_POOL_SIZE,
+        pool_block=False,
+        max_retries=retry,
+    )
+    session = requests.Session()
+    session.mount('http://', adapter)
+    session.mount('https://', adapter)
+    return session
+
+
+def get_session() -> requests.Session:
+    """
+    Retorna a sessão HTTP compartilhada do processo.
+
+    A sessão é recriada após um fork (workers prefork do Celery), pois sockets
+    herdados do processo pai não podem ser compartilhados entre processos.
+    """
+    global _session, _session_pid
+    pid = os.getpid()
+    if _session is None or _session_pid != pid:
+        with _lock:
+            if _session is None or _session_pid != pid:
+                _session = _build_session()
+                _session_pid = pid
+    return _session
+
+
+def get_timeout() -> Tuple[float, float]:
+    """Timeout (conexão, leitura) padrão para chamadas à Evolution API."""
+    return (settings.EVOLUTION_HTTP_CONNECT_TIMEOUT, settings.EVOLUTION_HTTP_READ_TIMEOUT)
+
+
+def reset_session():
+    """Fecha a sessão atual (útil em testes ou após mudar configurações)."""
+    global _session, _session_pid
+    with _lock:
+        if _session is not None:
+            _session.close()
+        _session = None
+        _session_pid = None
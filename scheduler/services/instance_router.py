@@ -0,0 +1,244 @@
+# scheduler/services/instance_router.py
+import hashlib
+import itertools
+import logging
+import threading
+import time
+from typing import Callable, Dict, Any, Iterable, List, Optional, Tuple
+
+import redis
+from django.conf import settings
+from django.utils import timezone
+
+from ..models import EvolutionConfig
+from .evolution_service import EvolutionAPIService
+from .rate_limiter import rate_limiter
+from .redis_client import get_redis
+
+logger = logging.getLogger(__name__)
+
+ROUND_ROBIN_KEY = 'router:rr'
+OUTSTANDING_KEY_PREFIX = 'router:outstanding:'
+DOWN_KEY_PREFIX = 'router:down:'
+
+STRATEGIES = ('weighted_round_robin', 'least_outstanding', 'sticky')
+
+
+def default_instance() -> EvolutionConfig:
+    """Instância das settings, representada como um EvolutionConfig não salvo."""
+    return EvolutionConfig(
+        instance_name=settings.EVOLUTION_INSTANCE_NAME,
+        api_key=settings.EVOLUTION_API_KEY,
+        base_url=settings.EVOLUTION_API_BASE_URL,
+        weight=1,
+        is_active=True,
+        is_connected=True,
+    )
+
+
+def is_instance_failure(response_data: Optional[Dict[str, Any]]) -> bool:
+    """A falha foi da instância (API fora do ar/sem resposta) e não do destinatário?"""
+    return bool(response_data) and not response_data.get('success') and bool(response_data.get('connection_error'))
+
+
+class InstanceRouter:
+    """
+    Distribui os envios entre todos os EvolutionConfig ativos e conectados.
+
+    Estratégias:
+      - weighted_round_robin: rodízio global (contador no Redis) respeitando EvolutionConfig.weight
+      - least_outstanding: instância com menos envios em andamento por unidade de peso
+      - sticky: o mesmo destinatário sempre sai pela mesma instância (rendezvous hashing),
+        mudando só se ela cair
+    Sem nenhuma instância saudável cadastrada, usa a instância definida nas settings.
+    """
+
+    def __init__(self, strategy: str = None, client: redis.Redis = None):
+        self.strategy = strategy or settings.EVOLUTION_ROUTER_STRATEGY
+        if self.strategy not in STRATEGIES:
+            raise ValueError(f"Estratégia de roteamento inválida: {self.strategy}")
+        self._client = client
+        self._lock = threading.Lock()
+        self._cache: List[EvolutionConfig] = []
+        self._cache_expires = 0.0
+        self._local_counter = itertools.count()
+
+    @property
+    def client(self) -> redis.Redis:
+        return self._client or get_redis()
+
+    # --- Instâncias saudáveis ---
+
+    def invalidate(self):
+        with self._lock:
+            self._cache_expires = 0.0
+
+    def healthy_instances(self) -> List[EvolutionConfig]:
+        now = time.monotonic()
+        if now >= self._cache_expires:
+            with self._lock:
+                if now >= self._cache_expires:
+                    self._cache = list(
+                        EvolutionConfig.objects.filter(is_active=True, is_connected=True).order_by('instance_name')
+                    )
+                    self._cache_expires = now + settings.EVOLUTION_ROUTER_REFRESH_SECONDS
+        instances = self._cache
+        if instances:
+            try:
+                down = self.client.mget([f"{DOWN_KEY_PREFIX}{config.instance_name}" for config in instances])
+            except redis.RedisError:
+                down = [None] * len(instances)
+            instances = [config for config, is_down in zip(instances, down) if not is_down]
+        # Sem nenhuma instância cadastrada no ar, ainda tenta a instância das settings
+        return instances or [default_instance()]
+
+    def mark_down(self, config: EvolutionConfig, reason: str = ''):
+        """Tira a instância do rodízio (em todos os workers) até a próxima verificação de status."""
+        logger.warning(f"Evolution instance {config.instance_name} marked down: {reason}")
+        try:
+            self.client.set(f"{DOWN_KEY_PREFIX}{config.instance_name}", reason or '1',
+                            ex=settings.EVOLUTION_ROUTER_DOWN_SECONDS)
+        except redis.RedisError as e:
+            logger.warning(f"Could not publish instance down state: {e}")
+        if config.pk:
+            EvolutionConfig.objects.filter(pk=config.pk).update(is_connected=False, last_check=timezone.now())
+        self.invalidate()
+
+    # --- Ordem de preferência por estratégia ---
+
+    def _outstanding(self, instances: List[EvolutionConfig]) -> List[int]:
+        try:
+            values = self.client.mget([f"{OUTSTANDING_KEY_PREFIX}{config.instance_name}" for config in instances])
+        except redis.RedisError:
+            values = [None] * len(instances)
+        return [int(value or 0) for value in values]
+
+    def _next_counter(self) -> int:
+        try:
+            return int(self.client.incr(ROUND_ROBIN_KEY))
+        except redis.RedisError:
+            return next(self._local_counter)
+
+    def candidates(self, recipient: str = None, exclude: Iterable[str] = ()) -> List[EvolutionConfig]:
+        """Instâncias saudáveis na ordem de preferência para este envio."""
+        exclude = set(exclude)
+        instances = [config for config in self.healthy_instances() if config.instance_name not in exclude]
+        if len(instances) <= 1:
+            return instances
+
+        if self.strategy == 'sticky' and recipient:
+            def score(config):
+                digest = hashlib.md5(f"{recipient}:{config.instance_name}".encode()).hexdigest()
+                return int(digest[:12], 16) * max(config.weight, 1)
+            return sorted(instances, key=score, reverse=True)
+
+        if self.strategy == 'least_outstanding':
+            loads = self._outstanding(instances)
+            ranked = sorted(zip(instances, loads), key=lambda item: item[1] / max(item[0].weight, 1))
+            return [config for config, _ in ranked]
+
+        # weighted_round_robin: a posição do contador global escolhe a instância proporcionalmente ao peso
+        total_weight = sum(max(config.weight, 1) for config in instances)
+        position = self._next_counter() % total_weight
+        for index, config in enumerate(instances):
+            position -= max(config.weight, 1)
+            if position < 0:
+                return instances[index:] + instances[:index]
+        return instances
+
+    def choose(self, recipient: str = None, exclude: Iterable[str] = ()) -> Optional[EvolutionConfig]:
+        candidates = self.candidates(recipient, exclude)
+        return candidates[0] if candidates else None
+
+    def reserve(self, recipient: str, exclude: Iterable[str] = ()) -> Tuple[Optional[EvolutionConfig], float]:
+        """
+        Escolhe uma instância com token de rate limit disponível para o destinatário.
+        Retorna (instância, 0) ou (None, segundos até alguma instância liberar).
+        """
+        min_wait = 0.0
+        for config in self.candidates(recipient, exclude):
+            wait = rate_limiter.try_acquire(config.instance_name, [recipient])
+            if not wait:
+                return config, 0.0
+            min_wait = wait if not min_wait else min(min_wait, wait)
+        return None, min_wait
+
+    def assign(self, recipients: List[str]) -> List[Optional[EvolutionConfig]]:
+        """Distribui um fan-out inteiro entre as instâncias (um destino por destinatário)."""
+        if self.strategy != 'least_outstanding':
+            return [self.choose(recipient) for recipient in recipients]
+        instances = self.healthy_instances()
+        if not instances:
+            return [None] * len(recipients)
+        loads = dict(zip((config.instance_name for config in instances), self._outstanding(instances)))
+        assigned = []
+        for _ in recipients:
+            config = min(instances, key=lambda c: loads[c.instance_name] / max(c.weight, 1))
+            loads[config.instance_name] += 1
+            assigned.append(config)
+        return assigned
+
+    # --- Envio com failover ---
+
+    def track(self, config: EvolutionConfig, delta: int):
+        """Atualiza o contador de envios em andamento da instância."""
+        try:
+            key = f"{OUTSTANDING_KEY_PREFIX}{config.instance_name}"
+            pipe = self.client.pipeline()
+            pipe.incrby(key, delta)
+            pipe.expire(key, settings.EVOLUTION_ROUTER_DOWN_SECONDS * 10)
+            pipe.execute()
+        except redis.RedisError:
+            pass
+
+    def send(self, recipient: str, send: Callable[[EvolutionAPIService], Dict[str, Any]],
+             config: EvolutionConfig = None) -> Tuple[Dict[str, Any], Optional[EvolutionConfig]]:
+        """
+        Envia por `config` (ou pela melhor instância) e, se a instância cair, tenta as demais,
+        reservando o token de rate limit de cada uma. Se todas as restantes estiverem no
+        limite, não espera no worker: devolve uma falha com `retry_after` (segundos) para
+        quem chamou reagendar o envio.
+        Retorna (resposta no formato de EvolutionAPIService._make_request, instância usada).
+        """
+        tried = set()
+        config = config or self.choose(recipient)
+        response_data = None
+        while config is not None:
+            tried.add(config.instance_name)
+            self.track(config, 1)
+            try:
+                response_data = send(EvolutionAPIService(config))
+            finally:
+                self.track(config, -1)
+            if not is_instance_failure(response_data):
+                return response_data, config
+            self.mark_down(config, response_data.get('error', ''))
+            config, wait = self.reserve(recipient, exclude=tried)
+            if wait:
+                return {
+                    'success': False, 'status_code': 429, 'retry_after': wait,
+                    'error': f'Instâncias de failover no limite de envio (próximo token em {wait:.2f}s)',
+                }, None
+        if response_data is None:
+            response_data = {'success': False, 'error': 'Nenhuma instância Evolution disponível', 'status_code': 503}
+        return response_data, None
+
+    def refresh_status(self) -> Dict[str, bool]:
+        """Consulta connectionState de cada instância ativa e atualiza is_connected/last_check."""
+        statuses = {}
+        for config in EvolutionConfig.objects.filter(is_active=True):
+            result = EvolutionAPIService(config).check_instance_status()
+            state = result.get('data', {}).get('instance', {}).get('state') if result.get('success') else None
+            connected = state == 'open'
+            EvolutionConfig.objects.filter(pk=config.pk).update(is_connected=connected, last_check=timezone.now())
+            if connected:
+                try:
+                    self.client.delete(f"{DOWN_KEY_PREFIX}{config.instance_name}")
+                except redis.RedisError:
+                    pass
+            statuses[config.instance_name] = connected
+        self.invalidate()
+        return statuses
+
+
+instance_router = InstanceRouter()
@@ -0,0 +1,126 @@
+# scheduler/services/log_writer.py
+import logging
+import time
+import uuid
+from contextlib import nullcontext
+from datetime import datetime
+from typing import Dict, List
+
+from django.conf import settings
+from django.db import IntegrityError, connection, transaction
+
+from ..models import MessageLog
+from .dashboard_counters import dashboard_counters
+from .metrics import record_sends
+from .rollups import mark_dirty
+
+logger = logging.getLogger(__name__)
+
+UPDATE_FIELDS = ['status', 'evolution_message_id', 'error_message', 'instance_name', 'sent_at', 'delivered_at']
+
+
+def idempotency_key(schedule_id, occurrence: datetime, recipient: str) -> str:
+    """Chave única de um envio: agendamento + ocorrência (epoch UTC) + destinatário."""
+    return f"{uuid.UUID(str(schedule_id)).hex}:{int(occurrence.timestamp())}:{recipient}"
+
+
+class MessageLogWriter:
+    """
+    Buffer de escrita dos MessageLog de uma task.
+
+    Os logs são reservados ('pending') com um INSERT em lote antes do envio e o
+    resultado de cada um fica em memória, gravado com bulk_update quando o buffer
+    atinge MESSAGE_LOG_FLUSH_SIZE itens, quando passa MESSAGE_LOG_FLUSH_INTERVAL
+    segundos desde a última gravação, ou na saída do bloco `with` (inclusive por
+    exceção). O buffer não atravessa tasks: o status final de um envio não pode
+    depender de um processo que ainda vai rodar outra task.
+    """
+
+    def __init__(self, flush_size: int = None, flush_interval: float = None):
+        self.flush_size = flush_size or settings.MESSAGE_LOG_FLUSH_SIZE
+        self.flush_interval = flush_interval if flush_interval is not None else settings.MESSAGE_LOG_FLUSH_INTERVAL
+        self._to_update: Dict = {}
+        # Status já gravado de cada log deste writer, para os contadores do dashboard
+        self._flushed_status: Dict = {}
+        # sent_at já gravado (a reserva grava o horário da reserva; o resultado, o do envio)
+        self._flushed_sent_at: Dict = {}
+        self._last_flush = time.monotonic()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self.flush()
+        return False
+
+    def reserve(self, log_entries: List[MessageLog]) -> List[MessageLog]:
+        """
+        Grava os logs imediatamente, ignorando os que colidem no idempotency_key, e
+        devolve só os que foram inseridos agora (os demais já foram enviados antes).
+
+        No caso comum (nenhuma colisão) é um único INSERT; só uma task reentregue paga o
+        INSERT IGNORE e o SELECT que descobre quais logs já existiam.
+        """
+        if not log_entries:
+            return []
+        if self._insert(log_entries):
+            reserved = log_entries
+        else:
+            MessageLog.objects.bulk_create(log_entries, batch_size=self.flush_size, ignore_conflicts=True)
+            # Os ids são gerados aqui, então um id encontrado no banco é um log deste writer
+            inserted = set(
+                MessageLog.objects.filter(pk__in=[log_entry.pk for log_entry in log_entries]).values_list('pk', flat=True)
+            )
+            reserved = [log_entry for log_entry in log_entries if log_entry.pk in inserted]
+        dashboard_counters.transitions('log', [(None, log_entry.status) for log_entry in reserved])
+        self.adopt(reserved)
+        return reserved
+
+    def adopt(self, log_entries: List[MessageLog]):
+        """Acompanha logs reservados por outra task (status atual já gravado), para os contadores do dashboard."""
+        for log_entry in log_entries:
+            self._flushed_status[log_entry.pk] = log_entry.status
+            self._flushed_sent_at[log_entry.pk] = log_entry.sent_at
+
+    def _insert(self, log_entries: List[MessageLog]) -> bool:
+        """INSERT simples dos logs; False se algum idempotency_key já existia."""
+        try:
+            # Dentro de uma transação, o savepoint mantém a transação externa utilizável após o erro
+            with transaction.atomic() if connection.in_atomic_block else nullcontext():
+                MessageLog.objects.bulk_create(log_entries, batch_size=self.flush_size)
+        except IntegrityError:
+            return False
+        return True
+
+    def update(self, log_entry: MessageLog):
+        """Agenda a gravação do estado atual de um log."""
+        self._to_update[log_entry.pk] = log_entry
+        self._maybe_flush()
+
+    def pending(self) -> int:
+        return len(self._to_update)
+
+    def _maybe_flush(self):
+        if self.pending() >= self.flush_size or time.monotonic() - self._last_flush >= self.flush_interval:
+            self.flush()
+
+    def flush(self):
+        to_update: List[MessageLog] = list(self._to_update.values())
+        self._to_update.clear()
+        self._last_flush = time.monotonic()
+        if not to_update:
+            return
+        MessageLog.objects.bulk_update(to_update, UPDATE_FIELDS, batch_size=self.flush_size)
+
+        # Logs que não passaram por este writer ficam para a reconciliação (status anterior desconhecido)
+        dashboard_counters.transitions('log', [
+            (self._flushed_status[log_entry.pk], log_entry.status)
+            for log_entry in to_update if log_entry.pk in self._flushed_status
+        ])
+        record_sends((self._flushed_status.get(log_entry.pk), log_entry) for log_entry in to_update)
+        # Logs já consolidados que mudaram precisam ser reconsolidados: o minuto do novo
+        # sent_at e o do anterior (a reserva pode ter sido consolidada como 'pending' em outra hora)
+        mark_dirty([log_entry.sent_at for log_entry in to_update] + [
+            self._flushed_sent_at.get(log_entry.pk) for log_entry in to_update
+        ])
+        self.adopt(to_update)
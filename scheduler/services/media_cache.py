@@ -0,0 +1,129 @@
+# scheduler/services/media_cache.py
+import base64
+import hashlib
+import mimetypes
+import os
+import threading
+from collections import OrderedDict
+from typing import Dict, Any
+
+from django.conf import settings
+
+# Valores aceitos pelo campo "mediatype" do sendMedia da Evolution API
+MEDIA_TYPES = {
+    'image': 'image',
+    'video': 'video',
+    'document': 'document',
+    'audio': 'audio',
+}
+
+
+class MediaCache:
+    """
+    Cache (por processo) do payload de mídia já preparado para o sendMedia.
+
+    - conteúdo endereçado pelo SHA-256 do arquivo: o mesmo arquivo em vários templates
+      é codificado uma única vez;
+    - (template, arquivo, updated_at) -> hash: um template já visto não relê o arquivo;
+      trocar o media_file muda o nome/updated_at e invalida a entrada naturalmente;
+    - LRU limitado pelo total de bytes codificados (MEDIA_CACHE_MAX_BYTES); as chaves de
+      template que apontam para um conteúdo descartado saem junto, então o índice de
+      templates também fica limitado.
+    """
+
+    def __init__(self, max_bytes: int = None):
+        self.max_bytes = max_bytes if max_bytes is not None else settings.MEDIA_CACHE_MAX_BYTES
+        self._lock = threading.Lock()
+        self._payloads: "OrderedDict[str, Dict[str, Any]]" = OrderedDict()
+        self._templates: Dict[Any, str] = {}
+        self._size = 0
+        self.hits = 0
+        self.misses = 0
+
+    @staticmethod
+    def _template_key(template):
+        return (str(template.pk), template.media_file.name, template.updated_at)
+
+    def _get(self, content_hash: str):
+        payload = self._payloads.get(content_hash)
+        if payload is not None:
+            self._payloads.move_to_end(content_hash)
+        return payload
+
+    def _put(self, content_hash: str, payload: Dict[str, Any]) -> bool:
+        size = len(payload['media'])
+        if size > self.max_bytes:
+            return False
+        self._payloads[content_hash] = payload
+        self._size += size
+        evicted_hashes = set()
+        while self._size > self.max_bytes:
+            evicted_hash, evicted = self._payloads.popitem(last=False)
+            self._size -= len(evicted['media'])
+            evicted_hashes.add(evicted_hash)
+        if evicted_hashes:
+            for key in [key for key, value in self._templates.items() if value in evicted_hashes]:
+                del self._templates[key]
+        return True
+
+    def get_payload(self, template) -> Dict[str, Any]:
+        """
+        Retorna o payload de mídia do template (sem 'number'/'caption'), pronto para o sendMedia.
+        Levanta FileNotFoundError se o arquivo não existir no storage.
+        """
+        template_key = self._template_key(template)
+        with self._lock:
+            content_hash = self._templates.get(template_key)
+            payload = self._get(content_hash) if content_hash else None
+            if payload is not None:
+                self.hits += 1
+                return payload
+
+        with template.media_file.open('rb') as media:
+            content = media.read()
+        content_hash = hashlib.sha256(content).hexdigest()
+
+        with self._lock:
+            payload = self._get(content_hash)
+            if payload is not None:
+                self._templates[template_key] = content_hash
+                self.hits += 1
+                return payload
+            self.misses += 1
+            file_name = os.path.basename(template.media_file.name)
+            payload = {
+                'mediatype': MEDIA_TYPES.get(template.media_type, 'document'),
+                'mimetype': mimetypes.guess_type(file_name)[0] or 'application/octet-stream',
+                'fileName': file_name,
+                'media': base64.b64encode(content).decode('ascii'),
+            }
+            if self._put(content_hash, payload):
+                self._templates[template_key] = content_hash
+            return payload
+
+    def invalidate_template(self, template_id):
+        """Esquece o arquivo associado a um template (o conteúdo segue no LRU enquanto couber)."""
+        template_id = str(template_id)
+        with self._lock:
+            for key in [key for key in self._templates if key[0] == template_id]:
+                del self._templates[key]
+
+    def clear(self):
+        with self._lock:
+            self._payloads.clear()
+            self._templates.clear()
+            self._size = 0
+
+    def stats(self) -> Dict[str, int]:
+        with self._lock:
+            return {
+                'entries': len(self._payloads),
+                'templates': len(self._templates),
+                'bytes': self._size,
+                'max_bytes': self.max_bytes,
+                'hits': self.hits,
+                'misses': self.misses,
+            }
+
+
+media_cache = MediaCache()
@@ -0,0 +1,163 @@
+# scheduler/services/metrics.py
+"""
+Métricas Prometheus do pipeline de envio (web e workers do Celery).
+
+O web expõe /metrics pelo django-prometheus. Nos workers prefork cada filho é um
+processo: com PROMETHEUS_MULTIPROC_DIR definido, os filhos gravam as séries em
+arquivos nesse diretório e o processo principal do worker serve a soma de todos na
+porta CELERY_METRICS_PORT (MultiProcessCollector).
+
+O tempo de fila vem do cabeçalho `published_at`, carimbado em toda publicação de
+task (before_task_publish); as consultas ao banco por task são contadas com um
+execute_wrapper instalado entre task_prerun e task_postrun.
+"""
+import logging
+import os
+import time
+from datetime import datetime
+from typing import Iterable
+
+from celery.signals import before_task_publish, task_postrun, task_prerun, worker_init, worker_process_shutdown
+from django.db import connection
+from prometheus_client import REGISTRY, CollectorRegistry, Counter, Histogram, multiprocess, start_http_server
+
+logger = logging.getLogger(__name__)
+
+PUBLISHED_AT_HEADER = 'published_at'
+FINAL_SEND_STATUSES = ('sent', 'failed')
+
+EVOLUTION_REQUEST_SECONDS = Histogram(
+    'whatsapp_evolution_request_seconds', 'Latência das chamadas à Evolution API.',
+    ['endpoint', 'instance'], buckets=(0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60),
+)
+EVOLUTION_REQUESTS = Counter(
+    'whatsapp_evolution_requests', 'Chamadas à Evolution API por código de resposta.',
+    ['endpoint', 'instance', 'status_code'],
+)
+EVOLUTION_HTTP_CONNECTIONS = Counter(
+    'whatsapp_evolution_http_connections', 'Requisições à Evolution API por conexão: aberta (nova) ou reaproveitada do pool.',
+    ['state'],
+)
+SENDS = Counter('whatsapp_sends', 'Envios finalizados por status (sent/failed) e instância.', ['status', 'instance'])
+RECEIPTS = Counter('whatsapp_receipts', 'Confirmações de entrega/leitura aplicadas aos logs.', ['status'])
+TASK_QUEUE_WAIT_SECONDS = Histogram(
+    'whatsapp_task_queue_wait_seconds', 'Tempo entre a publicação (ou o ETA) e o início da task.',
+    ['task', 'queue'], buckets=(0.01, 0.05, 0.1, 0.5, 1, 2.5, 5, 10, 30, 60, 300, 900),
+)
+TASK_RUNTIME_SECONDS = Histogram(
+    'whatsapp_task_runtime_seconds', 'Duração da execução das tasks.',
+    ['task'], buckets=(0.01, 0.05, 0.1, 0.5, 1, 2.5, 5, 10, 30, 60, 300),
+)
+TASK_DB_QUERIES = Histogram(
+    'whatsapp_task_db_queries', 'Consultas ao banco por execução de task.',
+    ['task'], buckets=(1, 2, 5, 10, 20, 50, 100, 250, 500, 1000, 5000),
+)
+SCHEDULE_FIRING_LAG_SECONDS = Histogram(
+    'whatsapp_schedule_firing_lag_seconds', 'Atraso do envio em relação ao next_execution da ocorrência.',
+    ['frequency'], buckets=(0.5, 1, 2, 5, 10, 30, 60, 120, 300, 900, 3600),
+)
+
+
+def endpoint_label(endpoint: str) -> str:
+    """'message/sendText/<instância>?x=y' -> 'message/sendText' (sem o nome da instância)."""
+    return '/'.join(endpoint.split('?', 1)[0].strip('/').split('/')[:2])
+
+
+def observe_evolution_request(endpoint: str, instance: str, seconds: float, status_code):
+    endpoint = endpoint_label(endpoint)
+    EVOLUTION_REQUEST_SECONDS.labels(endpoint, instance or '').observe(seconds)
+    EVOLUTION_REQUESTS.labels(endpoint, instance or '', str(status_code)).inc()
+
+
+def record_sends(changes: Iterable):
+    """Conta os logs que chegaram a um status final: [(status anterior, log)]."""
+    for previous, log_entry in changes:
+        if log_entry.status in FINAL_SEND_STATUSES and log_entry.status != previous:
+            SENDS.labels(log_entry.status, log_entry.instance_name or '').inc()
+
+
+def observe_firing_lag(frequency: str, occurrence: datetime, sent_at: datetime):
+    SCHEDULE_FIRING_LAG_SECONDS.labels(frequency).observe(max((sent_at - occurrence).total_seconds(), 0.0))
+
+
+# --- Celery ---
+
+_running = {}
+
+
+@before_task_publish.connect
+def stamp_published_at(headers=None, **kwargs):
+    if headers is not None:
+        headers[PUBLISHED_AT_HEADER] = time.time()
+
+
+def _queue_wait(request):
+    published_at = getattr(request, PUBLISHED_AT_HEADER, None) or (request.headers or {}).get(PUBLISHED_AT_HEADER)
+    if not published_at:
+        return None
+    ready_at = float(published_at)
+    if request.eta:
+        # Task com countdown/ETA (ex.: retry): a espera conta a partir do horário marcado
+        eta = request.eta if isinstance(request.eta, datetime) else datetime.fromisoformat(request.eta)
+        ready_at = max(ready_at, eta.timestamp())
+    return max(time.time() - ready_at, 0.0)
+
+
+@task_prerun.connect
+def start_task_metrics(task_id=None, task=None, **kwargs):
+    request = task.request
+    if not request.is_eager:
+        wait = _queue_wait(request)
+        if wait is not None:
+            queue = (request.delivery_info or {}).get('routing_key') or 'unknown'
+            TASK_QUEUE_WAIT_SECONDS.labels(task.name, queue).observe(wait)
+
+    queries = [0]
+
+    def count_queries(execute, sql, params, many, context):
+        queries[0] += 1
+        return execute(sql, params, many, context)
+
+    connection.execute_wrappers.append(count_queries)
+    _running[task_id] = (time.perf_counter(), queries, count_queries)
+
+
+@task_postrun.connect
+def finish_task_metrics(task_id=None, task=None, **kwargs):
+    state = _running.pop(task_id, None)
+    if state is None:
+        return
+    started, queries, count_queries = state
+    try:
+        connection.execute_wrappers.remove(count_queries)
+    except ValueError:
+        pass
+    TASK_RUNTIME_SECONDS.labels(task.name).observe(time.perf_counter() - started)
+    TASK_DB_QUERIES.labels(task.name).observe(queries[0])
+
+
+@worker_init.connect
+def start_worker_metrics_server(**kwargs):
+    """Servidor /metrics do worker (processo principal), somando as séries de todos os filhos."""
+    from django.conf import settings
+
+    if not settings.CELERY_METRICS_PORT:
+        return
+    directory = os.environ.get('PROMETHEUS_MULTIPROC_DIR')
+    registry = REGISTRY
+    if directory:
+        os.makedirs(directory, exist_ok=True)
+        # Arquivos de uma execução anterior do worker somariam valores antigos
+        for name in os.listdir(directory):
+            if name.endswith('.db'):
+                os.remove(os.path.join(directory, name))
+        registry = CollectorRegistry()
+        multiprocess.MultiProcessCollector(registry, path=directory)
+    start_http_server(settings.CELERY_METRICS_PORT, registry=registry)
+    logger.info(f"Worker metrics exposed on port {settings.CELERY_METRICS_PORT}")
+
+
+@worker_process_shutdown.connect
+def mark_worker_process_dead(pid=None, **kwargs):
+    if os.environ.get('PROMETHEUS_MULTIPROC_DIR'):
+        multiprocess.mark_process_dead(pid or os.getpid())
@@ -0,0 +1,168 @@
+# scheduler/services/number_validity.py
+"""
+Cache de validade de números no WhatsApp (chat/whatsappNumbers da Evolution API).
+
+Cada número verificado vira uma chave no Redis ('1' existe / '0' não existe) com
+TTL; o negativo expira antes, porque o número pode passar a usar o WhatsApp.
+O cache é preenchido em lote pela task precheck_numbers, enfileirada na importação
+de contatos e na criação de agendamentos; o envio só consulta o cache (um MGET) e
+pula os números sabidamente inválidos, sem chamar a API.
+"""
+import logging
+from typing import Dict, Iterable, List, Optional, Set
+
+from django.conf import settings
+from django.db import transaction
+from redis.exceptions import RedisError
+
+from .instance_router import instance_router
+from .redis_client import get_redis
+
+logger = logging.getLogger(__name__)
+
+KEY_PREFIX = 'wa:number:'
+STATS_KEY = 'wa:number:stats'
+STATS_FIELDS = ('hits', 'misses', 'checked', 'valid', 'invalid', 'skipped_sends', 'check_errors')
+
+
+def is_checkable(recipient: str) -> bool:
+    """Só números de telefone são verificados (grupos e JIDs ficam de fora)."""
+    return bool(recipient) and '@' not in recipient
+
+
+def _digits(value) -> str:
+    return ''.join(char for char in str(value or '') if char.isdigit())
+
+
+class NumberValidityCache:
+    """Validade de números no WhatsApp, com TTL e cache negativo no Redis."""
+
+    def __init__(self, client=None):
+        self._client = client
+
+    @property
+    def client(self):
+        return self._client or get_redis()
+
+    @property
+    def enabled(self) -> bool:
+        return settings.NUMBER_VALIDITY_ENABLED
+
+    def _count(self, **fields):
+        fields = {field: value for field, value in fields.items() if value}
+        if not fields:
+            return
+        try:
+            pipe = self.client.pipeline(transaction=False)
+            for field, value in fields.items():
+                pipe.hincrby(STATS_KEY, field, value)
+            pipe.execute()
+        except RedisError:
+            pass
+
+    # --- leitura ---
+
+    def lookup(self, numbers: Iterable[str]) -> Dict[str, Optional[bool]]:
+        """{número: True/False/None (desconhecido)} com um único MGET."""
+        numbers = list(dict.fromkeys(number for number in numbers if is_checkable(number)))
+        if not numbers:
+            return {}
+        values = self.client.mget([f'{KEY_PREFIX}{number}' for number in numbers])
+        result = {number: None if value is None else value == '1' for number, value in zip(numbers, values)}
+        hits = sum(value is not None for value in result.values())
+        self._count(hits=hits, misses=len(result) - hits)
+        return result
+
+    def known_invalid(self, numbers: Iterable[str]) -> Set[str]:
+        """
+        Números com resultado negativo em cache. Usado no envio: nunca chama a API e,
+        sem Redis, não bloqueia nenhum envio. Não conta os envios pulados: a consulta
+        acontece antes do claim da ocorrência (ver record_skipped).
+        """
+        if not self.enabled:
+            return set()
+        try:
+            return {number for number, valid in self.lookup(numbers).items() if valid is False}
+        except RedisError as e:
+            logger.warning(f"Number validity cache unavailable: {e}")
+            return set()
+
+    def record_skipped(self, count: int):
+        """Conta envios de fato pulados (log da ocorrência reservado e marcado como falho)."""
+        self._count(skipped_sends=count)
+
+    # --- preenchimento ---
+
+    def store(self, results: Dict[str, bool]):
+        if not results:
+            return
+        pipe = self.client.pipeline(transaction=False)
+        for number, valid in results.items():
+            ttl = settings.NUMBER_VALIDITY_TTL if valid else settings.NUMBER_VALIDITY_NEGATIVE_TTL
+            pipe.set(f'{KEY_PREFIX}{number}', '1' if valid else '0', ex=ttl)
+        pipe.execute()
+
+    def check(self, numbers: List[str]) -> Dict[str, bool]:
+        """Consulta a Evolution API para um lote de números. Números sem resposta ficam de fora."""
+        response, _ = instance_router.send(None, lambda service: service.check_whatsapp_numbers(numbers))
+        if not response.get('success'):
+            logger.warning(f"WhatsApp number check failed for {len(numbers)} numbers: {response.get('error')}")
+            self._count(check_errors=1)
+            return {}
+
+        by_digits = {_digits(number): number for number in numbers}
+        results = {}
+        for item in response.get('data') or []:
+            if not isinstance(item, dict):
+                continue
+            number = by_digits.get(_digits(item.get('number'))) or by_digits.get(_digits(item.get('jid', '').split('@')[0]))
+            if number:
+                results[number] = bool(item.get('exists'))
+        return results
+
+    def precheck(self, numbers: Iterable[str], force: bool = False) -> Dict[str, int]:
+        """Verifica em lotes os números ainda sem resultado em cache (ou todos, com `force`)."""
+        if not self.enabled:
+            return {}
+        numbers = list(dict.fromkeys(number for number in numbers if is_checkable(number)))
+        if not force:
+            numbers = [number for number, valid in self.lookup(numbers).items() if valid is None]
+
+        stats = {'checked': 0, 'valid': 0, 'invalid': 0}
+        batch_size = settings.NUMBER_VALIDITY_BATCH_SIZE
+        for start in range(0, len(numbers), batch_size):
+            results = self.check(numbers[start:start + batch_size])
+            self.store(results)
+            valid = sum(results.values())
+            stats['checked'] += len(results)
+            stats['valid'] += valid
+            stats['invalid'] += len(results) - valid
+        self._count(**stats)
+        return stats
+
+    def schedule_precheck(self, numbers: Iterable[str]):
+        """Enfileira precheck_numbers (após o commit) em lotes de NUMBER_VALIDITY_BATCH_SIZE."""
+        numbers = [number for number in dict.fromkeys(numbers) if is_checkable(number)]
+        if not self.enabled or not numbers:
+            return
+        from ..tasks import precheck_numbers
+
+        batch_size = settings.NUMBER_VALIDITY_BATCH_SIZE
+
+        def enqueue():
+            for start in range(0, len(numbers), batch_size):
+                precheck_numbers.delay(numbers[start:start + batch_size])
+
+        transaction.on_commit(enqueue)
+
+    def stats(self) -> Dict:
+        raw = self.client.hgetall(STATS_KEY)
+        stats = {field: int(raw.get(field, 0)) for field in STATS_FIELDS}
+        lookups = stats['hits'] + stats['misses']
+        stats['hit_rate'] = round(stats['hits'] / lookups, 4) if lookups else None
+        stats['ttl_seconds'] = settings.NUMBER_VALIDITY_TTL
+        stats['negative_ttl_seconds'] = settings.NUMBER_VALIDITY_NEGATIVE_TTL
+        return stats
+
+
+number_validity = NumberValidityCache()
@@ -0,0 +1,142 @@
+# scheduler/services/rate_limiter.py
+import asyncio
+import logging
+from typing import Dict, Any, Iterable, List, Tuple
+
+import redis
+from django.conf import settings
+
+from .redis_client import get_redis
+
+logger = logging.getLogger(__name__)
+
+INSTANCE_KEY_PREFIX = 'ratelimit:instance:'
+RECIPIENT_KEY_PREFIX = 'ratelimit:recipient:'
+
+# Token bucket atômico sobre vários buckets ao mesmo tempo.
+# KEYS: buckets; ARGV: para cada bucket -> taxa (tokens/s), capacidade, tokens pedidos.
+# Usa o relógio do próprio Redis para não depender do relógio de cada worker.
+# Só consome se TODOS os buckets tiverem tokens; senão devolve o tempo de espera.
+_ACQUIRE_SCRIPT = """
+local t = redis.call('TIME')
+local now = tonumber(t[1]) + tonumber(t[2]) / 1000000
+local levels = {}
+local max_wait = 0
+for i = 1, #KEYS do
+    local rate = tonumber(ARGV[3 * i - 2])
+    local capacity = tonumber(ARGV[3 * i - 1])
+    -- um pedido maior que a capacidade nunca seria atendido: limita à capacidade
+    local requested = math.min(tonumber(ARGV[3 * i]), capacity)
+    local data = redis.call('HMGET', KEYS[i], 'tokens', 'ts')
+    local tokens = tonumber(data[1])
+    local ts = tonumber(data[2])
+    if tokens == nil or ts == nil then
+        tokens = capacity
+        ts = now
+    end
+    tokens = math.min(capacity, tokens + math.max(0, now - ts) * rate)
+    levels[i] = tokens
+    if tokens < requested then
+        local wait = (requested - tokens) / rate
+        if wait > max_wait then
+            max_wait = wait
+        end
+    end
+end
+if max_wait > 0 then
+    return {0, tostring(max_wait)}
+end
+for i = 1, #KEYS do
+    local rate = tonumber(ARGV[3 * i - 2])
+    local capacity = tonumber(ARGV[3 * i - 1])
+    local requested = math.min(tonumber(ARGV[3 * i]), capacity)
+    redis.call('HSET', KEYS[i], 'tokens', tostring(levels[i] - requested), 'ts', tostring(now))
+    redis.call('EXPIRE', KEYS[i], math.ceil(capacity / rate) + 60)
+end
+return {1, '0'}
+"""
+
+
+class TokenBucketRateLimiter:
+    """
+    Limitador distribuído (token bucket no Redis) por instância Evolution e por destinatário.
+    Uma taxa <= 0 desativa o bucket correspondente.
+    """
+
+    def __init__(self, client: redis.Redis = None):
+        self._client = client
+        self.instance_rate = settings.EVOLUTION_RATE_LIMIT_INSTANCE_RATE
+        self.instance_burst = settings.EVOLUTION_RATE_LIMIT_INSTANCE_BURST
+        self.recipient_rate = settings.EVOLUTION_RATE_LIMIT_RECIPIENT_RATE
+        self.recipient_burst = settings.EVOLUTION_RATE_LIMIT_RECIPIENT_BURST
+
+    @property
+    def client(self) -> redis.Redis:
+        return self._client or get_redis()
+
+    @property
+    def enabled(self) -> bool:
+        return self.instance_rate > 0 or self.recipient_rate > 0
+
+    def _buckets(self, instance_name: str, recipients: Iterable[str]) -> Tuple[List[str], List]:
+        keys, args = [], []
+        recipients = list(recipients)
+        if self.instance_rate > 0:
+            keys.append(f"{INSTANCE_KEY_PREFIX}{instance_name}")
+            args += [self.instance_rate, self.instance_burst, len(recipients)]
+        if self.recipient_rate > 0:
+            for recipient in set(recipients):
+                keys.append(f"{RECIPIENT_KEY_PREFIX}{instance_name}:{recipient}")
+                args += [self.recipient_rate, self.recipient_burst, recipients.count(recipient)]
+        return keys, args
+
+    def try_acquire(self, instance_name: str, recipients: Iterable[str]) -> float:
+        """
+        Tenta consumir um token da instância por destinatário e um token de cada destinatário.
+        Retorna 0 se liberado, ou quantos segundos esperar antes de tentar de novo.
+        """
+        if not self.enabled:
+            return 0.0
+        keys, args = self._buckets(instance_name, recipients)
+        try:
+            allowed, wait = self.client.eval(_ACQUIRE_SCRIPT, len(keys), *keys, *args)
+        except redis.RedisError as e:
+            # Sem Redis não há como coordenar os workers: libera o envio em vez de travar a fila
+            logger.warning(f"Rate limiter unavailable, allowing send: {e}")
+            return 0.0
+        return 0.0 if int(allowed) else float(wait)
+
+    async def acquire_async(self, instance_name: str, recipient: str):
+        """Aguarda (sem bloquear o event loop) até haver tokens para um envio."""
+        while True:
+            wait = await asyncio.to_thread(self.try_acquire, instance_name, [recipient])
+            if not wait:
+                return
+            await asyncio.sleep(wait)
+
+    def _level(self, key: str, rate: float, capacity: float, now: float) -> Dict[str, Any]:
+        tokens, ts = self.client.hmget(key, 'tokens', 'ts')
+        if tokens is None or ts is None:
+            level = float(capacity)
+        else:
+            level = min(capacity, float(tokens) + max(0.0, now - float(ts)) * rate)
+        return {'tokens': round(level, 3), 'capacity': capacity, 'rate_per_second': rate}
+
+    def get_levels(self) -> Dict[str, Any]:
+        """Nível atual de cada bucket de instância e quantidade de buckets de destinatário ativos."""
+        seconds, micros = self.client.time()
+        now = seconds + micros / 1_000_000
+        instances = {}
+        for key in self.client.scan_iter(match=f"{INSTANCE_KEY_PREFIX}*", count=500):
+            name = key[len(INSTANCE_KEY_PREFIX):]
+            instances[name] = self._level(key, self.instance_rate, self.instance_burst, now)
+        active_recipients = sum(1 for _ in self.client.scan_iter(match=f"{RECIPIENT_KEY_PREFIX}*", count=1000))
+        return {
+            'instances': instances,
+            'recipient_buckets': active_recipients,
+            'recipient_rate_per_second': self.recipient_rate,
+            'recipient_burst': self.recipient_burst,
+        }
+
+
+rate_limiter = TokenBucketRateLimiter()
@@ -0,0 +1,26 @@
+# scheduler/services/redis_client.py
+import threading
+
+import redis
+from django.conf import settings
+
+_lock = threading.Lock()
+_client = None
+
+
+def get_redis() -> redis.Redis:
+    """
+    Cliente Redis compartilhado do processo (mesmo Redis usado como broker do Celery).
+    O pool de conexões do redis-py já se recria sozinho após um fork.
+    """
+    global _client
+    if _client is None:
+        with _lock:
+            if _client is None:
+                _client = redis.Redis.from_url(
+                    settings.SCHEDULER_REDIS_URL,
+                    socket_timeout=settings.SCHEDULER_REDIS_SOCKET_TIMEOUT,
+                    socket_connect_timeout=settings.SCHEDULER_REDIS_SOCKET_TIMEOUT,
+                    decode_responses=True,
+                )
+    return _client
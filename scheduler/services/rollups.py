@@ -0,0 +1,285 @@
+# scheduler/services/rollups.py
+"""
+Consolidação de MessageLog em séries por minuto/hora/dia (SendRollup).
+
+A task rollup_message_logs avança um checkpoint em sent_at e, para cada janela
+nova (mais os minutos marcados como alterados por atualizações de status, ex.:
+recibos de entrega), recalcula a partir dos logs as horas inteiras que a janela
+toca: as linhas de minuto e de hora dessas horas são substituídas, e os dias
+afetados são refeitos somando as horas. Por isso minutos podem ser descartados
+após SEND_ROLLUP_MINUTE_RETENTION_DAYS sem afetar horas e dias.
+
+Os dias (no fuso do projeto) são agrupados em Python a partir das linhas de hora:
+no MySQL um TruncDay com fuso vira CONVERT_TZ, que devolve NULL quando as tabelas
+de fuso horário do servidor não foram carregadas.
+"""
+import logging
+import math
+from collections import defaultdict
+from datetime import datetime, timedelta, timezone as dt_timezone
+from typing import Dict, Iterable, List, Optional, Tuple
+
+from django.conf import settings
+from django.db import transaction
+from django.db.models import Count, Min
+from django.db.models.functions import TruncMinute
+from django.utils import timezone
+from redis.exceptions import RedisError
+
+from ..models import MessageLog, RollupCheckpoint, SendRollup
+from .redis_client import get_redis
+
+logger = logging.getLogger(__name__)
+
+CHECKPOINT_NAME = 'message_logs'
+DIRTY_MINUTES_KEY = 'rollup:dirty_minutes'
+METRICS = ('total', 'sent', 'failed', 'delivered', 'read')
+GRANULARITIES = {'minute': 60, 'hour': 3600, 'day': 86400}
+MAX_WINDOW = timedelta(days=1)
+# Limita o backfill inicial por execução; o restante fica para as próximas
+MAX_WINDOWS_PER_RUN = 7
+
+# Métricas incrementadas por cada status final de log
+STATUS_METRICS = {
+    'pending': (),
+    'sent': ('sent',),
+    'failed': ('failed',),
+    'delivered': ('sent', 'delivered'),
+    'read': ('sent', 'delivered', 'read'),
+}
+
+
+def _floor_hour(value: datetime) -> datetime:
+    return value.replace(minute=0, second=0, microsecond=0)
+
+
+def _ceil_hour(value: datetime) -> datetime:
+    floored = _floor_hour(value)
+    return floored if floored == value else floored + timedelta(hours=1)
+
+
+def mark_dirty(sent_ats: Iterable[datetime]):
+    """
+    Marca para reconsolidação os minutos de logs que mudaram de status depois de
+    gravados (o checkpoint só acompanha logs novos). Aplicado após o commit.
+    """
+    minutes = {int(value.timestamp()) // 60 for value in sent_ats if value}
+    if not minutes:
+        return
+
+    def push():
+        try:
+            get_redis().sadd(DIRTY_MINUTES_KEY, *minutes)
+        except RedisError as e:
+            logger.warning(f"Failed to mark rollup minutes as dirty: {e}")
+
+    transaction.on_commit(push)
+
+
+def _pop_dirty_hours() -> List[datetime]:
+    """Retira do Redis os minutos alterados e devolve as horas (UTC) a recalcular."""
+    try:
+        client = get_redis()
+        pipe = client.pipeline(transaction=True)
+        pipe.smembers(DIRTY_MINUTES_KEY)
+        pipe.delete(DIRTY_MINUTES_KEY)
+        minutes, _ = pipe.execute()
+    except RedisError as e:
+        logger.warning(f"Failed to read dirty rollup minutes: {e}")
+        return []
+    hours = {int(minute) * 60 // 3600 * 3600 for minute in minutes}
+    return [datetime.fromtimestamp(hour, dt_timezone.utc) for hour in sorted(hours)]
+
+
+def _merge_ranges(hours: Iterable[datetime]) -> List[Tuple[datetime, datetime]]:
+    """Agrupa horas consecutivas em intervalos [início, fim)."""
+    ranges = []
+    for hour in sorted(hours):
+        if ranges and ranges[-1][1] == hour:
+            ranges[-1] = (ranges[-1][0], hour + timedelta(hours=1))
+        else:
+            ranges.append((hour, hour + timedelta(hours=1)))
+    return ranges
+
+
+def _hours(start: datetime, end: datetime) -> Iterable[datetime]:
+    while start < end:
+        yield start
+        start += timedelta(hours=1)
+
+
+def _aggregate_logs(start: datetime, end: datetime) -> Dict[Tuple, Dict[str, int]]:
+    """Agrega os logs de [start, end) por (granularidade, dimensão, chave, intervalo)."""
+    rows = (
+        MessageLog.objects.filter(sent_at__gte=start, sent_at__lt=end)
+        .annotate(bucket=TruncMinute('sent_at', tzinfo=dt_timezone.utc))
+        .order_by()
+        .values_list('bucket', 'scheduled_message_id', 'instance_name', 'status')
+        .annotate(count=Count('id'))
+    )
+    buckets: Dict[Tuple, Dict[str, int]] = defaultdict(lambda: dict.fromkeys(METRICS, 0))
+    for minute, schedule_id, instance_name, status, count in rows.iterator():
+        hour = _floor_hour(minute)
+        series = [('all', ''), ('schedule', str(schedule_id))]
+        if instance_name:
+            series.append(('instance', instance_name))
+        for granularity, bucket in (('minute', minute), ('hour', hour)):
+            for dimension, key in series:
+                counters = buckets[(granularity, dimension, key, bucket)]
+                counters['total'] += count
+                for metric in STATUS_METRICS.get(status, ()):
+                    counters[metric] += count
+    return buckets
+
+
+def _rebuild_days(hour_start: datetime, hour_end: datetime):
+    """Refaz as linhas diárias (no fuso do projeto) que contêm as horas de [hour_start, hour_end)."""
+    tz = timezone.get_current_timezone()
+    day_start = timezone.localtime(hour_start, tz).replace(hour=0, minute=0, second=0, microsecond=0)
+    last_hour = timezone.localtime(hour_end - timedelta(hours=1), tz)
+    day_end = last_hour.replace(hour=0, minute=0, second=0, microsecond=0) + timedelta(days=1)
+
+    hours = (
+        SendRollup.objects.filter(granularity='hour', bucket_start__gte=day_start, bucket_start__lt=day_end)
+        .order_by()
+        .values_list('bucket_start', 'dimension', 'key', *METRICS)
+    )
+    sums: Dict[Tuple, Dict[str, int]] = defaultdict(lambda: dict.fromkeys(METRICS, 0))
+    for bucket_start, dimension, key, *values in hours.iterator():
+        day = timezone.localtime(bucket_start, tz).replace(hour=0, minute=0, second=0, microsecond=0)
+        counters = sums[(dimension, key, day)]
+        for metric, value in zip(METRICS, values):
+            counters[metric] += value
+    days = [
+        SendRollup(granularity='day', dimension=dimension, key=key, bucket_start=day, **counters)
+        for (dimension, key, day), counters in sums.items()
+    ]
+    SendRollup.objects.filter(granularity='day', bucket_start__gte=day_start, bucket_start__lt=day_end).delete()
+    SendRollup.objects.bulk_create(days, batch_size=1000)
+
+
+def rebuild_range(start: datetime, end: datetime) -> int:
+    """Recalcula minutos, horas e dias das horas inteiras que cobrem [start, end). Devolve as linhas gravadas."""
+    hour_start, hour_end = _floor_hour(start), _ceil_hour(end)
+    buckets = _aggregate_logs(hour_start, hour_end)
+    rows = [
+        SendRollup(granularity=granularity, dimension=dimension, key=key, bucket_start=bucket, **counters)
+        for (granularity, dimension, key, bucket), counters in buckets.items()
+    ]
+    SendRollup.objects.filter(
+        granularity__in=['minute', 'hour'], bucket_start__gte=hour_start, bucket_start__lt=hour_end
+    ).delete()
+    SendRollup.objects.bulk_create(rows, batch_size=1000)
+    _rebuild_days(hour_start, hour_end)
+    return len(rows)
+
+
+def _lock_checkpoint(horizon: datetime) -> RollupCheckpoint:
+    """Checkpoint travado (select_for_update) até o fim da transação atual, criado na primeira execução."""
+    checkpoint = RollupCheckpoint.objects.select_for_update().filter(name=CHECKPOINT_NAME).first()
+    if checkpoint is None:
+        first_log = MessageLog.objects.aggregate(first=Min('sent_at'))['first']
+        checkpoint = RollupCheckpoint.objects.create(name=CHECKPOINT_NAME, position=first_log or horizon)
+        checkpoint = RollupCheckpoint.objects.select_for_update().get(pk=checkpoint.pk)
+    return checkpoint
+
+
+def run_rollup(now: Optional[datetime] = None) -> Dict[str, int]:
+    """
+    Avança o checkpoint até agora - SEND_ROLLUP_GRACE_SECONDS (margem para transações
+    ainda abertas), em até MAX_WINDOWS_PER_RUN janelas de um dia, e reconsolida as horas marcadas
+    como alteradas. Cada janela (e cada intervalo alterado) é gravada em uma transação própria,
+    com o lock do checkpoint, que serializa execuções concorrentes só durante aquela janela.
+    """
+    now = now or timezone.now()
+    horizon = now - timedelta(seconds=settings.SEND_ROLLUP_GRACE_SECONDS)
+    stats = {'windows': 0, 'dirty_ranges': 0, 'rows': 0}
+
+    with transaction.atomic():
+        position = _lock_checkpoint(horizon).position
+
+    # As horas a partir do checkpoint serão refeitas pelas janelas abaixo
+    ranges = _merge_ranges(hour for hour in _pop_dirty_hours() if hour < position)
+    for index, (start, end) in enumerate(ranges):
+        try:
+            with transaction.atomic():
+                _lock_checkpoint(horizon)
+                stats['rows'] += rebuild_range(start, end)
+        except Exception:
+            # Devolve ao Redis as horas que não foram recalculadas, para a próxima execução
+            mark_dirty(hour for range_start, range_end in ranges[index:]
+                       for hour in _hours(range_start, range_end))
+            raise
+        stats['dirty_ranges'] += 1
+
+    while stats['windows'] < MAX_WINDOWS_PER_RUN:
+        with transaction.atomic():
+            checkpoint = _lock_checkpoint(horizon)
+            if checkpoint.position >= horizon:
+                break
+            end = min(checkpoint.position + MAX_WINDOW, horizon)
+            stats['rows'] += rebuild_range(checkpoint.position, end)
+            checkpoint.position = end
+            checkpoint.save(update_fields=['position', 'updated_at'])
+        stats['windows'] += 1
+
+    retention = now - timedelta(days=settings.SEND_ROLLUP_MINUTE_RETENTION_DAYS)
+    SendRollup.objects.filter(granularity='minute', bucket_start__lt=retention).delete()
+    return stats
+
+
+def choose_granularity(start: datetime, end: datetime, max_points: int) -> str:
+    """Granularidade mais fina que cabe em `max_points` pontos (minutos só dentro da retenção)."""
+    minute_floor = timezone.now() - timedelta(days=settings.SEND_ROLLUP_MINUTE_RETENTION_DAYS)
+    span = (end - start).total_seconds()
+    for granularity, size in GRANULARITIES.items():
+        if granularity == 'minute' and start < minute_floor:
+            continue
+        if span / size <= max_points:
+            return granularity
+    return 'day'
+
+
+def timeseries(start: datetime, end: datetime, granularity: str, max_points: int,
+               dimension: str = 'all', key: str = '') -> Dict:
+    """
+    Série de [start, end) na granularidade pedida, com intervalos vazios preenchidos com zero.
+    Se passar de `max_points`, intervalos consecutivos são somados (downsampling).
+    """
+    size = GRANULARITIES[granularity]
+    if granularity == 'day':
+        tz = timezone.get_current_timezone()
+        start = timezone.localtime(start, tz).replace(hour=0, minute=0, second=0, microsecond=0)
+    else:
+        start = datetime.fromtimestamp(int(start.timestamp()) // size * size, dt_timezone.utc)
+    buckets = max(1, math.ceil((end - start).total_seconds() / size))
+    step = max(1, math.ceil(buckets / max_points))
+
+    rows = SendRollup.objects.filter(
+        granularity=granularity, dimension=dimension, key=key, bucket_start__gte=start, bucket_start__lt=end,
+    ).values_list('bucket_start', *METRICS)
+
+    points = [dict.fromkeys(METRICS, 0) for _ in range(math.ceil(buckets / step))]
+    for bucket_start, *values in rows:
+        index = int((bucket_start - start).total_seconds() // size) // step
+        if 0 <= index < len(points):
+            for metric, value in zip(METRICS, values):
+                points[index][metric] += value
+
+    tz = timezone.get_current_timezone()
+    series = []
+    for index, counters in enumerate(points):
+        point_start = start + timedelta(seconds=index * step * size)
+        done = counters['sent'] + counters['failed']
+        series.append({
+            'start': timezone.localtime(point_start, tz).isoformat(),
+            **counters,
+            'failure_rate': round(counters['failed'] / done, 4) if done else None,
+        })
+    return {
+        'granularity': granularity,
+        'step_seconds': step * size,
+        'dimension': dimension,
+        'key': key,
+        'points': series,
+    }
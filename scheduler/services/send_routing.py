@@ -0,0 +1,48 @@
+# scheduler/services/send_routing.py
+"""
+Rota (fila do Celery) de cada envio de agendamento.
+
+A rota vai como kwarg `route` de process_scheduled_message, na PeriodicTask (modo
+periodic_task), ou de process_scheduled_batch, no enfileiramento do dispatcher (um
+lote por rota), e o roteador em
+whatsapp_scheduler/celery.py a converte na fila de SEND_QUEUES. Assim o roteamento
+não consulta o banco na publicação.
+"""
+from typing import Dict, Iterable
+
+from ..models import MessageTemplate, ScheduledMessage
+
+ROUTES = ('high', 'text', 'media', 'bulk')
+
+
+def send_route(priority: str, media_type: str) -> str:
+    """
+    'high' para agendamentos de prioridade alta; 'bulk' para os de prioridade baixa;
+    'media' para mídias (uploads pesados); 'text' para o restante.
+    """
+    if priority == 'high':
+        return 'high'
+    if priority == 'low':
+        return 'bulk'
+    if media_type and media_type != 'text':
+        return 'media'
+    return 'text'
+
+
+def schedule_routes(schedules: Iterable[ScheduledMessage]) -> Dict:
+    """{id do agendamento: rota}, com uma única consulta para o tipo de mídia dos templates."""
+    schedules = list(schedules)
+    template_ids = {schedule.message_template_id for schedule in schedules}
+    media_types = dict(MessageTemplate.objects.filter(id__in=template_ids).values_list('id', 'media_type'))
+    return {
+        schedule.id: send_route(schedule.priority, media_types.get(schedule.message_template_id))
+        for schedule in schedules
+    }
+
+
+def routes_for_ids(schedule_ids: Iterable) -> Dict:
+    """{id: rota} direto do banco (um JOIN), para quem só tem os ids (ex.: dispatcher)."""
+    rows = ScheduledMessage.objects.filter(id__in=list(schedule_ids)).values_list(
+        'id', 'priority', 'message_template__media_type'
+    )
+    return {schedule_id: send_route(priority, media_type) for schedule_id, priority, media_type in rows}
@@ -0,0 +1,185 @@
+# scheduler/services/template_renderer.py
+import string
+import threading
+from collections import OrderedDict
+from datetime import datetime
+from typing import Any, Dict, List, Optional, Sequence, Tuple, Union
+
+from django.conf import settings
+from django.utils import timezone
+
+# Variáveis de cada destinatário; as demais valem para o envio inteiro
+RECIPIENT_FIELDS = ('name', 'first_name', 'phone')
+
+# Um trecho do plano: texto literal ou (variável, format_spec, texto original do placeholder)
+Segment = Union[str, Tuple[str, str, str]]
+
+_formatter = string.Formatter()
+
+
+def compile_content(content: str) -> Tuple[Segment, ...]:
+    """
+    Compila o conteúdo em um plano de renderização com string.Formatter.parse.
+    Placeholders aceitos: {variavel} e {variavel:formato}; chaves literais com {{ e }}.
+    Conteúdo com chaves malformadas é enviado como está (sem placeholders).
+    """
+    try:
+        parsed = list(_formatter.parse(content))
+    except ValueError:
+        return (content,)
+
+    segments: List[Segment] = []
+    for literal, field, spec, conversion in parsed:
+        if literal:
+            segments.append(literal)
+        if field is None:
+            continue
+        if not field.isidentifier() or conversion:
+            # {0}, {a.b}, {x!r}...: não são variáveis do template, seguem como texto
+            segments.append('{' + field + (f'!{conversion}' if conversion else '') + (f':{spec}' if spec else '') + '}')
+            continue
+        original = '{' + field + (f':{spec}' if spec else '') + '}'
+        segments.append((field, spec or '', original))
+    return _merge_literals(segments)
+
+
+def _merge_literals(segments) -> Tuple[Segment, ...]:
+    merged: List[Segment] = []
+    for segment in segments:
+        if isinstance(segment, str) and merged and isinstance(merged[-1], str):
+            merged[-1] += segment
+        elif segment != '':
+            merged.append(segment)
+    return tuple(merged)
+
+
+def _format(value: Any, spec: str, original: str) -> str:
+    if not spec:
+        return str(value)
+    try:
+        return format(value, spec)
+    except (TypeError, ValueError):
+        return original
+
+
+def bind(plan: Tuple[Segment, ...], context: Dict[str, Any]) -> Tuple[Segment, ...]:
+    """
+    Resolve no plano as variáveis presentes em `context` (as do envio inteiro), deixando
+    só as de destinatário. Variáveis desconhecidas voltam a ser o texto original.
+    """
+    bound = []
+    for segment in plan:
+        if isinstance(segment, str):
+            bound.append(segment)
+            continue
+        field, spec, original = segment
+        if field in RECIPIENT_FIELDS:
+            bound.append(segment)
+        elif field in context:
+            bound.append(_format(context[field], spec, original))
+        else:
+            bound.append(original)
+    return _merge_literals(bound)
+
+
+def _recipient_format(plan: Tuple[Segment, ...]) -> str:
+    """
+    Converte um plano já resolvido (só variáveis de destinatário) em uma string para
+    str.format_map, que faz a passada por destinatário em C. Formatos inválidos para
+    texto viram o placeholder literal.
+    """
+    parts = []
+    for segment in plan:
+        if isinstance(segment, str):
+            parts.append(segment.replace('{', '{{').replace('}', '}}'))
+        elif _format('', segment[1], None) is None:
+            parts.append(segment[2].replace('{', '{{').replace('}', '}}'))
+        else:
+            parts.append('{' + segment[0] + (f':{segment[1]}' if segment[1] else '') + '}')
+    return ''.join(parts)
+
+
+def send_context(scheduled_message, when: Optional[datetime] = None) -> Dict[str, Any]:
+    """
+    Variáveis comuns a todos os destinatários de um envio: as personalizadas do
+    agendamento (template_variables) e as embutidas, que têm precedência.
+    """
+    when = timezone.localtime(when or timezone.now())
+    return {
+        **(scheduled_message.template_variables or {}),
+        'title': scheduled_message.title,
+        'date': when.strftime('%d/%m/%Y'),
+        'time': when.strftime('%H:%M'),
+    }
+
+
+class TemplateRenderer:
+    """
+    Renderização de MessageTemplate.content com variáveis por destinatário.
+
+    Cada template é compilado uma única vez em um plano (literais + placeholders),
+    guardado em um LRU por processo com a chave (id, updated_at): editar o template
+    muda a chave e invalida a entrada naturalmente. render_many resolve primeiro as
+    variáveis do envio e depois percorre os destinatários só com as que variam; um
+    template sem placeholders de destinatário devolve o mesmo texto para todos.
+    """
+
+    def __init__(self, max_entries: int = None):
+        self.max_entries = max_entries if max_entries is not None else settings.TEMPLATE_RENDER_CACHE_SIZE
+        self._lock = threading.Lock()
+        self._plans: "OrderedDict[Tuple, Tuple[Segment, ...]]" = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+
+    def get_plan(self, template) -> Tuple[Segment, ...]:
+        key = (str(template.pk), template.updated_at)
+        with self._lock:
+            plan = self._plans.get(key)
+            if plan is not None:
+                self._plans.move_to_end(key)
+                self.hits += 1
+                return plan
+        plan = compile_content(template.content)
+        with self._lock:
+            self.misses += 1
+            self._plans[key] = plan
+            while len(self._plans) > self.max_entries:
+                self._plans.popitem(last=False)
+        return plan
+
+    def render_many(self, template, recipients: Sequence[Dict[str, Any]], context: Dict[str, Any]) -> List[str]:
+        """
+        Renderiza o template para cada destinatário ({'phone_number', 'name'}), na
+        mesma ordem. `context` são as variáveis do envio (ver send_context).
+        """
+        plan = bind(self.get_plan(template), context)
+        if all(isinstance(segment, str) for segment in plan):
+            text = plan[0] if plan else ''
+            return [text] * len(recipients)
+
+        format_map = _recipient_format(plan).format_map
+        texts = []
+        for recipient in recipients:
+            name = recipient.get('name') or ''
+            texts.append(format_map({
+                'name': name,
+                'first_name': name.split(' ', 1)[0],
+                'phone': recipient.get('phone_number') or '',
+            }))
+        return texts
+
+    def clear(self):
+        with self._lock:
+            self._plans.clear()
+
+    def stats(self) -> Dict[str, int]:
+        with self._lock:
+            return {
+                'entries': len(self._plans),
+                'max_entries': self.max_entries,
+                'hits': self.hits,
+                'misses': self.misses,
+            }
+
+
+template_renderer = TemplateRenderer()
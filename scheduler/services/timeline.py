@@ -0,0 +1,129 @@
+# scheduler/services/timeline.py
+import heapq
+from collections import Counter
+from datetime import datetime, timedelta, timezone as dt_timezone
+from typing import Dict, Any, Optional
+
+from django.conf import settings
+from django.core.cache import cache
+from django.utils import timezone
+
+from ..models import ScheduledMessage
+from ..utils.recurrence import next_occurrence
+
+VERSION_KEY = 'timeline:version'
+BUCKETS = {'hour': 3600, 'day': 86400}
+# Campos que mudam a expansão; next_execution/last_sent avançados por um envio não mudam a regra
+TIMELINE_FIELDS = ('title', 'status', 'frequency', 'start_date', 'end_date', 'day_of_week', 'day_of_month')
+
+
+def invalidate_timeline():
+    """Invalida todas as expansões em cache (chamado quando um agendamento muda)."""
+    try:
+        cache.incr(VERSION_KEY)
+    except ValueError:
+        cache.set(VERSION_KEY, 1, timeout=None)
+
+
+def _version() -> int:
+    version = cache.get(VERSION_KEY)
+    if version is None:
+        cache.add(VERSION_KEY, 1, timeout=None)
+        version = cache.get(VERSION_KEY, 1)
+    return version
+
+
+def _first_in_window(frequency, start_date, next_execution, window_start, day_of_week, day_of_month):
+    """Primeira ocorrência >= window_start, sem percorrer as execuções já atrasadas uma a uma."""
+    occurrence = next_execution
+    if occurrence < window_start and frequency != 'once':
+        # next_occurrence é estritamente depois do dia da base: partir da véspera cobre o próprio dia.
+        # A base vai em UTC, como em calculate_next_execution: um ?start= com outro fuso mudaria o horário
+        base = (window_start - timedelta(days=1)).astimezone(dt_timezone.utc)
+        occurrence = next_occurrence(frequency, start_date, base, day_of_week, day_of_month)
+    while occurrence is not None and occurrence < window_start:
+        if frequency == 'once':
+            return None
+        occurrence = next_occurrence(frequency, start_date, occurrence, day_of_week, day_of_month)
+    return occurrence
+
+
+# Depois da primeira ocorrência normalizada, diária e semanal têm passo fixo em UTC
+FIXED_STEPS = {'daily': 86400, 'weekly': 7 * 86400}
+
+
+def expand(window_start: datetime, window_end: datetime):
+    """
+    Gera (timestamp, id, título) de cada envio previsto dos agendamentos ativos
+    dentro de [window_start, window_end), respeitando end_date.
+    """
+    rows = (
+        ScheduledMessage.objects.filter(status='active', next_execution__isnull=False, next_execution__lt=window_end)
+        .order_by()
+        .values_list('id', 'title', 'frequency', 'start_date', 'end_date', 'next_execution', 'day_of_week', 'day_of_month')
+    )
+    for schedule_id, title, frequency, start_date, end_date, next_execution, day_of_week, day_of_month in rows.iterator(chunk_size=5000):
+        limit = min(window_end, end_date + timedelta(microseconds=1)) if end_date else window_end
+        occurrence = _first_in_window(frequency, start_date, next_execution, window_start, day_of_week, day_of_month)
+        if occurrence is None or occurrence >= limit:
+            continue
+        yield occurrence.timestamp(), schedule_id, title
+        occurrence = next_occurrence(frequency, start_date, occurrence, day_of_week, day_of_month)
+        step = FIXED_STEPS.get(frequency)
+        if step and occurrence is not None:
+            # Aritmética inteira em vez de operações de datetime a cada ocorrência
+            timestamp, limit_timestamp = occurrence.timestamp(), limit.timestamp()
+            while timestamp < limit_timestamp:
+                yield timestamp, schedule_id, title
+                timestamp += step
+            continue
+        while occurrence is not None and occurrence < limit:
+            yield occurrence.timestamp(), schedule_id, title
+            occurrence = next_occurrence(frequency, start_date, occurrence, day_of_week, day_of_month)
+
+
+def build_timeline(window_start: datetime, window_end: datetime, bucket: Optional[str] = None,
+                   limit: int = 1000) -> Dict[str, Any]:
+    """
+    Expande as recorrências na janela. Com `bucket` ('hour'/'day') devolve a contagem
+    de envios por intervalo (no fuso do projeto); sem, devolve as primeiras `limit` ocorrências.
+    """
+    data = {'start': window_start.isoformat(), 'end': window_end.isoformat(), 'bucket': bucket}
+    occurrences = expand(window_start, window_end)
+
+    if bucket:
+        size = BUCKETS[bucket]
+        # Os buckets seguem o fuso do projeto; o deslocamento é fixo dentro da janela salvo em
+        # transições de horário de verão, onde o bucket vizinho absorve a diferença de uma hora.
+        offset = int(timezone.localtime(window_start).utcoffset().total_seconds())
+        counts = Counter((int(timestamp) + offset) // size for timestamp, _, _ in occurrences)
+        tz = timezone.get_current_timezone()
+        data['total'] = sum(counts.values())
+        data['buckets'] = [
+            {
+                'start': datetime.fromtimestamp(key * size - offset, tz).isoformat(),
+                'count': counts[key],
+            }
+            for key in sorted(counts)
+        ]
+        return data
+
+    first = heapq.nsmallest(limit + 1, occurrences, key=lambda item: item[0])
+    tz = timezone.get_current_timezone()
+    data['truncated'] = len(first) > limit
+    data['occurrences'] = [
+        {'schedule_id': str(schedule_id), 'title': title, 'at': datetime.fromtimestamp(timestamp, tz).isoformat()}
+        for timestamp, schedule_id, title in first[:limit]
+    ]
+    return data
+
+
+def get_timeline(window_start: datetime, window_end: datetime, bucket: Optional[str] = None,
+                 limit: int = 1000) -> Dict[str, Any]:
+    """build_timeline com cache, invalidado sempre que um agendamento é alterado."""
+    key = f"timeline:{_version()}:{window_start.timestamp()}:{window_end.timestamp()}:{bucket}:{limit}"
+    data = cache.get(key)
+    if data is None:
+        data = build_timeline(window_start, window_end, bucket, limit)
+        cache.set(key, data, timeout=settings.TIMELINE_CACHE_SECONDS)
+    return data
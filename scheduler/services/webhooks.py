@@ -0,0 +1,266 @@
+# scheduler/services/webhooks.py
+"""
+Ingestão dos webhooks da Evolution API (recibos de entrega e leitura).
+
+O endpoint só empilha o corpo cru numa lista do Redis (limitada a
+WEBHOOK_QUEUE_MAX_LENGTH) e responde 202; a task apply_webhook_events consome a
+fila em lotes, mantém o status mais avançado de cada mensagem e aplica tudo com
+UPDATEs em conjunto, pela chave primária, depois de localizar os logs pelo índice
+de evolution_message_id.
+
+Cada lote é movido para uma lista de processamento e só é descartado depois que
+os recibos foram gravados; se o worker cair no meio, a execução seguinte
+reprocessa o lote (os recibos só avançam o status, então reaplicar não duplica).
+Recibos que chegam antes de o log ter o evolution_message_id gravado ficam num
+hash à parte e são tentados de novo nas execuções seguintes, por até
+WEBHOOK_UNMATCHED_TTL_SECONDS.
+"""
+import json
+import logging
+import time
+from collections import Counter
+from typing import Dict, Iterable, Iterator, List, Set, Tuple
+
+from django.conf import settings
+from django.db import transaction
+from django.db.models import Value
+from django.db.models.functions import Coalesce
+from django.utils import timezone
+
+from ..models import MessageLog
+from .dashboard_counters import dashboard_counters
+from .metrics import RECEIPTS
+from .redis_client import get_redis
+from .rollups import mark_dirty
+
+logger = logging.getLogger(__name__)
+
+QUEUE_KEY = 'webhooks:evolution'
+PROCESSING_KEY = 'webhooks:evolution:processing'
+UNMATCHED_KEY = 'webhooks:evolution:unmatched'
+LOCK_KEY = 'webhooks:evolution:lock'
+# Tempo máximo de uma execução de process_queue com o lock da fila
+LOCK_TIMEOUT = 300
+UPDATE_EVENTS = {'messages.update', 'messages_update'}
+ID_CHUNK_SIZE = 1000
+
+# Status da Evolution (Baileys) -> status do MessageLog
+RECEIPT_STATUSES = {
+    'DELIVERY_ACK': 'delivered',
+    'READ': 'read',
+    'PLAYED': 'read',
+}
+# De quais status cada recibo pode avançar (nunca regride nem altera falhas)
+ADVANCES_FROM = {
+    'delivered': ('pending', 'sent'),
+    'read': ('pending', 'sent', 'delivered'),
+}
+RANK = {'delivered': 1, 'read': 2}
+
+
+# Inclui o evento só se a fila não estiver cheia (devolve 0 nesse caso)
+_ENQUEUE_SCRIPT = """
+if redis.call('LLEN', KEYS[1]) >= tonumber(ARGV[2]) then
+    return 0
+end
+return redis.call('RPUSH', KEYS[1], ARGV[1])
+"""
+
+# Equivalente em lote de LMOVE: move até ARGV[1] eventos da fila para a lista de
+# processamento. Um lote não confirmado (worker caiu) é devolvido de novo.
+_MOVE_SCRIPT = """
+local pending = redis.call('LRANGE', KEYS[2], 0, -1)
+if #pending > 0 then
+    return pending
+end
+local items = redis.call('LRANGE', KEYS[1], 0, tonumber(ARGV[1]) - 1)
+for i = 1, #items, 1000 do
+    redis.call('RPUSH', KEYS[2], unpack(items, i, math.min(i + 999, #items)))
+end
+redis.call('LTRIM', KEYS[1], #items, -1)
+return items
+"""
+
+
+class WebhookQueueFull(Exception):
+    """A fila de webhooks chegou a WEBHOOK_QUEUE_MAX_LENGTH eventos."""
+
+
+def enqueue(body: bytes) -> int:
+    """Empilha o corpo cru de um webhook. Devolve o tamanho da fila após a inclusão."""
+    length = get_redis().eval(_ENQUEUE_SCRIPT, 1, QUEUE_KEY, body, settings.WEBHOOK_QUEUE_MAX_LENGTH)
+    if not length:
+        raise WebhookQueueFull(f"Fila de webhooks cheia ({settings.WEBHOOK_QUEUE_MAX_LENGTH} eventos).")
+    return length
+
+
+def pop_batch(size: int) -> List[str]:
+    """
+    Move de forma atômica até `size` eventos do início da fila para a lista de
+    processamento e os devolve. Se um lote anterior não foi confirmado, devolve esse lote.
+    """
+    return get_redis().eval(_MOVE_SCRIPT, 2, QUEUE_KEY, PROCESSING_KEY, size)
+
+
+def ack_batch():
+    """Descarta o lote em processamento, depois que os recibos foram gravados."""
+    get_redis().delete(PROCESSING_KEY)
+
+
+def _events(payload) -> Iterator[Dict]:
+    """Normaliza os formatos (evento único, lista de eventos, `data` como lista)."""
+    if isinstance(payload, list):
+        for item in payload:
+            yield from _events(item)
+        return
+    if not isinstance(payload, dict):
+        return
+    event = str(payload.get('event', '')).lower().replace('-', '.')
+    if event not in UPDATE_EVENTS:
+        return
+    data = payload.get('data')
+    for item in data if isinstance(data, list) else [data]:
+        if isinstance(item, dict):
+            yield item
+
+
+def parse_receipts(raw_events: Iterable[str]) -> Tuple[Dict[str, str], int]:
+    """
+    Extrai {evolution_message_id: status} dos eventos, mantendo o status mais
+    avançado de cada mensagem. Devolve também a quantidade de eventos descartados.
+    """
+    receipts: Dict[str, str] = {}
+    skipped = 0
+    for raw in raw_events:
+        try:
+            payload = json.loads(raw)
+        except ValueError:
+            skipped += 1
+            continue
+        for data in _events(payload):
+            update = data.get('update') if isinstance(data.get('update'), dict) else {}
+            status = RECEIPT_STATUSES.get(str(data.get('status') or update.get('status') or '').upper())
+            key = data.get('key') if isinstance(data.get('key'), dict) else {}
+            message_id = data.get('keyId') or key.get('id') or data.get('messageId') or data.get('id')
+            if not status or not message_id:
+                skipped += 1
+                continue
+            if RANK[status] > RANK.get(receipts.get(message_id), 0):
+                receipts[message_id] = status
+    return receipts, skipped
+
+
+def apply_receipts(receipts: Dict[str, str]) -> Tuple[int, Set[str]]:
+    """
+    Aplica os recibos em lotes de IDs, com um SELECT e até dois UPDATEs (um por status) por lote.
+    Devolve a quantidade de logs atualizados e os IDs sem log correspondente.
+    """
+    by_id = list(receipts.items())
+    now = timezone.now()
+    applied = 0
+    unmatched = set(receipts)
+    for start in range(0, len(by_id), ID_CHUNK_SIZE):
+        chunk = dict(by_id[start:start + ID_CHUNK_SIZE])
+        with transaction.atomic():
+            rows = MessageLog.objects.filter(
+                evolution_message_id__in=list(chunk),
+            ).order_by().values_list('id', 'evolution_message_id', 'status', 'sent_at')
+
+            targets: Dict[str, List] = {'delivered': [], 'read': []}
+            changes, sent_ats = [], []
+            for pk, message_id, status, sent_at in rows:
+                unmatched.discard(message_id)
+                new_status = chunk[message_id]
+                if status in ADVANCES_FROM[new_status]:
+                    targets[new_status].append(pk)
+                    changes.append((status, new_status))
+                    sent_ats.append(sent_at)
+
+            # UPDATE pela chave primária: trava só as linhas afetadas, não faixas do índice
+            for new_status, pks in targets.items():
+                if not pks:
+                    continue
+                updated = MessageLog.objects.filter(pk__in=pks).update(
+                    status=new_status, delivered_at=Coalesce('delivered_at', Value(now)),
+                )
+                RECEIPTS.labels(new_status).inc(updated)
+                applied += updated
+            dashboard_counters.transitions('log', changes)
+            mark_dirty(sent_ats)
+    return applied, unmatched
+
+
+def _stash_unmatched(receipts: Dict[str, str], now: float):
+    """Guarda os recibos sem log para nova tentativa, mantendo o prazo original e o status mais avançado."""
+    if not receipts:
+        return
+    client = get_redis()
+    ids = list(receipts)
+    stashed = {}
+    for message_id, previous in zip(ids, client.hmget(UNMATCHED_KEY, ids)):
+        status, expires_at = receipts[message_id], now + settings.WEBHOOK_UNMATCHED_TTL_SECONDS
+        if previous:
+            previous_status, previous_expires_at = previous.split(':', 1)
+            expires_at = float(previous_expires_at)
+            if RANK[previous_status] > RANK[status]:
+                status = previous_status
+        stashed[message_id] = f'{status}:{expires_at}'
+    client.hset(UNMATCHED_KEY, mapping=stashed)
+
+
+def _retry_unmatched(now: float, stats: Counter):
+    """Tenta de novo os recibos guardados; descarta os aplicados e os que passaram do prazo."""
+    client = get_redis()
+    receipts, done = {}, []
+    for message_id, value in client.hgetall(UNMATCHED_KEY).items():
+        status, expires_at = value.split(':', 1)
+        if float(expires_at) <= now:
+            done.append(message_id)
+            stats['expired'] += 1
+        else:
+            receipts[message_id] = status
+    if receipts:
+        applied, unmatched = apply_receipts(receipts)
+        stats['updated'] += applied
+        stats['retried'] += len(receipts) - len(unmatched)
+        done.extend(message_id for message_id in receipts if message_id not in unmatched)
+    if done:
+        client.hdel(UNMATCHED_KEY, *done)
+
+
+def process_queue(batch_size: int = None, max_batches: int = None) -> Dict[str, int]:
+    """
+    Consome a fila em lotes até esvaziá-la (ou até `max_batches`), depois de tentar de
+    novo os recibos sem log. Um lock no Redis mantém um único consumidor por vez.
+    """
+    batch_size = batch_size or settings.WEBHOOK_BATCH_SIZE
+    max_batches = max_batches or settings.WEBHOOK_MAX_BATCHES
+    stats = Counter()
+    lock = get_redis().lock(LOCK_KEY, timeout=LOCK_TIMEOUT)
+    if not lock.acquire(blocking=False):
+        logger.debug("Webhook queue already being processed")
+        return {}
+    try:
+        now = time.time()
+        _retry_unmatched(now, stats)
+        for _ in range(max_batches):
+            raw_events = pop_batch(batch_size)
+            if not raw_events:
+                break
+            receipts, skipped = parse_receipts(raw_events)
+            stats['batches'] += 1
+            stats['events'] += len(raw_events)
+            stats['skipped'] += skipped
+            stats['receipts'] += len(receipts)
+            applied, unmatched = apply_receipts(receipts)
+            stats['updated'] += applied
+            stats['unmatched'] += len(unmatched)
+            _stash_unmatched({message_id: receipts[message_id] for message_id in unmatched}, now)
+            ack_batch()
+            if len(raw_events) < batch_size:
+                break
+    finally:
+        lock.release()
+    if stats:
+        logger.info(f"Webhook events applied: {dict(stats)}")
+    return dict(stats)
@@ -1,9 +1,17 @@
 # scheduler/signals.py
-import json
-from django.db.models.signals import post_save, post_delete
+from django.conf import settings
+from django.db.models import Count
+from django.db.models.signals import post_init, post_save, pre_delete, post_delete
 from django.dispatch import receiver
 from django_celery_beat.models import PeriodicTask, CrontabSchedule, ClockedSchedule
-from .models import ScheduledMessage
+from .models import Contact, ScheduledMessage, MessageTemplate, MessageLog
+from .services.beat_sync import (
+    SYNC_FIELDS, schedule_spec, signals_suppressed, sync_periodic_tasks, task_fields, task_name,
+)
+from .services.dashboard_counters import dashboard_counters
+from .services.media_cache import media_cache
+from .services.number_validity import number_validity
+from .services.timeline import TIMELINE_FIELDS, invalidate_timeline
 
 @receiver(post_save, sender=ScheduledMessage)
 def create_or_update_periodic_task(sender, instance, created, **kwargs):
@@ -11,76 +19,147 @@ def create_or_update_periodic_task(sender, instance, created, **kwargs):
     Cria ou atualiza uma PeriodicTask correspondente quando um
     ScheduledMessage é salvo.
     """
-    task_name = f'whatsapp-schedule-{instance.id}'
+    # No modo dispatcher o beat não mantém uma tarefa por agendamento:
+    # o disparo é feito pela varredura de next_execution (tasks.dispatch_due_messages).
+    if settings.SCHEDULER_DISPATCH_MODE == 'dispatcher' or signals_suppressed():
+        return
+
+    name = task_name(instance.id)
     # Se o agendamento não estiver 'ativo', desabilitamos a tarefa e saímos.
     if instance.status != 'active':
-        PeriodicTask.objects.filter(name=task_name).update(enabled=False)
+        PeriodicTask.objects.filter(name=name).update(enabled=False)
         return
 
-    schedule = None
-    schedule_type = None
-
-    if instance.frequency == 'once':
-        schedule, _ = ClockedSchedule.objects.get_or_create(clocked_time=instance.start_date)
-        schedule_type = 'clocked'
-
-    elif instance.frequency == 'daily':
-        schedule, _ = CrontabSchedule.objects.get_or_create(
-            minute=instance.start_date.minute, hour=instance.start_date.hour,
-            day_of_week='*', day_of_month='*', month_of_year='*'
-        )
-        schedule_type = 'crontab'
-
-    elif instance.frequency == 'weekly' and instance.day_of_week is not None:
-        schedule, _ = CrontabSchedule.objects.get_or_create(
-            minute=instance.start_date.minute, hour=instance.start_date.hour,
-            day_of_week=instance.day_of_week
-        )
-        schedule_type = 'crontab'
-
-    elif instance.frequency == 'monthly' and instance.day_of_month is not None:
-        schedule, _ = CrontabSchedule.objects.get_or_create(
-            minute=instance.start_date.minute, hour=instance.start_date.hour,
-            day_of_month=instance.day_of_month
-        )
-        schedule_type = 'crontab'
-
-    # <<< ADICIONADO ESTE BLOCO PARA CORRIGIR A FALHA >>>
-    elif instance.frequency == 'yearly':
-        schedule, _ = CrontabSchedule.objects.get_or_create(
-            minute=instance.start_date.minute,
-            hour=instance.start_date.hour,
-            day_of_month=instance.start_date.day,
-            month_of_year=instance.start_date.month
-        )
-        schedule_type = 'crontab'
-    # <<< FIM DO BLOCO ADICIONADO >>>
-
+    schedule_type, lookup = schedule_spec(instance)
     if not schedule_type:
         # Se a frequência não for válida ou não tiver os dados necessários, desabilita e sai
-        PeriodicTask.objects.filter(name=task_name).update(enabled=False)
+        PeriodicTask.objects.filter(name=name).update(enabled=False)
         return
 
-    task_data = {
-        'task': 'scheduler.tasks.process_scheduled_message',
-        'name': task_name,
-        'kwargs': json.dumps({'schedule_id': str(instance.id)}),
-        'args': '[]',
-        'enabled': True,
-        'one_off': instance.frequency == 'once',
-    }
+    model = ClockedSchedule if schedule_type == 'clocked' else CrontabSchedule
+    schedule, _ = model.objects.get_or_create(**lookup)
+    PeriodicTask.objects.update_or_create(name=name, defaults=task_fields(instance, schedule_type, schedule))
 
-    # Limpa os campos de agendamento antes de definir o correto
-    task_data.update({
-        'interval': None, 'crontab': None, 'solar': None, 'clocked': None
-    })
-    task_data[schedule_type] = schedule
-    PeriodicTask.objects.update_or_create(name=task_name, defaults=task_data)
+@receiver(post_save, sender=ScheduledMessage)
+def precheck_schedule_recipient(sender, instance, created, **kwargs):
+    """
+    Verifica em segundo plano se o número do contato está no WhatsApp, para que o
+    envio já encontre o resultado no cache de validação.
+    """
+    if not created or signals_suppressed() or not instance.contact_id:
+        return
+    phone_number = Contact.objects.filter(pk=instance.contact_id).values_list('phone_number', flat=True).first()
+    if phone_number:
+        number_validity.schedule_precheck([phone_number])
 
 @receiver(post_delete, sender=ScheduledMessage)
 def delete_periodic_task(sender, instance, **kwargs):
     """
     Deleta a PeriodicTask correspondente quando um ScheduledMessage é deletado.
     """
-    task_name = f'whatsapp-schedule-{instance.id}'
-    PeriodicTask.objects.filter(name=task_name).delete()
+    if signals_suppressed():
+        return
+    PeriodicTask.objects.filter(name=task_name(instance.id)).delete()
+
+
+@receiver(post_init, sender=MessageTemplate)
+def remember_template_media_type(sender, instance, **kwargs):
+    """Guarda o media_type carregado para saber, no post_save, se a rota dos envios mudou."""
+    instance._routed_media_type = instance.__dict__.get('media_type')
+
+
+@receiver(post_save, sender=MessageTemplate)
+def reroute_template_schedules(sender, instance, created, update_fields=None, **kwargs):
+    """
+    O media_type entra na rota (fila) dos envios gravada nas PeriodicTasks: ao mudar,
+    ressincroniza em lote as tarefas dos agendamentos ativos que usam o template.
+    """
+    if update_fields is not None and 'media_type' not in update_fields:
+        # O media_type em memória não foi gravado: a rota no banco continua a mesma
+        return
+    previous, instance._routed_media_type = instance._routed_media_type, instance.media_type
+    if created or previous == instance.media_type or settings.SCHEDULER_DISPATCH_MODE == 'dispatcher':
+        return
+    sync_periodic_tasks(list(
+        ScheduledMessage.objects.filter(message_template=instance, status='active').only(*SYNC_FIELDS)
+    ))
+
+
+@receiver(post_save, sender=MessageTemplate)
+@receiver(post_delete, sender=MessageTemplate)
+def invalidate_template_media(sender, instance, **kwargs):
+    """
+    Descarta o payload de mídia em cache do template quando ele é alterado ou removido.
+    Nos demais processos a chave (arquivo, updated_at) já deixa de bater sozinha.
+    """
+    media_cache.invalidate_template(instance.pk)
+
+
+@receiver(post_init, sender=ScheduledMessage)
+def remember_timeline_fields(sender, instance, **kwargs):
+    """Guarda os campos carregados que entram na linha do tempo (os adiados ficam de fora)."""
+    instance._timeline_fields = {field: instance.__dict__[field] for field in TIMELINE_FIELDS if field in instance.__dict__}
+
+
+@receiver(post_save, sender=ScheduledMessage)
+def invalidate_schedule_timeline(sender, instance, created, update_fields=None, **kwargs):
+    """
+    Invalida a expansão da linha do tempo em cache quando um agendamento é criado ou
+    muda recorrência, título ou status. O save de cada envio (next_execution, last_sent)
+    não invalida.
+    """
+    previous, instance._timeline_fields = instance._timeline_fields, {
+        field: instance.__dict__[field] for field in TIMELINE_FIELDS if field in instance.__dict__
+    }
+    if signals_suppressed():
+        return
+    fields = TIMELINE_FIELDS if update_fields is None else [field for field in TIMELINE_FIELDS if field in update_fields]
+    if created or any(instance.__dict__.get(field) != previous.get(field) for field in fields):
+        invalidate_timeline()
+
+
+@receiver(post_delete, sender=ScheduledMessage)
+def invalidate_deleted_schedule_timeline(sender, instance, **kwargs):
+    """Invalida a linha do tempo em cache quando um agendamento é removido."""
+    if signals_suppressed():
+        return
+    invalidate_timeline()
+
+
+@receiver(post_init, sender=ScheduledMessage)
+def remember_schedule_status(sender, instance, **kwargs):
+    """Guarda o status carregado para calcular a transição no post_save (sem consulta extra)."""
+    instance._counted_status = instance.__dict__.get('status')
+
+
+@receiver(post_save, sender=ScheduledMessage)
+def count_schedule_status(sender, instance, created, update_fields=None, **kwargs):
+    """
+    Atualiza os contadores do dashboard quando um agendamento é criado ou muda de status.
+    """
+    if signals_suppressed() or (update_fields is not None and 'status' not in update_fields):
+        return
+    previous = None if created else instance._counted_status
+    if created or previous:
+        dashboard_counters.transition('schedule', previous, instance.status)
+    instance._counted_status = instance.status
+
+
+@receiver(pre_delete, sender=ScheduledMessage)
+def collect_schedule_log_counts(sender, instance, **kwargs):
+    """Conta, antes do CASCADE, os logs do agendamento que vão ser removidos."""
+    if signals_suppressed():
+        return
+    instance._deleted_log_counts = dict(
+        MessageLog.objects.filter(scheduled_message=instance).order_by()
+        .values_list('status').annotate(count=Count('id'))
+    )
+
+
+@receiver(post_delete, sender=ScheduledMessage)
+def count_schedule_deletion(sender, instance, **kwargs):
+    """Desconta dos contadores o agendamento removido e seus logs."""
+    if signals_suppressed():
+        return
+    dashboard_counters.transition('schedule', instance._counted_status or instance.status, None)
+    dashboard_counters.removed('log', getattr(instance, '_deleted_log_counts', {}))
@@ -1,89 +1,385 @@
 import logging
+import math
+from datetime import timedelta
 from celery import shared_task
+from django.conf import settings
 from django.utils import timezone
+from django.utils.dateparse import parse_datetime
 from django.db import transaction
-from .models import ScheduledMessage, MessageLog
-from .services.evolution_service import EvolutionAPIService
+from django.db.models import Q
+from .models import MessageLog, ScheduledMessage
+from .services.async_sender import AsyncEvolutionSender, run_routed_fanout
+from .services.dashboard_counters import dashboard_counters
+from .services.group_sync import sync_groups
+from .services.instance_router import instance_router, is_instance_failure
+from .services.media_cache import media_cache
+from .services.metrics import observe_firing_lag
+from .services.number_validity import number_validity
+from .services.log_writer import MessageLogWriter, idempotency_key
+from .services.rollups import run_rollup
+from .services.send_routing import routes_for_ids, send_route
+from .services.template_renderer import send_context, template_renderer
+from .services.webhooks import process_queue as process_webhook_queue
 
 logger = logging.getLogger(__name__)
 
 @shared_task(bind=True, max_retries=3, default_retry_delay=60)
-def process_scheduled_message(self, schedule_id):
+def process_scheduled_message(self, schedule_id, occurrence=None, route=None):
+    """
+    Envia uma ocorrência de um agendamento. `occurrence` (ISO) é o next_execution
+    esperado; sem ele, vale o next_execution atual (disparo por PeriodicTask).
+    `route` só é lido pelo roteador do Celery, para escolher a fila.
+    """
     try:
-        with transaction.atomic():
-            scheduled_message = ScheduledMessage.objects.select_for_update().get(id=schedule_id)
+        scheduled_message = ScheduledMessage.objects.select_related(
+            'message_template', 'contact', 'group'
+        ).get(id=schedule_id)
     except ScheduledMessage.DoesNotExist:
         logger.error(f"ScheduledMessage with ID {schedule_id} not found.")
         return
 
     if scheduled_message.status != 'active':
         logger.info(f"ScheduledMessage {schedule_id} is not active. Status: {scheduled_message.status}. Skipping execution.")
+        ScheduledMessage.objects.filter(id=schedule_id).update(dispatched_at=None)
         return
 
-    message_template = scheduled_message.message_template
-    recipients_data = []
+    occurrence = parse_datetime(occurrence) if occurrence else scheduled_message.next_execution
+    if not _is_pending_occurrence(scheduled_message, occurrence):
+        # Tick duplicado do beat ou task reentregue: a ocorrência já foi reivindicada
+        logger.info(f"ScheduledMessage {schedule_id} occurrence {occurrence} already claimed or not due. Skipping.")
+        return
+
+    recipients_data = _recipients(scheduled_message)
+    if not recipients_data:
+        _fail_recipient_configuration(scheduled_message)
+        return
+
+    # Números que o cache de validação já sabe não estarem no WhatsApp não chegam à API
+    invalid = number_validity.known_invalid(recipient_info['phone_number'] for recipient_info in recipients_data)
+    instances = []
+    # Reserva instância + token de rate limit para todos os destinatários antes de enviar qualquer um
+    for recipient_info in recipients_data:
+        if recipient_info['phone_number'] in invalid:
+            instances.append(None)
+            continue
+        config, wait = instance_router.reserve(recipient_info['phone_number'])
+        if wait:
+            # Reagenda a task em vez de dormir: o worker fica livre para outros envios
+            logger.info(f"ScheduledMessage {schedule_id} rate limited. Retrying in {wait:.2f}s.")
+            raise self.retry(
+                countdown=math.ceil(wait), max_retries=settings.EVOLUTION_RATE_LIMIT_MAX_DEFERRALS,
+                kwargs={'schedule_id': str(schedule_id), 'occurrence': occurrence.isoformat(), 'route': route},
+            )
+        instances.append(config)
+
+    if not _claim(scheduled_message, occurrence):
+        return
+
+    with MessageLogWriter() as log_writer:
+        [(log_entries, texts, skipped)] = _reserve_logs([(scheduled_message, occurrence, recipients_data)], invalid, log_writer)
+        sendable = {log_entry.recipient for log_entry in log_entries}
+        instances = [
+            config for recipient_info, config in zip(recipients_data, instances)
+            if recipient_info['phone_number'] in sendable
+        ]
+        all_recipients_sent_successfully = _send_sequentially(
+            scheduled_message, scheduled_message.message_template, log_entries, texts, instances, log_writer
+        ) and not skipped
+
+    _finish_occurrence(scheduled_message, all_recipients_sent_successfully)
+
+
+@shared_task
+def send_deferred_message(log_id, text, route=None, deferrals=0):
+    """
+    Envia um destinatário reagendado porque o failover encontrou as instâncias restantes
+    no limite de envio. O log continua reservado ('pending'); sem token, a task se
+    reagenda (até EVOLUTION_RATE_LIMIT_MAX_DEFERRALS vezes) em vez de dormir no worker.
+    `route` só é lido pelo roteador do Celery, para escolher a fila.
+    """
+    log_entry = MessageLog.objects.select_related(
+        'scheduled_message__message_template'
+    ).filter(id=log_id, status='pending').first()
+    if log_entry is None:
+        logger.info(f"Deferred MessageLog {log_id} is no longer pending. Skipping.")
+        return
+    scheduled_message = log_entry.scheduled_message
+
+    config, wait = instance_router.reserve(log_entry.recipient)
+    with MessageLogWriter() as log_writer:
+        log_writer.adopt([log_entry])
+        if not wait:
+            sent = _send_sequentially(
+                scheduled_message, scheduled_message.message_template, [log_entry], [text], [config], log_writer,
+                deferrals=deferrals,
+            )
+        elif _defer_send(scheduled_message, log_entry, text, wait, deferrals):
+            return
+        else:
+            log_entry.status = 'failed'
+            log_entry.error_message = 'Limite de reagendamentos por rate limit atingido.'
+            log_entry.sent_at = timezone.now()
+            log_writer.update(log_entry)
+            sent = False
+
+    if not sent and scheduled_message.frequency == 'once' and scheduled_message.status == 'completed':
+        # A ocorrência foi finalizada contando com este envio
+        scheduled_message.status = 'failed'
+        scheduled_message.save(update_fields=['status'])
+
+
+@shared_task
+def process_scheduled_batch(items, route=None):
+    """
+    Envia um lote de ocorrências vencidas do modo dispatcher ([[schedule_id, occurrence ISO], ...]).
+    Cada agendamento é validado e reivindicado como em process_scheduled_message, e os
+    envios de todo o lote saem ao mesmo tempo pelo motor assíncrono, com o rate limit
+    aguardado por envio. `route` só é lido pelo roteador do Celery, para escolher a fila.
+    """
+    occurrences = {str(schedule_id): parse_datetime(occurrence) for schedule_id, occurrence in items}
+    schedules = {
+        str(scheduled_message.id): scheduled_message
+        for scheduled_message in ScheduledMessage.objects.select_related(
+            'message_template', 'contact', 'group'
+        ).filter(id__in=list(occurrences))
+    }
+
+    claimed, inactive = [], []
+    for schedule_id, occurrence in occurrences.items():
+        scheduled_message = schedules.get(schedule_id)
+        if scheduled_message is None:
+            logger.error(f"ScheduledMessage with ID {schedule_id} not found.")
+            continue
+        if scheduled_message.status != 'active':
+            logger.info(f"ScheduledMessage {schedule_id} is not active. Status: {scheduled_message.status}. Skipping execution.")
+            inactive.append(scheduled_message.id)
+            continue
+        if not _is_pending_occurrence(scheduled_message, occurrence):
+            logger.info(f"ScheduledMessage {schedule_id} occurrence {occurrence} already claimed or not due. Skipping.")
+            continue
+        recipients_data = _recipients(scheduled_message)
+        if not recipients_data:
+            _fail_recipient_configuration(scheduled_message)
+            continue
+        if _claim(scheduled_message, occurrence):
+            claimed.append((scheduled_message, occurrence, recipients_data))
+    if inactive:
+        ScheduledMessage.objects.filter(id__in=inactive).update(dispatched_at=None)
+    if not claimed:
+        return 0
+
+    invalid = number_validity.known_invalid(
+        recipient_info['phone_number'] for _, _, recipients_data in claimed for recipient_info in recipients_data
+    )
+    with MessageLogWriter() as log_writer:
+        reserved = _reserve_logs(claimed, invalid, log_writer)
+        jobs, job_logs = [], []
+        succeeded = {}
+        for (scheduled_message, _, _), (log_entries, texts, skipped) in zip(claimed, reserved):
+            succeeded[scheduled_message.id] = not skipped
+            try:
+                media_payload = _media_payload(scheduled_message)
+            except Exception as e:
+                logger.error(f"Exception preparing media for schedule {scheduled_message.id}: {e}", exc_info=True)
+                _fail_logs(log_entries, e, log_writer)
+                succeeded[scheduled_message.id] = False
+                continue
+            jobs.extend({'number': log_entry.recipient, 'text': text, 'media': media_payload}
+                        for log_entry, text in zip(log_entries, texts))
+            job_logs.extend(log_entries)
+
+        for log_entry, sent in zip(job_logs, _send_concurrently(jobs, job_logs, log_writer)):
+            if not sent:
+                succeeded[log_entry.scheduled_message_id] = False
+
+    for scheduled_message, _, _ in claimed:
+        _finish_occurrence(scheduled_message, succeeded[scheduled_message.id])
+    return len(job_logs)
+
 
+def _recipients(scheduled_message):
+    """Destinatários do agendamento ([{'phone_number', 'name'}]) ou None se a configuração for inválida."""
     if scheduled_message.recipient_type == 'contact' and scheduled_message.contact:
-        recipients_data.append({
+        return [{
             'phone_number': scheduled_message.contact.phone_number,
             'name': scheduled_message.contact.name
-        })
-    elif scheduled_message.recipient_type == 'group' and scheduled_message.group:
-        recipients_data.append({
+        }]
+    if scheduled_message.recipient_type == 'group' and scheduled_message.group:
+        return [{
             'phone_number': scheduled_message.group.group_id,
             'name': scheduled_message.group.name
-        })
-    else:
-        logger.warning(f"ScheduledMessage {schedule_id} has invalid recipient configuration.")
-        scheduled_message.status = 'failed'
-        scheduled_message.save(update_fields=['status'])
-        return
+        }]
+    return None
 
-    if not recipients_data:
-        logger.warning(f"ScheduledMessage {schedule_id} has no valid recipients. Skipping send.")
-        scheduled_message.status = 'failed'
-        scheduled_message.save(update_fields=['status'])
-        return
 
-    evolution_service = EvolutionAPIService()
-    all_recipients_sent_successfully = True
+def _fail_recipient_configuration(scheduled_message):
+    logger.warning(f"ScheduledMessage {scheduled_message.id} has invalid recipient configuration.")
+    scheduled_message.status = 'failed'
+    scheduled_message.dispatched_at = None
+    scheduled_message.save(update_fields=['status', 'dispatched_at'])
 
-    for recipient_info in recipients_data:
-        recipient_phone = recipient_info['phone_number']
-        recipient_name = recipient_info['name']
 
-        log_entry = MessageLog.objects.create(
+def _claim(scheduled_message, occurrence):
+    """Reivindica a ocorrência e avança o agendamento em memória. False se outro worker já a reivindicou."""
+    now = timezone.now()
+    next_run = scheduled_message.calculate_next_execution()
+    if not _claim_occurrence(scheduled_message, occurrence, next_run, now):
+        logger.info(f"ScheduledMessage {scheduled_message.id} occurrence {occurrence} claimed by another worker. Skipping.")
+        return False
+    scheduled_message.last_sent = now
+    scheduled_message.next_execution = next_run
+    observe_firing_lag(scheduled_message.frequency, occurrence, now)
+    return True
+
+
+def _reserve_logs(occurrences, invalid, log_writer):
+    """
+    Reserva (um único INSERT em lote) um log por (ocorrência, destinatário) das
+    ocorrências [(agendamento, ocorrência, destinatários)], marca como falhos os números
+    que o cache sabe não estarem no WhatsApp e renderiza o texto dos demais.
+    Retorna, por ocorrência, (logs a enviar, textos, houve destinatários pulados?).
+    """
+    # Um log por (ocorrência, destinatário), com chave única: só envia quem este worker gravou
+    log_entries = log_writer.reserve([
+        MessageLog(
             scheduled_message=scheduled_message,
-            recipient=recipient_phone,
-            status='pending'
+            recipient=recipient_info['phone_number'],
+            status='pending',
+            idempotency_key=idempotency_key(scheduled_message.id, occurrence, recipient_info['phone_number']),
         )
+        for scheduled_message, occurrence, recipients_data in occurrences
+        for recipient_info in recipients_data
+    ])
+    by_schedule = {}
+    for log_entry in log_entries:
+        by_schedule.setdefault(log_entry.scheduled_message_id, []).append(log_entry)
+
+    reserved, skipped_sends = [], 0
+    for scheduled_message, occurrence, recipients_data in occurrences:
+        schedule_id = scheduled_message.id
+        schedule_logs = by_schedule.get(schedule_id, [])
+        if len(schedule_logs) < len(recipients_data):
+            logger.warning(
+                f"ScheduledMessage {schedule_id} occurrence {occurrence}: "
+                f"{len(recipients_data) - len(schedule_logs)} recipients already sent. Skipping them."
+            )
+        skipped = [log_entry for log_entry in schedule_logs if log_entry.recipient in invalid]
+        for log_entry in skipped:
+            log_entry.status = 'failed'
+            log_entry.error_message = 'Número não está no WhatsApp (cache de validação).'
+            log_entry.sent_at = timezone.now()
+            log_writer.update(log_entry)
+        if skipped:
+            logger.info(f"ScheduledMessage {schedule_id}: skipped {len(skipped)} recipients not on WhatsApp.")
+            skipped_sends += len(skipped)
+        schedule_logs = [log_entry for log_entry in schedule_logs if log_entry.recipient not in invalid]
+
+        recipients_by_phone = {recipient_info['phone_number']: recipient_info for recipient_info in recipients_data}
+        texts = template_renderer.render_many(
+            scheduled_message.message_template,
+            [recipients_by_phone[log_entry.recipient] for log_entry in schedule_logs],
+            send_context(scheduled_message, occurrence),
+        )
+        reserved.append((schedule_logs, texts, bool(skipped)))
+    # Só aqui, com a ocorrência reivindicada e o log reservado: retries e ticks duplicados não contam de novo
+    number_validity.record_skipped(skipped_sends)
+    return reserved
+
+
+def _finish_occurrence(scheduled_message, all_recipients_sent_successfully):
+    """Grava o status do agendamento após o envio da ocorrência e libera o lease do dispatcher."""
+    if not scheduled_message.next_execution:
+        if scheduled_message.frequency == 'once' and all_recipients_sent_successfully:
+            scheduled_message.status = 'completed'
+        elif scheduled_message.frequency != 'once' and scheduled_message.end_date and scheduled_message.last_sent >= scheduled_message.end_date:
+            scheduled_message.status = 'completed'
+        else:
+            scheduled_message.status = 'failed'
+
+    if not all_recipients_sent_successfully and scheduled_message.frequency == 'once':
+        scheduled_message.status = 'failed'
+
+    scheduled_message.dispatched_at = None
+    scheduled_message.save(update_fields=['status', 'last_sent', 'next_execution', 'dispatched_at'])
+    logger.info(f"ScheduledMessage {scheduled_message.id} processed. Next execution: {scheduled_message.next_execution}")
+
+
+def _is_pending_occurrence(scheduled_message, occurrence):
+    """A ocorrência ainda é a pendente do agendamento e já venceu (com tolerância para relógios)?"""
+    if occurrence is None or scheduled_message.next_execution != occurrence:
+        return False
+    tolerance = timedelta(seconds=settings.SCHEDULER_OCCURRENCE_TOLERANCE_SECONDS)
+    return occurrence <= timezone.now() + tolerance
+
+
+def _claim_occurrence(scheduled_message, occurrence, next_run, now):
+    """
+    Reivindica a ocorrência com um UPDATE condicional em next_execution: só um worker
+    consegue avançá-la, sem manter lock de linha durante os envios.
+    """
+    return ScheduledMessage.objects.filter(
+        id=scheduled_message.id, status='active', next_execution=occurrence,
+    ).update(next_execution=next_run, last_sent=now) == 1
+
+
+def _apply_send_result(log_entry, response_data, schedule_id, recipient_phone):
+    """Atualiza o log com o resultado do envio. Retorna True se o envio teve sucesso."""
+    if response_data and response_data.get('success'):
+        log_entry.status = 'sent'
+        log_entry.evolution_message_id = response_data.get('data', {}).get('key', {}).get('id')
+        logger.info(f"Message {log_entry.id} sent successfully for schedule {schedule_id} to {recipient_phone}.")
+        return True
+    log_entry.status = 'failed'
+    error_msg = response_data.get('error', 'Unknown API error') if response_data else 'No response from API'
+    log_entry.error_message = f"API Error: {error_msg}"
+    logger.error(f"Failed to send message {log_entry.id} for schedule {schedule_id} to {recipient_phone}: {log_entry.error_message}")
+    return False
+
+
+def _send_sequentially(scheduled_message, message_template, log_entries, texts, instances, log_writer, deferrals=0):
+    """
+    Envia para cada destinatário (um log reservado e um texto renderizado por destinatário), um de cada vez,
+    com uma chamada bloqueante por envio, pela instância reservada para ele (com
+    failover pelo roteador). Um destinatário cujo failover ficou sem token de rate
+    limit é reagendado (send_deferred_message) e não conta como falha.
+    """
+    schedule_id = scheduled_message.id
+    all_recipients_sent_successfully = True
+
+    for log_entry, text, config in zip(log_entries, texts, instances):
+        recipient_phone = log_entry.recipient
+        deferred = False
         try:
             response_data = None
             if message_template.media_type == 'text':
-                response_data = evolution_service.send_text_message(
+                response_data, config = instance_router.send(
                     recipient_phone,
-                    message_template.content
+                    lambda service: service.send_text_message(recipient_phone, text),
+                    config=config
                 )
             elif message_template.media_type in ['image', 'video', 'document'] and message_template.media_file:
-                media_url = scheduled_message.message_template.media_file.url
-                response_data = evolution_service.send_media_message(
+                # Payload preparado uma vez por arquivo (media_cache), não a cada destinatário
+                media_payload = media_cache.get_payload(message_template)
+                response_data, config = instance_router.send(
                     recipient_phone,
-                    message_template.content,
-                    media_url,
-                    message_template.media_type
+                    lambda service: service.send_prepared_media(
+                        recipient_phone,
+                        text,
+                        media_payload
+                    ),
+                    config=config
                 )
             else:
                 raise ValueError(f"Tipo de mídia '{message_template.media_type}' não suportado ou arquivo ausente para {scheduled_message.id}.")
 
-            if response_data and response_data.get('success'):
-                log_entry.status = 'sent'
-                log_entry.evolution_message_id = response_data.get('data', {}).get('key', {}).get('id')
-                logger.info(f"Message {log_entry.id} sent successfully for schedule {schedule_id} to {recipient_phone}.")
-            else:
-                log_entry.status = 'failed'
-                error_msg = response_data.get('error', 'Unknown API error') if response_data else 'No response from API'
-                log_entry.error_message = f"API Error: {error_msg}"
-                logger.error(f"Failed to send message {log_entry.id} for schedule {schedule_id} to {recipient_phone}: {log_entry.error_message}")
+            if response_data and response_data.get('retry_after'):
+                deferred = _defer_send(scheduled_message, log_entry, text, response_data['retry_after'], deferrals)
+                if deferred:
+                    continue
+
+            log_entry.instance_name = config.instance_name if config else None
+
+            if not _apply_send_result(log_entry, response_data, schedule_id, recipient_phone):
                 all_recipients_sent_successfully = False
 
         except Exception as e:
@@ -92,23 +388,225 @@ def process_scheduled_message(self, schedule_id):
             logger.error(f"Exception sending message {log_entry.id} for schedule {schedule_id} to {recipient_phone}: {e}", exc_info=True)
             all_recipients_sent_successfully = False
         finally:
-            log_entry.sent_at = timezone.now()
-            log_entry.save()
+            if not deferred:
+                log_entry.sent_at = timezone.now()
+                log_writer.update(log_entry)
 
-    scheduled_message.last_sent = timezone.now()
-    next_run = scheduled_message.calculate_next_execution()
-    scheduled_message.next_execution = next_run
+    return all_recipients_sent_successfully
 
-    if not next_run:
-        if scheduled_message.frequency == 'once' and all_recipients_sent_successfully:
-            scheduled_message.status = 'completed'
-        elif scheduled_message.frequency != 'once' and scheduled_message.end_date and scheduled_message.last_sent >= scheduled_message.end_date:
-            scheduled_message.status = 'completed'
-        else:
-            scheduled_message.status = 'failed'
 
-    if not all_recipients_sent_successfully and scheduled_message.frequency == 'once':
-        scheduled_message.status = 'failed'
+def _defer_send(scheduled_message, log_entry, text, wait, deferrals):
+    """
+    Reagenda o envio de um log reservado para quando houver token de rate limit, sem
+    bloquear o worker. False se o limite de reagendamentos já foi atingido.
+    """
+    if deferrals >= settings.EVOLUTION_RATE_LIMIT_MAX_DEFERRALS:
+        return False
+    kwargs = {
+        'log_id': str(log_entry.id),
+        'text': text,
+        'route': send_route(scheduled_message.priority, scheduled_message.message_template.media_type),
+        'deferrals': deferrals + 1,
+    }
+    # Só depois do commit: a task precisa enxergar o log reservado
+    transaction.on_commit(lambda: send_deferred_message.apply_async(kwargs=kwargs, countdown=math.ceil(wait)))
+    logger.info(f"MessageLog {log_entry.id} rate limited on failover. Retrying in {wait:.2f}s.")
+    return True
+
+
+def _media_payload(scheduled_message):
+    """Payload de mídia do template (None para texto), lido e codificado uma vez por arquivo (media_cache)."""
+    message_template = scheduled_message.message_template
+    if message_template.media_type in ['image', 'video', 'document'] and message_template.media_file:
+        return media_cache.get_payload(message_template)
+    if message_template.media_type != 'text':
+        raise ValueError(f"Tipo de mídia '{message_template.media_type}' não suportado ou arquivo ausente para {scheduled_message.id}.")
+    return None
+
+
+def _fail_logs(log_entries, error, log_writer):
+    now = timezone.now()
+    for log_entry in log_entries:
+        log_entry.status = 'failed'
+        log_entry.error_message = f"Exceção na task: {error}"
+        log_entry.sent_at = now
+        log_writer.update(log_entry)
+
+
+def _send_concurrently(jobs, log_entries, log_writer):
+    """
+    Envia os jobs ({'number', 'text', 'media'}, um por log reservado) em paralelo pelo
+    motor assíncrono, distribuídos entre as instâncias, e grava o resultado de cada
+    log pelo buffer em lote. Retorna, por job, se o envio teve sucesso.
+    """
+    if not jobs:
+        return []
+    try:
+        assigned = instance_router.assign([job['number'] for job in jobs])
+        results = _run_routed_jobs(jobs, assigned)
+
+        # Failover: quem falhou porque a instância caiu é reenviado uma vez pelas instâncias restantes
+        failed_instances = {
+            assigned[index].instance_name: assigned[index]
+            for index, result in enumerate(results)
+            if assigned[index] is not None and is_instance_failure(result)
+        }
+        if failed_instances:
+            for config in failed_instances.values():
+                instance_router.mark_down(config, 'fan-out connection failure')
+            retry_indexes = [
+                index for index, result in enumerate(results)
+                if assigned[index] is not None and assigned[index].instance_name in failed_instances
+            ]
+            for index in retry_indexes:
+                assigned[index] = instance_router.choose(jobs[index]['number'], exclude=failed_instances)
+            retry_results = _run_routed_jobs([jobs[index] for index in retry_indexes], [assigned[index] for index in retry_indexes])
+            for index, result in zip(retry_indexes, retry_results):
+                results[index] = result
+    except Exception as e:
+        logger.error(f"Exception during concurrent send of {len(jobs)} messages: {e}", exc_info=True)
+        _fail_logs(log_entries, e, log_writer)
+        return [False] * len(jobs)
+
+    outcomes = []
+    now = timezone.now()
+    for log_entry, response_data, config in zip(log_entries, results, assigned):
+        outcomes.append(_apply_send_result(log_entry, response_data, log_entry.scheduled_message_id, log_entry.recipient))
+        log_entry.instance_name = config.instance_name if config else None
+        log_entry.sent_at = now
+        log_writer.update(log_entry)
+    return outcomes
+
+
+def _run_routed_jobs(jobs, assigned):
+    """Agrupa os jobs por instância, envia todos os lotes em paralelo e devolve os resultados na ordem dos jobs."""
+    results = [None] * len(jobs)
+    groups = {}
+    for index, config in enumerate(assigned):
+        if config is None:
+            results[index] = {'success': False, 'error': 'Nenhuma instância Evolution disponível', 'status_code': 503}
+            continue
+        groups.setdefault(config.instance_name, (config, []))[1].append(index)
+    if not groups:
+        return results
+
+    batches = []
+    for config, indexes in groups.values():
+        sender = AsyncEvolutionSender(config.base_url.rstrip('/'), config.api_key, config.instance_name)
+        batches.append((sender, [jobs[index] for index in indexes]))
+        instance_router.track(config, len(indexes))
+    try:
+        batch_results = run_routed_fanout(batches)
+    finally:
+        for config, indexes in groups.values():
+            instance_router.track(config, -len(indexes))
+
+    for (config, indexes), batch in zip(groups.values(), batch_results):
+        for index, result in zip(indexes, batch):
+            results[index] = result
+    return results
+
+
+@shared_task
+def dispatch_due_messages():
+    """
+    Tick do modo dispatcher: busca os agendamentos vencidos por next_execution,
+    reivindica-os em lotes (dispatched_at) e enfileira process_scheduled_batch com até
+    SCHEDULER_SEND_BATCH_SIZE agendamentos da mesma rota por task.
+    """
+    now = timezone.now()
+    batch_size = settings.SCHEDULER_DISPATCH_BATCH_SIZE
+    send_batch_size = max(settings.SCHEDULER_SEND_BATCH_SIZE, 1)
+    lease_expired_before = now - timedelta(seconds=settings.SCHEDULER_DISPATCH_CLAIM_TTL)
+    dispatched = 0
+
+    while True:
+        with transaction.atomic():
+            # skip_locked permite mais de um beat/dispatcher concorrente sem disputa de lock
+            due = list(
+                ScheduledMessage.objects.select_for_update(skip_locked=True)
+                .filter(status='active', next_execution__lte=now)
+                .filter(Q(dispatched_at__isnull=True) | Q(dispatched_at__lt=lease_expired_before))
+                .order_by('next_execution')
+                .values_list('id', 'next_execution')[:batch_size]
+            )
+            if not due:
+                break
+            due_ids = [schedule_id for schedule_id, _ in due]
+            ScheduledMessage.objects.filter(id__in=due_ids).update(dispatched_at=now)
+
+        routes = routes_for_ids(due_ids)
+        by_route = {}
+        for schedule_id, occurrence in due:
+            by_route.setdefault(routes.get(schedule_id), []).append([str(schedule_id), occurrence.isoformat()])
+        # Um lote por rota: os envios de cada lote saem em paralelo pelo motor assíncrono
+        for route, items in by_route.items():
+            for start in range(0, len(items), send_batch_size):
+                process_scheduled_batch.delay(items=items[start:start + send_batch_size], route=route)
+        dispatched += len(due_ids)
+
+        if len(due_ids) < batch_size:
+            break
+
+    if dispatched:
+        logger.info(f"Dispatcher enqueued {dispatched} due scheduled messages.")
+    return dispatched
+
+
+@shared_task
+def refresh_evolution_instances():
+    """
+    Verifica o status de conexão de cada EvolutionConfig ativo, devolvendo ao
+    rodízio as instâncias que voltaram e retirando as que caíram.
+    """
+    statuses = instance_router.refresh_status()
+    logger.info(f"Evolution instances status: {statuses}")
+    return statuses
+
+
+@shared_task
+def reconcile_dashboard_counters():
+    """
+    Recalcula no banco os contadores de status do dashboard, corrigindo qualquer
+    diferença acumulada pelos incrementos (falhas de Redis, escritas fora dos hooks).
+    """
+    counts = dashboard_counters.reconcile()
+    logger.info(f"Dashboard counters reconciled: {counts}")
+    return counts
+
+
+@shared_task
+def rollup_message_logs():
+    """Consolida os logs novos (e os que mudaram de status) nas séries de SendRollup."""
+    stats = run_rollup()
+    logger.info(f"Message log rollup: {stats}")
+    return stats
+
+
+@shared_task
+def apply_webhook_events():
+    """
+    Aplica em lote os webhooks da Evolution enfileirados no Redis. Disparada pelo
+    endpoint quando a fila deixa de estar vazia e, como rede de segurança, pelo beat.
+    Se parar no limite de lotes com eventos restantes, agenda a si mesma de novo.
+    """
+    stats = process_webhook_queue()
+    if stats.get('batches') == settings.WEBHOOK_MAX_BATCHES:
+        apply_webhook_events.apply_async()
+    return stats
+
+
+@shared_task
+def precheck_numbers(numbers):
+    """Verifica em lote na Evolution API quais números estão no WhatsApp e guarda no cache."""
+    stats = number_validity.precheck(numbers)
+    logger.info(f"WhatsApp number precheck: {stats}")
+    return stats
+
 
-    scheduled_message.save(update_fields=['status', 'last_sent', 'next_execution'])
-    logger.info(f"ScheduledMessage {schedule_id} processed. Next execution: {scheduled_message.next_execution}")
\ No newline at end of file
+@shared_task
+def sync_evolution_groups(force=False):
+    """Sincroniza Group com os grupos de todas as instâncias Evolution (só grava as diferenças)."""
+    report = sync_groups(force=force)
+    logger.info(f"Group sync: {report}")
+    return report
@@ -1,3 +1,1856 @@
-from django.test import TestCase
+import asyncio
+import calendar
+import io
+import json
+import os
+import random
+import tempfile
+import uuid
+from datetime import datetime, timedelta, timezone as dt_timezone
+from unittest import mock, skipUnless
 
-# Create your tests here.
+import redis
+from django.contrib.auth.models import User
+from django.core.cache import cache
+from django.core.files.uploadedfile import SimpleUploadedFile
+from django.core.management import CommandError, call_command
+from django.db import DatabaseError, connection
+from django.test import SimpleTestCase, TestCase
+from django.test.utils import CaptureQueriesContext
+from django.utils import timezone
+from django.utils.dateparse import parse_datetime
+from django_celery_beat.models import ClockedSchedule, CrontabSchedule, IntervalSchedule, PeriodicTask, PeriodicTasks
+from rest_framework.test import APIClient
+
+from .benchmarks import compare
+from .models import (
+    Contact, EvolutionConfig, Group, MessageTemplate, RollupCheckpoint, ScheduledMessage, SendRollup, MessageLog,
+)
+from .pagination import KeysetPagination
+from .services.async_sender import AsyncEvolutionSender
+from .services.beat_sync import delete_periodic_tasks, sync_periodic_tasks, task_name
+from .services.contact_import import ContactImportError, import_contacts, iter_rows
+from .services.dashboard_counters import COUNTERS_KEY, RECONCILED_AT_FIELD, dashboard_counters
+from .services.evolution_service import EvolutionAPIService
+from .services.evolution_stub import EvolutionStubServer
+from .services.group_sync import parse_groups, sync_groups
+from .services.http_session import reset_session
+from .services.instance_router import InstanceRouter, instance_router
+from .services.media_cache import MediaCache, media_cache
+from .services import contact_import
+from .services import rate_limiter as rate_limiter_module
+from .services import timeline as timeline_module
+from .services.rate_limiter import TokenBucketRateLimiter
+from .services.rollups import DIRTY_MINUTES_KEY, mark_dirty, rebuild_range, run_rollup
+from .services.log_writer import MessageLogWriter, idempotency_key
+from .services import metrics
+from .services import number_validity as number_validity_module
+from .services.send_routing import routes_for_ids, send_route
+from .services.template_renderer import TemplateRenderer
+from .services import webhooks
+from .services.webhooks import apply_receipts, parse_receipts
+from .tasks import (
+    _claim_occurrence, _is_pending_occurrence, dispatch_due_messages, process_scheduled_batch, process_scheduled_message,
+    reconcile_dashboard_counters, send_deferred_message,
+)
+from .utils.recurrence import next_occurrence, next_occurrence_batch, next_occurrences
+
+try:
+    import fakeredis
+except ImportError:  # dependência só dos testes dos serviços em Redis
+    fakeredis = None
+
+
+class HotPathIndexTests(TestCase):
+    """
+    Garante, via EXPLAIN (MySQL) ou EXPLAIN QUERY PLAN (SQLite), que as consultas
+    dos caminhos quentes usam os índices compostos. Por padrão semeia 20 mil logs,
+    o bastante para o planner e rápido para toda execução; para conferir com o volume
+    de produção rode com SCHEDULER_EXPLAIN_LOG_ROWS=1000000.
+    """
+    LOG_ROWS = int(os.environ.get('SCHEDULER_EXPLAIN_LOG_ROWS', 20_000))
+    SCHEDULES = 2_000
+    BATCH_SIZE = 10_000
+
+    @classmethod
+    def setUpTestData(cls):
+        template = MessageTemplate.objects.create(title='Template', content='Olá')
+        contact = Contact.objects.create(name='Contato', phone_number='5511999999999')
+        now = timezone.now()
+        statuses = ['active', 'paused', 'completed', 'failed']
+        ScheduledMessage.objects.bulk_create([
+            ScheduledMessage(
+                title=f'Agendamento {i}', message_template=template, recipient_type='contact', contact=contact,
+                frequency='daily', start_date=now, status=statuses[i % len(statuses)],
+                next_execution=now + timedelta(minutes=i - cls.SCHEDULES // 2),
+            )
+            for i in range(cls.SCHEDULES)
+        ])
+        cls.schedule_ids = list(ScheduledMessage.objects.values_list('id', flat=True))
+        cls.now = now
+        cls._seed_logs()
+        with connection.cursor() as cursor:
+            cursor.execute('ANALYZE' if connection.vendor == 'sqlite' else f'ANALYZE TABLE {MessageLog._meta.db_table}')
+
+    @classmethod
+    def _seed_logs(cls):
+        # INSERT direto em lotes: instanciar 1M de objetos do model tornaria o seed inviável
+        fields = [MessageLog._meta.get_field(name) for name in
+                  ('id', 'scheduled_message', 'recipient', 'status', 'sent_at', 'evolution_message_id')]
+        columns = ', '.join(connection.ops.quote_name(field.column) for field in fields)
+        placeholders = ', '.join(['%s'] * len(fields))
+        sql = f'INSERT INTO {connection.ops.quote_name(MessageLog._meta.db_table)} ({columns}) VALUES ({placeholders})'
+        statuses = ['sent', 'sent', 'sent', 'delivered', 'read', 'failed']
+
+        def row(i):
+            values = (
+                uuid.uuid4(), cls.schedule_ids[i % len(cls.schedule_ids)], f'55119{i:08d}',
+                statuses[i % len(statuses)], cls.now - timedelta(seconds=i), f'EVO{i:012d}',
+            )
+            return [field.get_db_prep_value(value, connection, prepared=False) for field, value in zip(fields, values)]
+
+        with connection.cursor() as cursor:
+            for start in range(0, cls.LOG_ROWS, cls.BATCH_SIZE):
+                cursor.executemany(sql, [row(i) for i in range(start, min(start + cls.BATCH_SIZE, cls.LOG_ROWS))])
+
+    def _index_name(self, model, columns):
+        with connection.cursor() as cursor:
+            constraints = connection.introspection.get_constraints(cursor, model._meta.db_table)
+        for name, info in constraints.items():
+            if info['index'] and info['columns'] == columns:
+                return name
+        self.fail(f'Índice sobre {columns} não encontrado em {model._meta.db_table}')
+
+    def assertUsesIndex(self, queryset, index_name):
+        plan = queryset.explain()
+        self.assertIn(index_name, plan, f'Plano não usa {index_name}:\n{plan}')
+
+    def test_upcoming_and_overdue_use_status_next_execution_index(self):
+        upcoming = ScheduledMessage.objects.filter(status='active', next_execution__gte=self.now).order_by('next_execution')
+        overdue = ScheduledMessage.objects.filter(status='active', next_execution__lt=self.now).order_by('next_execution')
+        self.assertUsesIndex(upcoming, 'sched_status_next_idx')
+        self.assertUsesIndex(overdue, 'sched_status_next_idx')
+
+    def test_dispatcher_scan_uses_status_next_execution_index(self):
+        due = ScheduledMessage.objects.filter(status='active', next_execution__lte=self.now).order_by('next_execution')[:500]
+        self.assertUsesIndex(due, 'sched_status_next_idx')
+
+    def test_logs_by_status_in_period_use_status_sent_at_index(self):
+        failed_last_hour = MessageLog.objects.filter(status='failed', sent_at__gte=self.now - timedelta(hours=1))
+        self.assertUsesIndex(failed_last_hour, 'log_status_sent_idx')
+
+    def test_schedule_history_uses_schedule_sent_at_index(self):
+        history = MessageLog.objects.filter(scheduled_message_id=self.schedule_ids[0]).order_by('-sent_at')[:20]
+        self.assertUsesIndex(history, 'log_sched_sent_idx')
+
+    def test_log_cursor_page_uses_sent_at_id_index(self):
+        last = MessageLog.objects.order_by('-sent_at', '-id')[5000]
+        page = MessageLog.objects.filter(
+            KeysetPagination._after(['-sent_at', '-id'], [last.sent_at, last.id])
+        ).order_by('-sent_at', '-id')[:21]
+        self.assertUsesIndex(page, 'log_sent_id_idx')
+
+    def test_receipt_lookup_uses_evolution_message_id_index(self):
+        index_name = self._index_name(MessageLog, ['evolution_message_id'])
+        self.assertUsesIndex(MessageLog.objects.filter(evolution_message_id='EVO000000000042'), index_name)
+
+
+def legacy_next_execution(frequency, start_date, base_time, day_of_week, day_of_month):
+    """Implementação original (laços dia a dia/ano a ano) de calculate_next_execution, como referência."""
+    if frequency == 'once':
+        return None
+    elif frequency == 'daily':
+        next_time = base_time + timedelta(days=1)
+        return next_time.replace(hour=start_date.hour, minute=start_date.minute, second=0, microsecond=0)
+    elif frequency == 'weekly':
+        if day_of_week is None:
+            return None
+        next_time = base_time
+        while True:
+            next_time += timedelta(days=1)
+            if next_time.weekday() == day_of_week:
+                return next_time.replace(hour=start_date.hour, minute=start_date.minute, second=0, microsecond=0)
+    elif frequency == 'monthly':
+        if not day_of_month:
+            return None
+        next_time = base_time
+        year, month = next_time.year, next_time.month
+        last_day_this_month = calendar.monthrange(year, month)[1]
+        day = min(day_of_month, last_day_this_month)
+        potential_date = next_time.replace(day=day)
+        if potential_date <= base_time:
+            month += 1
+            if month > 12:
+                month = 1
+                year += 1
+            last_day_next_month = calendar.monthrange(year, month)[1]
+            day = min(day_of_month, last_day_next_month)
+            next_time = potential_date.replace(year=year, month=month, day=day)
+        else:
+            next_time = potential_date
+        return next_time.replace(hour=start_date.hour, minute=start_date.minute, second=0, microsecond=0)
+    elif frequency == 'yearly':
+        next_time = base_time
+        target_year = next_time.year
+        try:
+            potential_date = next_time.replace(month=start_date.month, day=start_date.day)
+            if potential_date <= base_time:
+                target_year += 1
+        except ValueError:
+            if base_time.month > start_date.month:
+                target_year += 1
+        while True:
+            try:
+                return next_time.replace(year=target_year, month=start_date.month, day=start_date.day,
+                                         hour=start_date.hour, minute=start_date.minute, second=0, microsecond=0)
+            except ValueError:
+                target_year += 1
+    return None
+
+
+class RecurrenceEngineTests(SimpleTestCase):
+    """Testes de propriedade: o motor em O(1) deve bater com a implementação original."""
+    CASES = 5_000
+
+    def setUp(self):
+        self.random = random.Random(20240229)
+
+    def random_datetime(self):
+        year = self.random.randint(1999, 2105)
+        month = self.random.randint(1, 12)
+        # dá peso extra para os fins de mês e 29/02
+        day = self.random.choice([1, 28, 29, 30, 31, self.random.randint(1, 31)])
+        day = min(day, calendar.monthrange(year, month)[1])
+        return datetime(year, month, day, self.random.randint(0, 23), self.random.randint(0, 59),
+                        self.random.randint(0, 59), self.random.randint(0, 999_999), tzinfo=dt_timezone.utc)
+
+    def random_leap_day(self):
+        year = self.random.choice([y for y in range(1996, 2104) if calendar.isleap(y)])
+        return datetime(year, 2, 29, self.random.randint(0, 23), self.random.randint(0, 59), tzinfo=dt_timezone.utc)
+
+    def assertMatchesLegacy(self, frequency, start_date, base, day_of_week=None, day_of_month=None):
+        expected = legacy_next_execution(frequency, start_date, base, day_of_week, day_of_month)
+        actual = next_occurrence(frequency, start_date, base, day_of_week, day_of_month)
+        self.assertEqual(actual, expected, f'{frequency} start={start_date} base={base} '
+                                           f'dow={day_of_week} dom={day_of_month}')
+
+    def test_daily_matches_legacy(self):
+        for _ in range(self.CASES):
+            self.assertMatchesLegacy('daily', self.random_datetime(), self.random_datetime())
+
+    def test_weekly_matches_legacy(self):
+        for _ in range(self.CASES):
+            self.assertMatchesLegacy('weekly', self.random_datetime(), self.random_datetime(),
+                                     day_of_week=self.random.randint(0, 6))
+
+    def test_monthly_matches_legacy(self):
+        for _ in range(self.CASES):
+            self.assertMatchesLegacy('monthly', self.random_datetime(), self.random_datetime(),
+                                     day_of_month=self.random.randint(1, 31))
+
+    def test_yearly_matches_legacy(self):
+        for _ in range(self.CASES):
+            self.assertMatchesLegacy('yearly', self.random_datetime(), self.random_datetime())
+
+    def test_yearly_leap_day_matches_legacy(self):
+        for _ in range(self.CASES):
+            self.assertMatchesLegacy('yearly', self.random_leap_day(), self.random_datetime())
+
+    def test_missing_parameters_return_none(self):
+        base = self.random_datetime()
+        self.assertIsNone(next_occurrence('once', base, base))
+        self.assertIsNone(next_occurrence('weekly', base, base, day_of_week=None))
+        self.assertIsNone(next_occurrence('monthly', base, base, day_of_month=None))
+
+    def test_leap_day_skips_non_leap_century(self):
+        start = datetime(2096, 2, 29, 9, 0, tzinfo=dt_timezone.utc)
+        base = datetime(2096, 3, 1, tzinfo=dt_timezone.utc)
+        self.assertEqual(next_occurrence('yearly', start, base), datetime(2104, 2, 29, 9, 0, tzinfo=dt_timezone.utc))
+
+    def test_next_occurrences_chains_like_repeated_calls(self):
+        for _ in range(200):
+            start, base = self.random_datetime(), self.random_datetime()
+            day_of_month = self.random.randint(1, 31)
+            occurrences = next_occurrences('monthly', start, base, 24, day_of_month=day_of_month)
+            expected, current = [], base
+            for _ in range(24):
+                current = legacy_next_execution('monthly', start, current, None, day_of_month)
+                expected.append(current)
+            self.assertEqual(occurrences, expected)
+
+    def test_batch_matches_single_calls(self):
+        frequencies, starts, bases, weekdays, month_days = [], [], [], [], []
+        for _ in range(self.CASES):
+            frequencies.append(self.random.choice(['once', 'daily', 'weekly', 'monthly', 'yearly']))
+            starts.append(self.random_datetime())
+            bases.append(self.random_datetime())
+            weekdays.append(self.random.randint(0, 6))
+            month_days.append(self.random.randint(1, 31))
+        batch = next_occurrence_batch(frequencies, starts, bases, weekdays, month_days)
+        self.assertEqual(batch, [
+            legacy_next_execution(*params) for params in zip(frequencies, starts, bases, weekdays, month_days)
+        ])
+
+    def test_model_method_uses_engine(self):
+        start = datetime(2024, 1, 31, 8, 30, tzinfo=dt_timezone.utc)
+        now = datetime(2024, 2, 10, 12, 0, tzinfo=dt_timezone.utc)
+        schedule = ScheduledMessage(frequency='monthly', start_date=start, day_of_month=31, status='active')
+        with mock.patch('scheduler.models.timezone.now', return_value=now):
+            self.assertEqual(schedule.calculate_next_execution(), datetime(2024, 2, 29, 8, 30, tzinfo=dt_timezone.utc))
+
+
+class ScheduledMessageListQueryTests(TestCase):
+    """Fixa o número de consultas por página da listagem de agendamentos (sem N+1)."""
+    # Paginação por cursor: só o SELECT da página (com JOIN das relações aninhadas), sem COUNT
+    QUERIES_PER_PAGE = 1
+
+    @classmethod
+    def setUpTestData(cls):
+        now = timezone.now()
+        schedules = []
+        for i in range(30):
+            template = MessageTemplate.objects.create(title=f'Template {i}', content='Olá')
+            contact = Contact.objects.create(name=f'Contato {i}', phone_number=f'55119{i:08d}')
+            group = Group.objects.create(name=f'Grupo {i}', group_id=f'{i}@g.us')
+            schedules.append(ScheduledMessage(
+                title=f'Agendamento {i}', message_template=template,
+                recipient_type='contact' if i % 2 else 'group',
+                contact=contact if i % 2 else None, group=None if i % 2 else group,
+                frequency='daily', start_date=now, status='active',
+                next_execution=now + timedelta(hours=i - 15),
+            ))
+        ScheduledMessage.objects.bulk_create(schedules)
+        cls.user = User.objects.create_user('api', password='x')
+
+    def setUp(self):
+        self.client = APIClient()
+        self.client.force_authenticate(self.user)
+
+    def get(self, url, queries=QUERIES_PER_PAGE):
+        with self.assertNumQueries(queries):
+            response = self.client.get(url)
+        self.assertEqual(response.status_code, 200)
+        return response.json()
+
+    def test_list_page_has_constant_query_count(self):
+        data = self.get('/api/schedules/')
+        self.assertEqual(len(data['results']), 20)
+        self.assertEqual(data['results'][0]['message_template']['content'], 'Olá')
+
+    def test_upcoming_and_overdue_have_constant_query_count(self):
+        self.assertTrue(self.get('/api/schedules/upcoming/')['results'])
+        self.assertTrue(self.get('/api/schedules/overdue/')['results'])
+
+    def test_empty_expand_returns_ids_only(self):
+        data = self.get('/api/schedules/?expand=')
+        schedule = ScheduledMessage.objects.get(id=data['results'][0]['id'])
+        self.assertEqual(data['results'][0]['message_template'], str(schedule.message_template_id))
+
+    def test_fields_and_expand_limit_the_payload(self):
+        data = self.get('/api/schedules/?fields=id,title,contact&expand=contact')
+        for item in data['results']:
+            self.assertEqual(set(item), {'id', 'title', 'contact'})
+        self.assertTrue(any(isinstance(item['contact'], dict) for item in data['results']))
+
+
+class MessageLogCursorPaginationTests(TestCase):
+    """Paginação por cursor em (sent_at, id) e filtros da listagem de logs."""
+
+    @classmethod
+    def setUpTestData(cls):
+        template = MessageTemplate.objects.create(title='Template', content='Olá')
+        contact = Contact.objects.create(name='Contato', phone_number='5511999999999')
+        now = timezone.now()
+        cls.schedules = [
+            ScheduledMessage.objects.create(
+                title=f'Agendamento {i}', message_template=template, recipient_type='contact',
+                contact=contact, frequency='daily', start_date=now,
+            )
+            for i in range(2)
+        ]
+        logs = [
+            MessageLog(scheduled_message=cls.schedules[i % 2], recipient='5511999999999',
+                       status='failed' if i % 3 == 0 else 'sent')
+            for i in range(45)
+        ]
+        MessageLog.objects.bulk_create(logs)
+        # vários logs no mesmo instante para exercitar o desempate pelo id
+        for i, log in enumerate(logs):
+            log.sent_at = now - timedelta(minutes=i // 4)
+        MessageLog.objects.bulk_update(logs, ['sent_at'])
+        cls.now = now
+        cls.user = User.objects.create_user('api', password='x')
+
+    def setUp(self):
+        self.client = APIClient()
+        self.client.force_authenticate(self.user)
+
+    def collect(self, url):
+        ids, pages = [], []
+        while url:
+            with self.assertNumQueries(1):
+                data = self.client.get(url).json()
+            pages.append(data)
+            ids.extend(item['id'] for item in data['results'])
+            url = data['next']
+        return ids, pages
+
+    def test_walks_every_log_once_in_order(self):
+        ids, pages = self.collect('/api/logs/?page_size=10')
+        expected = [str(pk) for pk in MessageLog.objects.order_by('-sent_at', '-id').values_list('id', flat=True)]
+        self.assertEqual(ids, expected)
+        self.assertEqual(len(pages), 5)
+        self.assertIsNone(pages[0]['previous'])
+
+    def test_previous_link_returns_the_prior_page(self):
+        _, pages = self.collect('/api/logs/?page_size=10')
+        previous = self.client.get(pages[2]['previous']).json()
+        self.assertEqual(previous['results'], pages[1]['results'])
+        self.assertEqual(self.client.get(previous['next']).json()['results'], pages[2]['results'])
+
+    def test_filters_by_schedule_status_and_period(self):
+        schedule = self.schedules[0]
+        after = (self.now - timedelta(minutes=5)).isoformat()
+        ids, _ = self.collect(
+            f'/api/logs/?page_size=4&schedule={schedule.id}&status=failed&sent_after={after.replace("+", "%2B")}'
+        )
+        expected = MessageLog.objects.filter(
+            scheduled_message=schedule, status='failed', sent_at__gte=self.now - timedelta(minutes=5)
+        ).order_by('-sent_at', '-id').values_list('id', flat=True)
+        self.assertEqual(ids, [str(pk) for pk in expected])
+        self.assertTrue(ids)
+
+    def test_invalid_cursor_and_filters_are_rejected(self):
+        self.assertEqual(self.client.get('/api/logs/?cursor=bogus').status_code, 404)
+        self.assertEqual(self.client.get('/api/logs/?schedule=123').status_code, 400)
+        self.assertEqual(self.client.get('/api/logs/?sent_before=ontem').status_code, 400)
+
+
+class WebhookReceiptTests(TestCase):
+    """Recibos da Evolution: só avançam o status do log, em UPDATEs por lote."""
+
+    def setUp(self):
+        template = MessageTemplate.objects.create(title='Template', content='Olá')
+        contact = Contact.objects.create(name='Contato', phone_number='5511999999999')
+        schedule = ScheduledMessage.objects.create(
+            title='Agendamento', message_template=template, contact=contact,
+            frequency='once', start_date=timezone.now() + timedelta(days=1),
+        )
+        for index, status in enumerate(['sent', 'sent', 'read', 'failed', 'delivered']):
+            MessageLog.objects.create(
+                scheduled_message=schedule, recipient=contact.phone_number,
+                status=status, evolution_message_id=f'MSG{index}',
+            )
+
+    @staticmethod
+    def event(message_id, status):
+        return json.dumps({'event': 'messages.update', 'data': {'keyId': message_id, 'status': status}})
+
+    def test_keeps_the_most_advanced_receipt_per_message(self):
+        receipts, skipped = parse_receipts([
+            self.event('MSG1', 'READ'), self.event('MSG1', 'DELIVERY_ACK'),
+            self.event('MSG0', 'SERVER_ACK'), 'não é json',
+        ])
+        self.assertEqual(receipts, {'MSG1': 'read'})
+        self.assertEqual(skipped, 2)
+
+    def test_never_downgrades_status(self):
+        receipts, _ = parse_receipts([
+            self.event('MSG0', 'DELIVERY_ACK'), self.event('MSG1', 'READ'),
+            self.event('MSG2', 'DELIVERY_ACK'), self.event('MSG3', 'READ'),
+            self.event('MSG4', 'PLAYED'), self.event('DESCONHECIDO', 'READ'),
+        ])
+        # SAVEPOINT/RELEASE, um SELECT pelo índice de evolution_message_id e um UPDATE por status alvo
+        with self.assertNumQueries(5):
+            self.assertEqual(apply_receipts(receipts), (3, {'DESCONHECIDO'}))
+        logs = dict(MessageLog.objects.values_list('evolution_message_id', 'status'))
+        self.assertEqual(logs, {'MSG0': 'delivered', 'MSG1': 'read', 'MSG2': 'read', 'MSG3': 'failed', 'MSG4': 'read'})
+        self.assertIsNotNone(MessageLog.objects.get(evolution_message_id='MSG1').delivered_at)
+
+
+@skipUnless(fakeredis, 'fakeredis não instalado')
+class WebhookQueueTests(TestCase):
+    """Endpoint e fila dos webhooks: token obrigatório, fila limitada, confirmação após o commit e recibos adiantados."""
+
+    def setUp(self):
+        self.redis = fakeredis.FakeRedis(decode_responses=True)
+        patcher = mock.patch('scheduler.services.redis_client._client', self.redis)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        template = MessageTemplate.objects.create(title='Template', content='Olá')
+        self.contact = Contact.objects.create(name='Contato', phone_number='5511999999999')
+        self.schedule = ScheduledMessage.objects.create(
+            title='Agendamento', message_template=template, contact=self.contact,
+            frequency='once', start_date=timezone.now() + timedelta(days=1),
+        )
+        self.log(0)
+
+    def log(self, index, status='sent'):
+        return MessageLog.objects.create(
+            scheduled_message=self.schedule, recipient=self.contact.phone_number,
+            status=status, evolution_message_id=f'MSG{index}',
+        )
+
+    def post(self, body, **extra):
+        return self.client.post('/api/webhooks/evolution/', body, content_type='application/json', **extra)
+
+    def enqueue(self, *events):
+        for message_id, status in events:
+            webhooks.enqueue(WebhookReceiptTests.event(message_id, status))
+
+    def test_endpoint_requires_a_configured_token(self):
+        body = WebhookReceiptTests.event('MSG0', 'READ')
+        with self.settings(EVOLUTION_WEBHOOK_TOKEN=''):
+            self.assertEqual(self.post(body).status_code, 403)
+        with self.settings(EVOLUTION_WEBHOOK_TOKEN='segredo'), \
+                mock.patch('scheduler.tasks.apply_webhook_events.apply_async') as apply_async:
+            self.assertEqual(self.post(body).status_code, 401)
+            self.assertEqual(self.post(body, HTTP_X_WEBHOOK_TOKEN='errado').status_code, 401)
+            self.assertEqual(self.post(body, HTTP_X_WEBHOOK_TOKEN='segredo').status_code, 202)
+            self.assertEqual(self.client.post('/api/webhooks/evolution/?token=segredo', body,
+                                              content_type='application/json').status_code, 202)
+        # Só o primeiro evento de uma fila vazia agenda a aplicação
+        apply_async.assert_called_once()
+        self.assertEqual(self.redis.llen(webhooks.QUEUE_KEY), 2)
+
+    def test_full_queue_is_refused(self):
+        with self.settings(EVOLUTION_WEBHOOK_TOKEN='segredo', WEBHOOK_QUEUE_MAX_LENGTH=2), \
+                mock.patch('scheduler.tasks.apply_webhook_events.apply_async'):
+            statuses = [self.post('{}', HTTP_X_WEBHOOK_TOKEN='segredo').status_code for _ in range(3)]
+        self.assertEqual(statuses, [202, 202, 503])
+        self.assertEqual(self.redis.llen(webhooks.QUEUE_KEY), 2)
+
+    def test_batch_is_kept_until_the_receipts_are_written(self):
+        self.enqueue(('MSG0', 'DELIVERY_ACK'), ('MSG0', 'READ'), ('MSG0', 'DELIVERY_ACK'))
+        with mock.patch('scheduler.services.webhooks.apply_receipts', side_effect=DatabaseError('falha')):
+            with self.assertRaises(DatabaseError):
+                webhooks.process_queue(batch_size=2)
+        # O lote que falhou continua na lista de processamento, e o lock foi liberado
+        self.assertEqual(self.redis.llen(webhooks.PROCESSING_KEY), 2)
+        self.assertEqual(self.redis.llen(webhooks.QUEUE_KEY), 1)
+
+        stats = webhooks.process_queue(batch_size=2)
+        self.assertEqual((stats['batches'], stats['events'], stats['updated']), (2, 3, 1))
+        self.assertEqual(MessageLog.objects.get(evolution_message_id='MSG0').status, 'read')
+        self.assertFalse(self.redis.exists(webhooks.QUEUE_KEY, webhooks.PROCESSING_KEY))
+
+    def test_receipts_arriving_before_the_log_are_retried_until_they_expire(self):
+        self.enqueue(('MSG1', 'DELIVERY_ACK'), ('MSG2', 'READ'))
+        with mock.patch('scheduler.services.webhooks.time.time', return_value=1000.0):
+            self.assertEqual(webhooks.process_queue()['unmatched'], 2)
+        self.enqueue(('MSG1', 'READ'))
+        with mock.patch('scheduler.services.webhooks.time.time', return_value=1100.0):
+            webhooks.process_queue()
+        # Status mais avançado, com o prazo da primeira tentativa
+        self.assertEqual(self.redis.hgetall(webhooks.UNMATCHED_KEY), {'MSG1': 'read:1600.0', 'MSG2': 'read:1600.0'})
+
+        # O log da MSG1 ganha o evolution_message_id; a MSG2 nunca aparece
+        self.log(1)
+        with mock.patch('scheduler.services.webhooks.time.time', return_value=1200.0):
+            stats = webhooks.process_queue()
+        self.assertEqual((stats['retried'], stats['updated']), (1, 1))
+        self.assertEqual(MessageLog.objects.get(evolution_message_id='MSG1').status, 'read')
+        with mock.patch('scheduler.services.webhooks.time.time', return_value=1600.0):
+            self.assertEqual(webhooks.process_queue(), {'expired': 1})
+        self.assertFalse(self.redis.exists(webhooks.UNMATCHED_KEY))
+
+    def test_a_single_consumer_processes_the_queue(self):
+        self.enqueue(('MSG0', 'READ'))
+        lock = self.redis.lock(webhooks.LOCK_KEY, timeout=60)
+        lock.acquire()
+        self.assertEqual(webhooks.process_queue(), {})
+        self.assertEqual(self.redis.llen(webhooks.QUEUE_KEY), 1)
+        lock.release()
+        self.assertEqual(webhooks.process_queue()['updated'], 1)
+
+
+class ExactlyOnceDispatchTests(TestCase):
+    """Cada ocorrência de um agendamento gera um único envio por destinatário."""
+
+    def setUp(self):
+        template = MessageTemplate.objects.create(title='Template', content='Olá')
+        self.contact = Contact.objects.create(name='Contato', phone_number='5511999999999')
+        self.schedule = ScheduledMessage.objects.create(
+            title='Agendamento', message_template=template, contact=self.contact, recipient_type='contact',
+            frequency='daily', start_date=timezone.now() - timedelta(minutes=1),
+        )
+        self.occurrence = self.schedule.next_execution
+        patcher = mock.patch('scheduler.tasks.instance_router')
+        self.router = patcher.start()
+        self.addCleanup(patcher.stop)
+        self.router.reserve.return_value = (None, 0)
+        self.router.send.return_value = ({'success': True, 'data': {'key': {'id': 'MSG'}}}, None)
+
+    def run_task(self, **kwargs):
+        process_scheduled_message.apply(kwargs={'schedule_id': str(self.schedule.id), **kwargs})
+
+    def test_duplicate_ticks_send_once(self):
+        self.run_task()
+        self.run_task(occurrence=self.occurrence.isoformat())
+        self.run_task()
+        self.assertEqual(self.router.send.call_count, 1)
+        log = MessageLog.objects.get()
+        self.assertEqual(log.status, 'sent')
+        self.assertEqual(log.idempotency_key, idempotency_key(self.schedule.id, self.occurrence, self.contact.phone_number))
+        self.schedule.refresh_from_db()
+        self.assertGreater(self.schedule.next_execution, self.occurrence)
+
+    def test_claim_is_a_conditional_update(self):
+        # Outro worker avançou a ocorrência entre a leitura e o claim
+        def advance(*args, **kwargs):
+            ScheduledMessage.objects.filter(id=self.schedule.id).update(next_execution=timezone.now() + timedelta(days=1))
+            return None, 0
+        self.router.reserve.side_effect = advance
+        self.run_task()
+        self.router.send.assert_not_called()
+        self.assertFalse(MessageLog.objects.exists())
+
+    def test_known_invalid_number_is_not_sent(self):
+        with mock.patch('scheduler.tasks.number_validity') as validity:
+            validity.known_invalid.return_value = {self.contact.phone_number}
+            self.run_task()
+            # Tick duplicado da mesma ocorrência: o envio pulado é contado uma única vez
+            self.run_task(occurrence=self.occurrence.isoformat())
+        self.router.send.assert_not_called()
+        self.router.reserve.assert_not_called()
+        log = MessageLog.objects.get()
+        self.assertEqual(log.status, 'failed')
+        self.assertIn('WhatsApp', log.error_message)
+        validity.record_skipped.assert_called_once_with(1)
+
+    def test_skipped_send_is_not_counted_when_the_claim_is_lost(self):
+        with mock.patch('scheduler.tasks.number_validity') as validity, \
+                mock.patch('scheduler.tasks._claim_occurrence', return_value=False):
+            validity.known_invalid.return_value = {self.contact.phone_number}
+            self.run_task()
+        validity.known_invalid.assert_called_once()
+        validity.record_skipped.assert_not_called()
+        self.assertFalse(MessageLog.objects.exists())
+
+    @skipUnless(fakeredis, 'fakeredis não instalado')
+    def test_skipped_sends_stat_counts_each_occurrence_once(self):
+        client = fakeredis.FakeRedis(decode_responses=True)
+        client.set(f'{number_validity_module.KEY_PREFIX}{self.contact.phone_number}', '0')
+        with mock.patch('scheduler.services.redis_client._client', client), \
+                self.settings(NUMBER_VALIDITY_ENABLED=True):
+            self.run_task()
+            self.run_task(occurrence=self.occurrence.isoformat())
+            self.assertEqual(client.hget(number_validity_module.STATS_KEY, 'skipped_sends'), '1')
+
+    def test_rate_limited_failover_defers_the_recipient_without_waiting(self):
+        self.router.send.return_value = ({'success': False, 'status_code': 429, 'retry_after': 2.5, 'error': 'limite'}, None)
+        with mock.patch('scheduler.tasks.send_deferred_message.apply_async') as apply_async, \
+                self.captureOnCommitCallbacks(execute=True):
+            self.run_task()
+        log = MessageLog.objects.get()
+        self.assertEqual(log.status, 'pending')
+        [call] = apply_async.call_args_list
+        self.assertEqual(call.kwargs['countdown'], 3)
+        self.assertEqual(call.kwargs['kwargs'], {'log_id': str(log.id), 'text': 'Olá', 'route': 'text', 'deferrals': 1})
+        self.schedule.refresh_from_db()
+        self.assertEqual(self.schedule.status, 'active')
+
+        # Na task reagendada, a instância tem token: o envio sai e o log é finalizado
+        self.router.send.return_value = ({'success': True, 'data': {'key': {'id': 'MSG'}}}, None)
+        send_deferred_message(**call.kwargs['kwargs'])
+        log.refresh_from_db()
+        self.assertEqual((log.status, log.evolution_message_id), ('sent', 'MSG'))
+        # Log já finalizado: uma reentrega da task não envia de novo
+        send_deferred_message(**call.kwargs['kwargs'])
+        self.assertEqual(self.router.send.call_count, 2)
+
+    def test_deferred_send_gives_up_after_the_deferral_limit(self):
+        log = MessageLog.objects.create(scheduled_message=self.schedule, recipient=self.contact.phone_number)
+        self.router.reserve.return_value = (None, 1.0)
+        with mock.patch('scheduler.tasks.send_deferred_message.apply_async') as apply_async, \
+                self.captureOnCommitCallbacks(execute=True), self.settings(EVOLUTION_RATE_LIMIT_MAX_DEFERRALS=2):
+            send_deferred_message(str(log.id), 'Olá', deferrals=1)
+            send_deferred_message(str(log.id), 'Olá', deferrals=2)
+        # Só a primeira execução ainda pôde se reagendar
+        [call] = apply_async.call_args_list
+        self.assertEqual(call.kwargs['kwargs']['deferrals'], 2)
+        self.router.send.assert_not_called()
+        log.refresh_from_db()
+        self.assertEqual(log.status, 'failed')
+
+    def test_existing_occurrence_log_blocks_resend(self):
+        MessageLog.objects.create(
+            scheduled_message=self.schedule, recipient=self.contact.phone_number, status='sent',
+            idempotency_key=idempotency_key(self.schedule.id, self.occurrence, self.contact.phone_number),
+        )
+        self.run_task()
+        self.router.send.assert_not_called()
+        self.assertEqual(MessageLog.objects.count(), 1)
+        self.schedule.refresh_from_db()
+        self.assertGreater(self.schedule.next_execution, self.occurrence)
+
+
+class DispatcherTests(TestCase):
+    """Modo dispatcher: lease (dispatched_at) do tick do beat e claim da ocorrência pelo worker."""
+
+    def setUp(self):
+        self.template = MessageTemplate.objects.create(title='Template', content='Olá')
+        self.contact = Contact.objects.create(name='Contato', phone_number='5511999999999')
+        self.now = timezone.now()
+
+    def schedule(self, next_execution, status='active', dispatched_at=None):
+        schedule = ScheduledMessage.objects.create(
+            title='Agendamento', message_template=self.template, contact=self.contact, recipient_type='contact',
+            frequency='daily', start_date=self.now + timedelta(days=1), status=status,
+        )
+        ScheduledMessage.objects.filter(id=schedule.id).update(next_execution=next_execution, dispatched_at=dispatched_at)
+        return schedule
+
+    def test_enqueues_due_schedules_and_respects_the_lease(self):
+        due = self.schedule(self.now - timedelta(minutes=1))
+        expired = self.schedule(self.now - timedelta(minutes=30), dispatched_at=self.now - timedelta(hours=1))
+        leased = self.schedule(self.now - timedelta(minutes=5), dispatched_at=self.now - timedelta(seconds=30))
+        self.schedule(self.now + timedelta(hours=1))
+        self.schedule(self.now - timedelta(minutes=1), status='paused')
+
+        with mock.patch('scheduler.tasks.process_scheduled_batch.delay') as delay:
+            self.assertEqual(dispatch_due_messages(), 2)
+        [call] = delay.call_args_list
+        self.assertEqual(call.kwargs['route'], 'text')
+        enqueued = dict(call.kwargs['items'])
+        self.assertEqual(set(enqueued), {str(due.id), str(expired.id)})
+        self.assertEqual(parse_datetime(enqueued[str(due.id)]), self.now - timedelta(minutes=1))
+        self.assertEqual(
+            set(ScheduledMessage.objects.filter(dispatched_at__gte=self.now).values_list('id', flat=True)),
+            {due.id, expired.id},
+        )
+
+        # O lease ainda vale no tick seguinte: nada é enfileirado de novo
+        with mock.patch('scheduler.tasks.process_scheduled_batch.delay') as delay:
+            self.assertEqual(dispatch_due_messages(), 0)
+        delay.assert_not_called()
+        leased.refresh_from_db()
+        self.assertLess(leased.dispatched_at, self.now)
+
+    def test_claim_succeeds_once_per_occurrence(self):
+        occurrence = self.now - timedelta(minutes=1)
+        schedule = self.schedule(occurrence)
+        schedule.refresh_from_db()
+        self.assertTrue(_is_pending_occurrence(schedule, occurrence))
+        next_run = occurrence + timedelta(days=1)
+        self.assertTrue(_claim_occurrence(schedule, occurrence, next_run, self.now))
+        self.assertFalse(_claim_occurrence(schedule, occurrence, next_run, self.now))
+        schedule.refresh_from_db()
+        self.assertEqual((schedule.next_execution, schedule.last_sent), (next_run, self.now))
+        self.assertFalse(_is_pending_occurrence(schedule, occurrence))
+
+    def test_migrate_to_dispatcher_removes_schedule_tasks(self):
+        with self.settings(SCHEDULER_DISPATCH_MODE='periodic_task'):
+            self.schedule(self.now + timedelta(hours=1))
+        other = PeriodicTask.objects.create(
+            name='outra', task='scheduler.tasks.cleanup_old_logs',
+            interval=IntervalSchedule.objects.create(every=1, period=IntervalSchedule.HOURS),
+        )
+        changed = PeriodicTasks.last_change()
+        with self.settings(SCHEDULER_DISPATCH_MODE='dispatcher'):
+            call_command('migrate_to_dispatcher', stdout=open(os.devnull, 'w'))
+        self.assertEqual(list(PeriodicTask.objects.values_list('id', flat=True)), [other.id])
+        self.assertNotEqual(PeriodicTasks.last_change(), changed)
+
+    def test_migrate_to_periodic_tasks_removes_the_dispatcher_task(self):
+        with self.settings(SCHEDULER_DISPATCH_MODE='dispatcher'):
+            active = self.schedule(self.now + timedelta(hours=1))
+            self.schedule(self.now + timedelta(hours=1), status='paused')
+        # Entrada de CELERY_BEAT_SCHEDULE persistida pelo DatabaseScheduler no modo dispatcher
+        PeriodicTask.objects.create(
+            name='dispatch-due-messages', task='scheduler.tasks.dispatch_due_messages',
+            interval=IntervalSchedule.objects.create(every=60, period=IntervalSchedule.SECONDS),
+        )
+        with self.settings(SCHEDULER_DISPATCH_MODE='dispatcher'):
+            call_command('migrate_to_periodic_tasks', stdout=open(os.devnull, 'w'), stderr=open(os.devnull, 'w'))
+        self.assertTrue(PeriodicTask.objects.filter(name='dispatch-due-messages').exists())
+
+        changed = PeriodicTasks.last_change()
+        with self.settings(SCHEDULER_DISPATCH_MODE='periodic_task'):
+            call_command('migrate_to_periodic_tasks', stdout=open(os.devnull, 'w'))
+        self.assertEqual(list(PeriodicTask.objects.values_list('name', flat=True)), [task_name(active.id)])
+        self.assertNotEqual(PeriodicTasks.last_change(), changed)
+
+
+class BeatSyncTests(TestCase):
+    """Sincronização em lote das PeriodicTasks (modo periodic_task) usada pelas operações em massa."""
+
+    def setUp(self):
+        self.template = MessageTemplate.objects.create(title='Template', content='Olá')
+        self.contact = Contact.objects.create(name='Contato', phone_number='5511999999999')
+        self.start = timezone.now() + timedelta(days=1)
+
+    def schedules(self, frequencies, status='active'):
+        return ScheduledMessage.objects.bulk_create([
+            ScheduledMessage(
+                title=f'Agendamento {index}', message_template=self.template, contact=self.contact,
+                recipient_type='contact', frequency=frequency, start_date=self.start, status=status,
+                day_of_week=1, day_of_month=10,
+            )
+            for index, frequency in enumerate(frequencies)
+        ])
+
+    def test_creates_updates_and_disables_tasks_with_set_based_queries(self):
+        schedules = self.schedules(['once', 'daily', 'weekly', 'monthly', 'yearly'] * 4)
+        with self.settings(SCHEDULER_DISPATCH_MODE='periodic_task'):
+            with CaptureQueriesContext(connection) as created:
+                sync_periodic_tasks(schedules)
+        tasks = {task.name: task for task in PeriodicTask.objects.all()}
+        self.assertEqual(set(tasks), {task_name(schedule.id) for schedule in schedules})
+        # Horários iguais compartilham o mesmo CrontabSchedule/ClockedSchedule
+        self.assertEqual(CrontabSchedule.objects.count(), 4)
+        self.assertEqual(ClockedSchedule.objects.count(), 1)
+        task = tasks[task_name(schedules[0].id)]
+        self.assertTrue(task.one_off)
+        self.assertEqual(json.loads(task.kwargs), {'schedule_id': str(schedules[0].id), 'route': 'text'})
+
+        for schedule in schedules[:10]:
+            schedule.status = 'paused'
+        with self.settings(SCHEDULER_DISPATCH_MODE='periodic_task'):
+            with CaptureQueriesContext(connection) as updated:
+                sync_periodic_tasks(schedules)
+        enabled = dict(PeriodicTask.objects.values_list('name', 'enabled'))
+        self.assertEqual(
+            {schedule.id for schedule in schedules if not enabled[task_name(schedule.id)]},
+            {schedule.id for schedule in schedules[:10]},
+        )
+        # O número de consultas não cresce com a quantidade de agendamentos
+        for queries in (created, updated):
+            self.assertLessEqual(len([query for query in queries if 'SAVEPOINT' not in query['sql']]), 11)
+
+    def test_does_nothing_in_dispatcher_mode(self):
+        schedules = self.schedules(['daily'])
+        with self.settings(SCHEDULER_DISPATCH_MODE='dispatcher'):
+            with CaptureQueriesContext(connection) as queries:
+                sync_periodic_tasks(schedules)
+        self.assertEqual(len(queries.captured_queries), 0)
+        self.assertFalse(PeriodicTask.objects.exists())
+
+    def test_delete_removes_tasks_and_notifies_the_beat(self):
+        schedules = self.schedules(['daily', 'once', 'weekly'])
+        with self.settings(SCHEDULER_DISPATCH_MODE='periodic_task'):
+            sync_periodic_tasks(schedules)
+        changed = PeriodicTasks.last_change()
+        self.assertEqual(delete_periodic_tasks([schedules[0].id, schedules[1].id]), 2)
+        self.assertEqual(list(PeriodicTask.objects.values_list('name', flat=True)), [task_name(schedules[2].id)])
+        self.assertNotEqual(PeriodicTasks.last_change(), changed)
+        self.assertEqual(delete_periodic_tasks([uuid.uuid4()]), 0)
+
+
+class BulkScheduleEndpointTests(TestCase):
+    """Endpoints /api/schedules/bulk-*: um resultado por item e PeriodicTasks sincronizadas em lote."""
+
+    def setUp(self):
+        self.client = APIClient()
+        self.client.force_authenticate(User.objects.create_user('api', password='x'))
+        self.template = MessageTemplate.objects.create(title='Template', content='Olá')
+        self.contact = Contact.objects.create(name='Contato', phone_number='5511999999999')
+        self.start = timezone.now() + timedelta(days=1)
+
+    def item(self, **overrides):
+        return {
+            'title': 'Agendamento', 'recipient_type': 'contact', 'frequency': 'daily',
+            'start_date': self.start.isoformat(), 'contact_id': str(self.contact.id),
+            'message_template_id': str(self.template.id), **overrides,
+        }
+
+    def create(self, count):
+        response = self.client.post('/api/schedules/bulk-create/', [self.item() for _ in range(count)], format='json')
+        self.assertEqual(response.status_code, 200, response.content)
+        return [item['id'] for item in response.json()['results']]
+
+    def test_bulk_create_reports_each_item(self):
+        items = [self.item(), self.item(contact_id=str(uuid.uuid4())), self.item(frequency='hourly'), self.item()]
+        response = self.client.post('/api/schedules/bulk-create/', {'items': items}, format='json')
+        self.assertEqual(response.status_code, 200)
+        body = response.json()
+        self.assertEqual(body['summary'], {'created': 2, 'error': 2})
+        self.assertEqual([item['result'] for item in body['results']], ['created', 'error', 'error', 'created'])
+        self.assertIn('contact_id', body['results'][1]['errors'])
+        created = [item['id'] for item in body['results'] if item['result'] == 'created']
+        self.assertEqual(
+            set(ScheduledMessage.objects.values_list('id', flat=True)), {uuid.UUID(value) for value in created}
+        )
+        self.assertEqual(ScheduledMessage.objects.filter(next_execution=self.start).count(), 2)
+        self.assertEqual(
+            set(PeriodicTask.objects.values_list('name', flat=True)), {task_name(value) for value in created}
+        )
+
+    def test_bulk_create_rejects_too_many_items(self):
+        with self.settings(BULK_SCHEDULE_MAX_ITEMS=2):
+            response = self.client.post('/api/schedules/bulk-create/', [self.item()] * 3, format='json')
+        self.assertEqual(response.status_code, 400)
+        self.assertFalse(ScheduledMessage.objects.exists())
+
+    def test_bulk_pause_and_resume_toggle_the_periodic_tasks(self):
+        ids = self.create(3)
+        missing = str(uuid.uuid4())
+        response = self.client.post('/api/schedules/bulk-pause/', {'ids': ids[:2] + [missing, 'x']}, format='json')
+        self.assertEqual(response.json()['summary'], {'updated': 2, 'not_found': 1, 'error': 1})
+        enabled = dict(PeriodicTask.objects.values_list('name', 'enabled'))
+        self.assertEqual([enabled[task_name(value)] for value in ids], [False, False, True])
+
+        # Só os pausados são retomados; o ativo é ignorado
+        response = self.client.post('/api/schedules/bulk-resume/', {'ids': ids}, format='json')
+        self.assertEqual(response.json()['summary'], {'updated': 2, 'skipped': 1})
+        self.assertTrue(all(PeriodicTask.objects.values_list('enabled', flat=True)))
+        self.assertEqual(set(ScheduledMessage.objects.values_list('status', flat=True)), {'active'})
+
+    def test_bulk_delete_removes_schedules_and_tasks(self):
+        ids = self.create(3)
+        response = self.client.post('/api/schedules/bulk-delete/', {'ids': ids[:2] + [str(uuid.uuid4())]}, format='json')
+        self.assertEqual(response.json()['summary'], {'deleted': 2, 'not_found': 1})
+        self.assertEqual(list(ScheduledMessage.objects.values_list('id', flat=True)), [uuid.UUID(ids[2])])
+        self.assertEqual(list(PeriodicTask.objects.values_list('name', flat=True)), [task_name(ids[2])])
+
+    def test_bulk_actions_require_ids(self):
+        response = self.client.post('/api/schedules/bulk-pause/', {'ids': []}, format='json')
+        self.assertEqual(response.status_code, 400)
+
+
+class ConcurrentBatchSendTests(TestCase):
+    """Lotes do dispatcher enviados pelo motor assíncrono: limite de concorrência, logs por destinatário e falhas."""
+
+    def setUp(self):
+        self.stub = EvolutionStubServer(seed=0).start()
+        self.addCleanup(self.stub.stop)
+        self.config = EvolutionConfig.objects.create(
+            instance_name='lote', api_key='k', base_url=self.stub.base_url, is_connected=True,
+        )
+        instance_router.invalidate()
+        self.addCleanup(instance_router.invalidate)
+        self.template = MessageTemplate.objects.create(title='Template', content='Olá {first_name}')
+        due = timezone.now() - timedelta(minutes=1)
+        self.schedules = [
+            ScheduledMessage.objects.create(
+                title=f'Lote {index}', message_template=self.template, recipient_type='contact', frequency='once',
+                contact=Contact.objects.create(name=f'Contato {index}', phone_number=f'551199999000{index}'),
+                start_date=due,
+            )
+            for index in range(3)
+        ]
+
+    def run_batch(self):
+        items = [[str(schedule.id), schedule.next_execution.isoformat()] for schedule in self.schedules]
+        return process_scheduled_batch.apply(kwargs={'items': items, 'route': 'text'}).get()
+
+    def test_semaphore_bounds_in_flight_sends(self):
+        sender = AsyncEvolutionSender('http://evolution.local', 'k', 'lote', concurrency=2)
+        in_flight, peak = [0], [0]
+
+        async def send_text(client, number, message):
+            in_flight[0] += 1
+            peak[0] = max(peak[0], in_flight[0])
+            await asyncio.sleep(0.01)
+            in_flight[0] -= 1
+            return {'success': True, 'data': {'key': {'id': number}}, 'status_code': 201}
+
+        sender.send_text = send_text
+        results = asyncio.run(sender.send_many([{'number': str(index), 'text': 'Oi'} for index in range(8)]))
+        self.assertEqual(peak[0], 2)
+        self.assertEqual([result['data']['key']['id'] for result in results], [str(index) for index in range(8)])
+
+    def test_rate_limit_wait_does_not_hold_a_slot(self):
+        limiter = mock.Mock()
+
+        async def acquire_async(instance_name, recipient):
+            if recipient == 'limitado':
+                await asyncio.sleep(0.05)
+
+        limiter.acquire_async = acquire_async
+        sender = AsyncEvolutionSender('http://evolution.local', 'k', 'lote', concurrency=1, rate_limiter=limiter)
+        sent = []
+
+        async def send_text(client, number, message):
+            sent.append(number)
+            return {'success': True, 'data': {}, 'status_code': 201}
+
+        sender.send_text = send_text
+        asyncio.run(sender.send_many([{'number': number, 'text': 'Oi'} for number in ('limitado', 'a', 'b')]))
+        self.assertEqual(sent, ['a', 'b', 'limitado'])
+
+    def test_batch_sends_every_schedule_and_logs_each_recipient(self):
+        self.assertEqual(self.run_batch(), 3)
+        logs = MessageLog.objects.filter(scheduled_message__in=self.schedules)
+        self.assertEqual({(log.status, log.instance_name) for log in logs}, {('sent', 'lote')})
+        self.assertEqual(len({log.evolution_message_id for log in logs}), 3)
+        self.assertEqual(self.stub.stats()['sent'], 3)
+        self.assertEqual(set(ScheduledMessage.objects.values_list('status', flat=True)), {'completed'})
+        # Reentrega do mesmo lote: as ocorrências já foram reivindicadas
+        self.assertEqual(self.run_batch(), 0)
+        self.assertEqual(self.stub.stats()['sent'], 3)
+
+    def test_api_errors_fail_the_log_and_the_schedule(self):
+        self.stub.error_rate = 1.0
+        self.run_batch()
+        logs = MessageLog.objects.filter(scheduled_message__in=self.schedules)
+        self.assertEqual({log.status for log in logs}, {'failed'})
+        self.assertTrue(all(log.error_message.startswith('API Error') for log in logs))
+        self.assertEqual(set(ScheduledMessage.objects.values_list('status', flat=True)), {'failed'})
+
+    def test_unreachable_instance_fails_over(self):
+        with EvolutionStubServer() as closed:
+            dead_url = closed.base_url
+        EvolutionConfig.objects.create(instance_name='caida', api_key='k', base_url=dead_url, is_connected=True, weight=10)
+        instance_router.invalidate()
+        self.run_batch()
+        logs = MessageLog.objects.filter(scheduled_message__in=self.schedules)
+        self.assertEqual({(log.status, log.instance_name) for log in logs}, {('sent', 'lote')})
+        self.assertFalse(EvolutionConfig.objects.get(instance_name='caida').is_connected)
+
+
+@skipUnless(fakeredis, 'fakeredis não instalado')
+class TokenBucketRateLimiterTests(SimpleTestCase):
+    """Script Lua do token bucket: reposição pela taxa, consumo tudo-ou-nada e tempo de espera."""
+
+    def setUp(self):
+        self.client = fakeredis.FakeRedis(decode_responses=True)
+        self.limiter = TokenBucketRateLimiter(client=self.client)
+        self.limiter.instance_rate, self.limiter.instance_burst = 2.0, 4
+        self.limiter.recipient_rate, self.limiter.recipient_burst = 0.5, 1
+        self.instance_key = f'{rate_limiter_module.INSTANCE_KEY_PREFIX}principal'
+
+    def tokens(self, key):
+        return float(self.client.hget(key, 'tokens'))
+
+    def test_burst_then_wait_for_the_instance_rate(self):
+        for index in range(4):
+            self.assertEqual(self.limiter.try_acquire('principal', [f'55119999900{index}']), 0.0)
+        # Bucket da instância vazio: um token a 2/s chega em 0,5 s
+        self.assertAlmostEqual(self.limiter.try_acquire('principal', ['5511999990009']), 0.5, delta=0.05)
+
+    def test_refills_by_elapsed_time_up_to_capacity(self):
+        seconds, micros = self.client.time()
+        now = seconds + micros / 1_000_000
+        self.client.hset(self.instance_key, mapping={'tokens': 0, 'ts': now - 1.5})
+        for index in range(3):
+            self.assertEqual(self.limiter.try_acquire('principal', [f'55119999900{index}']), 0.0)
+        self.assertGreater(self.limiter.try_acquire('principal', ['5511999990009']), 0)
+
+        self.client.hset(self.instance_key, mapping={'tokens': 0, 'ts': now - 3600})
+        self.limiter.recipient_rate = 0
+        self.assertEqual(self.limiter.try_acquire('principal', ['5511999990000'] * 4), 0.0)
+        self.assertAlmostEqual(self.tokens(self.instance_key), 0.0, delta=0.05)
+
+    def test_consumes_all_buckets_or_none(self):
+        self.assertEqual(self.limiter.try_acquire('principal', ['5511999990000']), 0.0)
+        before = self.tokens(self.instance_key)
+        # O destinatário esgotou (0,5/s): espera ~2 s e a instância não perde o token
+        wait = self.limiter.try_acquire('principal', ['5511999990000', '5511999990001'])
+        self.assertAlmostEqual(wait, 2.0, delta=0.05)
+        self.assertAlmostEqual(self.tokens(self.instance_key), before, delta=0.05)
+        self.assertFalse(self.client.exists(f'{rate_limiter_module.RECIPIENT_KEY_PREFIX}principal:5511999990001'))
+
+    def test_redis_failure_fails_open(self):
+        self.limiter._client = mock.Mock(eval=mock.Mock(side_effect=redis.RedisError('fora do ar')))
+        self.assertEqual(self.limiter.try_acquire('principal', ['5511999990000']), 0.0)
+
+
+@skipUnless(fakeredis, 'fakeredis não instalado')
+class InstanceRouterTests(TestCase):
+    """Estratégias de balanceamento entre instâncias Evolution e failover do envio."""
+
+    def setUp(self):
+        self.client = fakeredis.FakeRedis(decode_responses=True)
+        self.grande = EvolutionConfig.objects.create(instance_name='grande', api_key='k', base_url='http://a', weight=3, is_connected=True)
+        self.pequena = EvolutionConfig.objects.create(instance_name='pequena', api_key='k', base_url='http://b', weight=1, is_connected=True)
+
+    def router(self, strategy):
+        return InstanceRouter(strategy, client=self.client)
+
+    def test_weighted_round_robin_follows_weights(self):
+        router = self.router('weighted_round_robin')
+        chosen = [router.choose().instance_name for _ in range(8)]
+        self.assertEqual((chosen.count('grande'), chosen.count('pequena')), (6, 2))
+
+    def test_least_outstanding_prefers_the_least_loaded_per_weight(self):
+        router = self.router('least_outstanding')
+        router.track(self.grande, 6)
+        router.track(self.pequena, 1)
+        self.assertEqual(router.choose().instance_name, 'pequena')
+        router.track(self.pequena, 2)
+        self.assertEqual(router.choose().instance_name, 'grande')
+        # O lote é distribuído pela carga projetada por peso: grande 6/3 -> 10/3, pequena 3/1
+        assigned = [config.instance_name for config in router.assign(['1', '2', '3', '4', '5'])]
+        self.assertEqual(assigned, ['grande'] * 4 + ['pequena'])
+
+    def test_sticky_keeps_the_recipient_on_one_instance_until_it_goes_down(self):
+        router = self.router('sticky')
+        recipients = [f'55119999900{index:02d}' for index in range(20)]
+        first = {recipient: router.choose(recipient).instance_name for recipient in recipients}
+        self.assertEqual(first, {recipient: router.choose(recipient).instance_name for recipient in recipients})
+        self.assertEqual(set(first.values()), {'grande', 'pequena'})
+
+        router.mark_down(self.pequena, 'teste')
+        moved = {recipient: router.choose(recipient).instance_name for recipient in recipients}
+        self.assertEqual(set(moved.values()), {'grande'})
+        self.assertTrue(all(moved[r] == first[r] for r in recipients if first[r] == 'grande'))
+
+    def test_failover_reserves_rate_limit_tokens(self):
+        router = self.router('weighted_round_robin')
+        down = {'success': False, 'error': 'timeout', 'connection_error': True}
+        sent = {'success': True, 'data': {'key': {'id': 'MSG'}}}
+        send = mock.Mock(side_effect=[down, sent])
+        with mock.patch('scheduler.services.instance_router.rate_limiter') as limiter:
+            limiter.try_acquire.return_value = 0.0
+            response, config = router.send('5511999990000', send, config=self.grande)
+        self.assertEqual((response, config.instance_name), (sent, 'pequena'))
+        limiter.try_acquire.assert_called_once_with('pequena', ['5511999990000'])
+        self.assertFalse(EvolutionConfig.objects.get(pk=self.grande.pk).is_connected)
+
+    def test_rate_limited_failover_returns_retry_after_instead_of_waiting(self):
+        router = self.router('weighted_round_robin')
+        send = mock.Mock(return_value={'success': False, 'error': 'timeout', 'connection_error': True})
+        with mock.patch('scheduler.services.instance_router.rate_limiter') as limiter, \
+                mock.patch('time.sleep') as sleep:
+            limiter.try_acquire.return_value = 0.25
+            response, config = router.send('5511999990000', send, config=self.grande)
+        self.assertIsNone(config)
+        self.assertEqual((response['success'], response['status_code'], response['retry_after']), (False, 429, 0.25))
+        send.assert_called_once()
+        sleep.assert_not_called()
+
+    def test_falls_back_to_the_settings_instance_when_all_are_down(self):
+        router = self.router('weighted_round_robin')
+        router.healthy_instances()
+        for config in (self.grande, self.pequena):
+            self.client.set(f'router:down:{config.instance_name}', '1')
+        with self.settings(EVOLUTION_INSTANCE_NAME='padrao'):
+            self.assertEqual([config.instance_name for config in router.healthy_instances()], ['padrao'])
+
+
+class MediaCacheTests(TestCase):
+    """Cache de payloads de mídia: LRU por bytes, deduplicação por conteúdo e invalidação por template."""
+
+    def setUp(self):
+        media_root = tempfile.TemporaryDirectory()
+        self.addCleanup(media_root.cleanup)
+        override = self.settings(MEDIA_ROOT=media_root.name)
+        override.enable()
+        self.addCleanup(override.disable)
+        # 'aaa...' (300 bytes) vira 400 bytes em base64: cabem dois arquivos
+        self.cache = MediaCache(max_bytes=1000)
+
+    @staticmethod
+    def template(name, content):
+        return MessageTemplate.objects.create(
+            title=name, content='Legenda', media_type='image',
+            media_file=SimpleUploadedFile(f'{name}.png', content, content_type='image/png'),
+        )
+
+    def test_same_content_is_encoded_once(self):
+        first, second = self.template('a', b'a' * 300), self.template('b', b'a' * 300)
+        payload = self.cache.get_payload(first)
+        self.assertIs(self.cache.get_payload(second), payload)
+        self.assertEqual(payload['mimetype'], 'image/png')
+        stats = self.cache.stats()
+        self.assertEqual((stats['entries'], stats['templates'], stats['misses'], stats['hits']), (1, 2, 1, 1))
+
+        # Um template já visto não relê o arquivo
+        with mock.patch.object(first.media_file, 'open', side_effect=AssertionError('releu o arquivo')):
+            self.assertIs(self.cache.get_payload(first), payload)
+
+    def test_lru_eviction_also_drops_template_keys(self):
+        first, second, third = (self.template(name, name.encode() * 300) for name in ('a', 'b', 'c'))
+        self.cache.get_payload(first)
+        self.cache.get_payload(second)
+        self.cache.get_payload(first)  # 'a' passa a ser o mais recente
+        self.cache.get_payload(third)
+        stats = self.cache.stats()
+        self.assertEqual((stats['entries'], stats['templates'], stats['bytes']), (2, 2, 800))
+        self.assertEqual(self.cache.stats()['misses'], 3)
+        self.cache.get_payload(first)
+        self.assertEqual(self.cache.stats()['misses'], 3)
+        self.cache.get_payload(second)
+        self.assertEqual(self.cache.stats()['misses'], 4)
+
+    def test_oversized_files_are_not_cached(self):
+        self.cache.get_payload(self.template('grande', b'x' * 900))
+        self.assertEqual(self.cache.stats()['entries'], 0)
+        self.assertEqual(self.cache.stats()['templates'], 0)
+
+    def test_template_change_invalidates_its_entry(self):
+        template = self.template('a', b'a' * 300)
+        self.cache.get_payload(template)
+        self.cache.invalidate_template(template.pk)
+        self.assertEqual(self.cache.stats()['templates'], 0)
+
+        with mock.patch.object(media_cache, 'invalidate_template') as invalidate:
+            template.save()
+        invalidate.assert_called_once_with(template.pk)
+
+
+class MessageLogWriterTests(TestCase):
+    """Reserva dos logs antes do envio (um INSERT no caso comum) e resultados gravados em lote."""
+
+    def setUp(self):
+        template = MessageTemplate.objects.create(title='Template', content='Olá')
+        contact = Contact.objects.create(name='Contato', phone_number='5511999999999')
+        self.schedule = ScheduledMessage.objects.create(
+            title='Agendamento', message_template=template, contact=contact,
+            frequency='once', start_date=timezone.now() + timedelta(days=1),
+        )
+        self.occurrence = timezone.now()
+
+    def logs(self, *recipients):
+        return [
+            MessageLog(scheduled_message=self.schedule, recipient=recipient, status='pending',
+                       idempotency_key=idempotency_key(self.schedule.id, self.occurrence, recipient))
+            for recipient in recipients
+        ]
+
+    @staticmethod
+    def statements(queries):
+        return [query['sql'].split()[0] for query in queries if 'SAVEPOINT' not in query['sql']]
+
+    def test_reserve_without_conflicts_is_one_insert(self):
+        with CaptureQueriesContext(connection) as queries:
+            reserved = MessageLogWriter().reserve(self.logs('1', '2', '3'))
+        self.assertEqual(len(reserved), 3)
+        self.assertEqual(self.statements(queries), ['INSERT'])
+
+    def test_reserve_skips_recipients_already_logged(self):
+        MessageLogWriter().reserve(self.logs('1'))
+        with CaptureQueriesContext(connection) as queries:
+            reserved = MessageLogWriter().reserve(self.logs('1', '2'))
+        self.assertEqual([log_entry.recipient for log_entry in reserved], ['2'])
+        self.assertEqual(self.statements(queries), ['INSERT', 'INSERT', 'SELECT'])
+        self.assertEqual(MessageLog.objects.count(), 2)
+
+    def test_results_are_buffered_until_flush(self):
+        with MessageLogWriter(flush_size=10, flush_interval=3600) as log_writer:
+            reserved = log_writer.reserve(self.logs('1', '2'))
+            for log_entry in reserved:
+                log_entry.status = 'sent'
+                log_writer.update(log_entry)
+            self.assertEqual(set(MessageLog.objects.values_list('status', flat=True)), {'pending'})
+            with CaptureQueriesContext(connection) as queries:
+                log_writer.flush()
+        self.assertEqual(self.statements(queries), ['UPDATE'])
+        self.assertEqual(set(MessageLog.objects.values_list('status', flat=True)), {'sent'})
+
+    def test_flush_marks_the_reservation_and_completion_minutes_dirty(self):
+        with mock.patch('scheduler.services.log_writer.mark_dirty') as mark_dirty:
+            with MessageLogWriter() as log_writer:
+                [log_entry] = log_writer.reserve(self.logs('1'))
+                reserved_at = log_entry.sent_at
+                # Envio concluído horas depois da reserva (esperas de rate limit)
+                log_entry.status, log_entry.sent_at = 'sent', reserved_at + timedelta(hours=3)
+                log_writer.update(log_entry)
+            [(dirty,), _] = mark_dirty.call_args
+        self.assertEqual(set(dirty), {reserved_at, reserved_at + timedelta(hours=3)})
+
+        # Num segundo resultado do mesmo log, o sent_at anterior é o já gravado
+        with mock.patch('scheduler.services.log_writer.mark_dirty') as mark_dirty:
+            log_entry.status, log_entry.sent_at = 'failed', reserved_at + timedelta(hours=4)
+            log_writer.update(log_entry)
+            log_writer.flush()
+        self.assertEqual(set(mark_dirty.call_args.args[0]), {reserved_at + timedelta(hours=3), reserved_at + timedelta(hours=4)})
+
+
+@skipUnless(fakeredis, 'fakeredis não instalado')
+class DashboardCountersTests(TestCase):
+    """Contadores incrementais do dashboard: HINCRBY condicional (script Lua) e reconciliação com o banco."""
+
+    def setUp(self):
+        self.redis = fakeredis.FakeRedis(decode_responses=True)
+        patcher = mock.patch('scheduler.services.redis_client._client', self.redis)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        self.template = MessageTemplate.objects.create(title='Template', content='Olá')
+        self.contact = Contact.objects.create(name='Contato', phone_number='5511999999999')
+
+    def schedule(self, status='active'):
+        return ScheduledMessage.objects.create(
+            title='Agendamento', message_template=self.template, contact=self.contact, recipient_type='contact',
+            frequency='daily', start_date=timezone.now() + timedelta(days=1), status=status,
+        )
+
+    def counters(self):
+        return {field: int(value) for field, value in self.redis.hgetall(COUNTERS_KEY).items()
+                if field != RECONCILED_AT_FIELD}
+
+    def test_deltas_are_ignored_until_the_hash_is_reconciled(self):
+        with self.captureOnCommitCallbacks(execute=True):
+            dashboard_counters.transition('schedule', None, 'active')
+        # Sem base reconciliada, o script não cria um hash parcial
+        self.assertFalse(self.redis.exists(COUNTERS_KEY))
+
+        dashboard_counters.reconcile()
+        with self.captureOnCommitCallbacks(execute=True):
+            dashboard_counters.transitions('log', [(None, 'pending'), (None, 'pending'), ('pending', 'sent')])
+            dashboard_counters.transition('schedule', 'active', 'paused', count=2)
+            dashboard_counters.transition('schedule', 'paused', 'paused')
+        self.assertEqual(self.counters(), {'log:pending': 1, 'log:sent': 1, 'schedule:active': -2, 'schedule:paused': 2})
+
+    def test_deltas_wait_for_the_commit(self):
+        dashboard_counters.reconcile()
+        with self.captureOnCommitCallbacks() as callbacks:
+            dashboard_counters.transition('log', None, 'sent')
+        self.assertEqual(self.counters(), {})
+        for callback in callbacks:
+            callback()
+        self.assertEqual(self.counters(), {'log:sent': 1})
+
+    def test_signals_and_snapshot_follow_schedule_changes(self):
+        dashboard_counters.reconcile()
+        with mock.patch('scheduler.tasks.precheck_numbers.delay'):
+            with self.captureOnCommitCallbacks(execute=True):
+                schedule = self.schedule()
+                self.schedule(status='paused')
+            with self.captureOnCommitCallbacks(execute=True):
+                schedule.status = 'completed'
+                schedule.save()
+        snapshot = dashboard_counters.snapshot()
+        self.assertEqual(snapshot['schedule_summary'], {'paused': 1, 'completed': 1})
+        self.assertEqual(snapshot['total_schedules'], 2)
+
+    def test_reconcile_task_replaces_drifted_counters(self):
+        self.schedule()
+        self.schedule(status='paused')
+        self.redis.hset(COUNTERS_KEY, mapping={'schedule:active': 40, 'schedule:failed': 3})
+        self.assertEqual(reconcile_dashboard_counters(), {'schedule:active': 1, 'schedule:paused': 1})
+        self.assertEqual(self.counters(), {'schedule:active': 1, 'schedule:paused': 1})
+        self.assertTrue(self.redis.hget(COUNTERS_KEY, RECONCILED_AT_FIELD))
+
+    def test_snapshot_reconciles_a_missing_hash_and_falls_back_to_the_database(self):
+        self.schedule()
+        self.assertEqual(dashboard_counters.snapshot()['schedule_summary'], {'active': 1})
+        self.assertEqual(self.counters(), {'schedule:active': 1})
+
+        with mock.patch.object(self.redis, 'hgetall', side_effect=redis.ConnectionError('down')):
+            snapshot = dashboard_counters.snapshot()
+        self.assertEqual((snapshot['schedule_summary'], snapshot['total_logs']), ({'active': 1}, 0))
+
+    def test_redis_errors_on_deltas_are_not_raised(self):
+        with mock.patch.object(self.redis, 'eval', side_effect=redis.ConnectionError('down')):
+            with self.captureOnCommitCallbacks(execute=True):
+                dashboard_counters.transition('schedule', None, 'active')
+
+
+class SendRollupTests(TestCase):
+    """Consolidação dos logs em SendRollup: dias no fuso do projeto, uma transação por janela e horas alteradas."""
+
+    def setUp(self):
+        template = MessageTemplate.objects.create(title='Template', content='Olá')
+        contact = Contact.objects.create(name='Contato', phone_number='5511999999999')
+        self.schedule = ScheduledMessage.objects.create(
+            title='Agendamento', message_template=template, contact=contact, recipient_type='contact',
+            frequency='daily', start_date=timezone.now() + timedelta(days=1),
+        )
+        # 23:30 e 00:30 em São Paulo (UTC-3): mesmo dia em UTC, dias diferentes no fuso do projeto
+        self.evening = datetime(2026, 3, 10, 2, 30, tzinfo=dt_timezone.utc)
+        self.midnight = datetime(2026, 3, 10, 3, 30, tzinfo=dt_timezone.utc)
+        self.now = datetime(2026, 3, 10, 12, 0, tzinfo=dt_timezone.utc)
+
+    def logs(self, *rows):
+        logs = MessageLog.objects.bulk_create([
+            MessageLog(scheduled_message=self.schedule, recipient='5511999999999', status=status, instance_name='principal')
+            for _, status in rows
+        ])
+        for log_entry, (sent_at, _) in zip(logs, rows):
+            log_entry.sent_at = sent_at
+        MessageLog.objects.bulk_update(logs, ['sent_at'])
+        return logs
+
+    def series(self, granularity, dimension='all'):
+        return {
+            timezone.localtime(row.bucket_start).isoformat(): (row.total, row.sent, row.failed, row.delivered)
+            for row in SendRollup.objects.filter(granularity=granularity, dimension=dimension).order_by('bucket_start')
+        }
+
+    def test_days_are_grouped_in_the_project_timezone(self):
+        self.logs((self.evening, 'sent'), (self.evening, 'failed'), (self.midnight, 'delivered'))
+        with mock.patch('scheduler.services.rollups._pop_dirty_hours', return_value=[]):
+            stats = run_rollup(now=self.now)
+        self.assertEqual(stats['windows'], 1)
+        self.assertEqual(self.series('day'), {
+            '2026-03-09T00:00:00-03:00': (2, 1, 1, 0),
+            '2026-03-10T00:00:00-03:00': (1, 1, 0, 1),
+        })
+        self.assertEqual(self.series('hour', 'instance'), {
+            '2026-03-09T23:00:00-03:00': (2, 1, 1, 0),
+            '2026-03-10T00:00:00-03:00': (1, 1, 0, 1),
+        })
+        self.assertEqual(len(self.series('minute', 'schedule')), 2)
+        self.assertEqual(RollupCheckpoint.objects.get().position, self.now - timedelta(seconds=120))
+
+    def test_each_window_commits_on_its_own(self):
+        self.logs((self.now - timedelta(days=2, hours=12), 'sent'))
+        RollupCheckpoint.objects.create(name='message_logs', position=self.now - timedelta(days=3))
+        calls = []
+
+        def rebuild(start, end):
+            calls.append(start)
+            if len(calls) == 2:
+                raise RuntimeError('falha no banco')
+            return rebuild_range(start, end)
+
+        with mock.patch('scheduler.services.rollups._pop_dirty_hours', return_value=[]), \
+                mock.patch('scheduler.services.rollups.rebuild_range', side_effect=rebuild):
+            with self.assertRaises(RuntimeError):
+                run_rollup(now=self.now)
+        # A primeira janela ficou gravada; a segunda foi desfeita e é retomada na próxima execução
+        self.assertEqual(RollupCheckpoint.objects.get().position, self.now - timedelta(days=2))
+        self.assertTrue(SendRollup.objects.filter(granularity='day').exists())
+
+        with mock.patch('scheduler.services.rollups._pop_dirty_hours', return_value=[]):
+            self.assertEqual(run_rollup(now=self.now)['windows'], 2)
+        self.assertEqual(RollupCheckpoint.objects.get().position, self.now - timedelta(seconds=120))
+
+    def test_backfill_is_limited_per_run(self):
+        RollupCheckpoint.objects.create(name='message_logs', position=self.now - timedelta(days=10))
+        with mock.patch('scheduler.services.rollups._pop_dirty_hours', return_value=[]):
+            self.assertEqual(run_rollup(now=self.now)['windows'], 7)
+            self.assertEqual(run_rollup(now=self.now)['windows'], 3)
+            self.assertEqual(run_rollup(now=self.now)['windows'], 0)
+
+    @skipUnless(fakeredis, 'fakeredis não instalado')
+    def test_dirty_hours_are_rebuilt_and_restored_on_failure(self):
+        client = fakeredis.FakeRedis(decode_responses=True)
+        [log_entry] = self.logs((self.midnight, 'sent'))
+        with mock.patch('scheduler.services.redis_client._client', client):
+            run_rollup(now=self.now)
+            MessageLog.objects.filter(id=log_entry.id).update(status='delivered')
+            with self.captureOnCommitCallbacks(execute=True):
+                mark_dirty([self.midnight])
+
+            with mock.patch('scheduler.services.rollups.rebuild_range', side_effect=RuntimeError('falha no banco')):
+                with self.captureOnCommitCallbacks(execute=True), self.assertRaises(RuntimeError):
+                    run_rollup(now=self.now)
+            self.assertEqual(client.smembers(DIRTY_MINUTES_KEY), {str(int(self.midnight.timestamp()) // 3600 * 60)})
+
+            stats = run_rollup(now=self.now)
+        self.assertEqual((stats['dirty_ranges'], stats['windows']), (1, 0))
+        self.assertEqual(self.series('day')['2026-03-10T00:00:00-03:00'], (1, 1, 0, 1))
+        self.assertFalse(client.exists(DIRTY_MINUTES_KEY))
+
+
+class TimelineCacheTests(TestCase):
+    """Linha do tempo em cache: mesma chave para consultas próximas e invalidação só quando a regra muda."""
+
+    def setUp(self):
+        cache.clear()
+        self.client = APIClient()
+        self.client.force_authenticate(User.objects.create_user('api', password='x'))
+        template = MessageTemplate.objects.create(title='Template', content='Olá')
+        contact = Contact.objects.create(name='Contato', phone_number='5511999999999')
+        self.schedule = ScheduledMessage.objects.create(
+            title='Diário', message_template=template, contact=contact, recipient_type='contact',
+            frequency='daily', start_date=timezone.now() + timedelta(hours=1),
+        )
+
+    def version(self):
+        return cache.get(timeline_module.VERSION_KEY)
+
+    def test_default_window_hits_the_cache(self):
+        hour = timezone.now().replace(minute=0, second=0, microsecond=0)
+        with mock.patch('scheduler.services.timeline.build_timeline', wraps=timeline_module.build_timeline) as build:
+            with mock.patch('django.utils.timezone.now', return_value=hour + timedelta(minutes=10)):
+                first = self.client.get('/api/schedules/timeline/?bucket=day').json()
+            with mock.patch('django.utils.timezone.now', return_value=hour + timedelta(minutes=40)):
+                second = self.client.get('/api/schedules/timeline/?bucket=day').json()
+        self.assertEqual(build.call_count, 1)
+        self.assertEqual(first, second)
+        self.assertEqual(first['total'], 7)
+
+    def test_explicit_start_is_not_truncated(self):
+        default = self.client.get('/api/schedules/timeline/').json()['occurrences']
+        first = parse_datetime(default[0]['at'])
+        start = first + timedelta(minutes=1)
+        self.assertNotEqual(start.minute, 0)
+        response = self.client.get('/api/schedules/timeline/', {'start': start.isoformat()})
+        self.assertEqual(response.status_code, 200)
+        data = response.json()
+        self.assertEqual(parse_datetime(data['start']), start)
+        # A ocorrência um minuto antes do start (na mesma hora) fica de fora
+        self.assertEqual(data['occurrences'][0], default[1])
+
+    def test_only_rule_title_and_status_changes_invalidate(self):
+        before = self.version()
+        # Save feito a cada envio: avança next_execution/last_sent, status inalterado
+        self.schedule.last_sent = timezone.now()
+        self.schedule.next_execution += timedelta(days=1)
+        self.schedule.save(update_fields=['status', 'last_sent', 'next_execution', 'dispatched_at'])
+        self.schedule.save()
+        self.assertEqual(self.version(), before)
+
+        self.schedule.frequency = 'weekly'
+        self.schedule.save()
+        self.assertGreater(self.version(), before)
+
+        changed = self.version()
+        ScheduledMessage.objects.get(pk=self.schedule.pk).delete()
+        self.assertGreater(self.version(), changed)
+
+
+class ContactImportTests(TestCase):
+    """Importação de contatos em massa: leitura em streaming, upsert pelo telefone e relatório de erros."""
+
+    CSV = (
+        'name,phone_number,is_active\n'
+        'Ana,(11) 99999-0001,sim\n'
+        'Bruno,11999990002,\n'
+        ',11999990003,1\n'
+        'Carla,123,1\n'
+        'Davi,11999990004,talvez\n'
+        'Ana Souza,5511999990001,não\n'
+    )
+
+    def setUp(self):
+        Contact.objects.create(name='Bruno Antigo', phone_number='5511999990002', is_active=False)
+
+    @staticmethod
+    def lines(text):
+        return (line.encode() for line in text.splitlines(keepends=True))
+
+    def test_rows_are_parsed_lazily(self):
+        consumed = []
+
+        def source():
+            for line in self.lines('{"name": "Ana", "phone_number": "11999990001"}\nnão é json\n\n{"name": "Bia"}\n'):
+                consumed.append(line)
+                yield line
+
+        rows = iter_rows(source(), 'jsonl')
+        self.assertEqual(next(rows), (1, {'name': 'Ana', 'phone_number': '11999990001'}))
+        self.assertEqual(len(consumed), 1)
+        row, error = next(rows)
+        self.assertEqual(row, 2)
+        self.assertIsInstance(error, ContactImportError)
+        self.assertEqual(next(rows), (4, {'name': 'Bia'}))
+
+    def test_upserts_by_normalized_phone_and_reports_errors(self):
+        with mock.patch('scheduler.services.contact_import._upsert', wraps=contact_import._upsert) as upsert:
+            report = import_contacts(self.lines(self.CSV), 'csv', chunk_size=2, max_errors=2)
+        self.assertEqual(upsert.call_count, 2)
+        self.assertEqual(
+            {key: report[key] for key in ('processed', 'created', 'updated', 'error_count', 'errors_truncated')},
+            {'processed': 6, 'created': 1, 'updated': 2, 'error_count': 3, 'errors_truncated': True},
+        )
+        self.assertEqual([error['row'] for error in report['errors']], [4, 5])
+        self.assertIn('name', report['errors'][0]['error'])
+        self.assertIn('phone_number', report['errors'][1]['error'])
+        contacts = {contact.phone_number: (contact.name, contact.is_active) for contact in Contact.objects.all()}
+        # A última linha do mesmo telefone vale; is_active vazio é True
+        self.assertEqual(contacts, {
+            '5511999990001': ('Ana Souza', False),
+            '5511999990002': ('Bruno', True),
+        })
+
+    def test_command_reads_file_and_writes_report(self):
+        with tempfile.TemporaryDirectory() as directory:
+            path = os.path.join(directory, 'contatos.csv')
+            report_path = os.path.join(directory, 'relatorio.json')
+            with open(path, 'w', encoding='utf-8') as output:
+                output.write(self.CSV)
+            stdout, stderr = io.StringIO(), io.StringIO()
+            call_command('import_contacts', path, report=report_path, stdout=stdout, stderr=stderr)
+            with open(report_path, encoding='utf-8') as saved:
+                report = json.load(saved)
+            self.assertEqual(report['error_count'], 3)
+            self.assertIn('6 linhas processadas', stdout.getvalue())
+            self.assertIn('Linha 6: is_active inválido', stderr.getvalue())
+            with self.assertRaises(CommandError):
+                call_command('import_contacts', os.path.join(directory, 'nao_existe.csv'), stdout=stdout)
+
+    def test_api_import_endpoint(self):
+        client = APIClient()
+        client.force_authenticate(User.objects.create_user('api', password='x'))
+        upload = SimpleUploadedFile('contatos.jsonl', b'{"name": "Eva", "phone_number": "11999990005"}\n[]\n')
+        response = client.post('/api/contacts/import/', {'file': upload}, format='multipart')
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual((response.json()['created'], response.json()['error_count']), (1, 1))
+        self.assertTrue(Contact.objects.filter(phone_number='5511999990005').exists())
+
+        self.assertEqual(client.post('/api/contacts/import/', {}, format='multipart').status_code, 400)
+        upload = SimpleUploadedFile('contatos.txt', b'name,phone_number\n')
+        response = client.post('/api/contacts/import/?file_format=xml', {'file': upload}, format='multipart')
+        self.assertEqual(response.status_code, 400)
+
+
+class TemplateRendererTests(SimpleTestCase):
+    """Planos compilados por (id, updated_at) e renderização em lote por destinatário."""
+
+    RECIPIENTS = [{'phone_number': '5511999999999', 'name': 'Maria Silva'}, {'phone_number': '123@g.us', 'name': 'Grupo'}]
+
+    def setUp(self):
+        self.renderer = TemplateRenderer(max_entries=2)
+
+    def template(self, content, updated_at=None):
+        return MessageTemplate(id=uuid.uuid4(), content=content, updated_at=updated_at or timezone.now())
+
+    def test_renders_recipient_send_and_custom_variables(self):
+        template = self.template('Oi {first_name} ({phone}), {cupom} em {date}: {{literal}} {desconhecida} {0}')
+        texts = self.renderer.render_many(template, self.RECIPIENTS, {'cupom': 'PROMO', 'date': '01/02/2025'})
+        self.assertEqual(texts, [
+            'Oi Maria (5511999999999), PROMO em 01/02/2025: {literal} {desconhecida} {0}',
+            'Oi Grupo (123@g.us), PROMO em 01/02/2025: {literal} {desconhecida} {0}',
+        ])
+
+    def test_malformed_braces_are_sent_verbatim(self):
+        template = self.template('Promoção {name')
+        self.assertEqual(self.renderer.render_many(template, self.RECIPIENTS, {}), ['Promoção {name'] * 2)
+
+    def test_plan_is_cached_by_id_and_updated_at(self):
+        template = self.template('Olá {name}')
+        self.renderer.render_many(template, self.RECIPIENTS, {})
+        self.renderer.render_many(template, self.RECIPIENTS, {})
+        self.assertEqual((self.renderer.hits, self.renderer.misses), (1, 1))
+
+        template.content = 'Tchau {name}'
+        template.updated_at += timedelta(seconds=1)
+        self.assertEqual(self.renderer.render_many(template, self.RECIPIENTS[:1], {}), ['Tchau Maria Silva'])
+        self.assertEqual(self.renderer.misses, 2)
+
+
+class GroupSyncTests(TestCase):
+    """Sincronização de grupos: diff em memória, gravações em lote e checkpoint por instância."""
+
+    GROUPS = 3_000
+
+    def setUp(self):
+        self.remote = [{'id': f'{index}@g.us', 'subject': f'Grupo {index}'} for index in range(self.GROUPS)]
+        patcher = mock.patch('scheduler.services.group_sync.EvolutionAPIService')
+        self.service = patcher.start().return_value
+        self.addCleanup(patcher.stop)
+        self.service.fetch_groups.side_effect = lambda **kwargs: {'success': True, 'data': self.remote}
+
+    def test_applies_only_the_differences_in_bulk(self):
+        report = sync_groups()
+        self.assertEqual((report['created'], report['updated'], report['deactivated']), (self.GROUPS, 0, 0))
+
+        self.remote[0]['subject'] = 'Renomeado'
+        del self.remote[1]
+        report = sync_groups()
+        self.assertEqual((report['created'], report['updated'], report['deactivated']), (0, 1, 1))
+        self.assertEqual(Group.objects.get(group_id='0@g.us').name, 'Renomeado')
+        self.assertFalse(Group.objects.get(group_id='1@g.us').is_active)
+
+    def test_unchanged_lists_skip_the_group_table(self):
+        sync_groups()
+        # Só os checkpoints e as instâncias cadastradas são lidos
+        with self.assertNumQueries(2):
+            report = sync_groups()
+        self.assertEqual(set(report['instances'].values()), {'unchanged'})
+
+    def test_failed_instance_never_deactivates(self):
+        sync_groups()
+        self.service.fetch_groups.side_effect = lambda **kwargs: {'success': False, 'error': 'timeout'}
+        sync_groups(force=True)
+        self.assertEqual(Group.objects.filter(is_active=True).count(), self.GROUPS)
+
+
+class SendRoutingTests(TestCase):
+    """Rota (fila) dos envios: prioridade e mídia, convertida pelo roteador do Celery."""
+
+    def test_route_by_priority_and_media(self):
+        self.assertEqual(send_route('high', 'video'), 'high')
+        self.assertEqual(send_route('low', 'text'), 'bulk')
+        self.assertEqual(send_route('normal', 'image'), 'media')
+        self.assertEqual(send_route('normal', 'text'), 'text')
+
+    def test_dispatcher_routes_and_celery_queue(self):
+        from whatsapp_scheduler.celery import route_task
+
+        template = MessageTemplate.objects.create(title='Vídeo', content='Oi', media_type='video')
+        contact = Contact.objects.create(name='Ana', phone_number='5511999990000')
+        schedule = ScheduledMessage.objects.create(
+            title='Envio', message_template=template, contact=contact,
+            frequency='once', start_date=timezone.now() + timedelta(days=1),
+        )
+        with self.assertNumQueries(1):
+            routes = routes_for_ids([schedule.id])
+        self.assertEqual(routes, {schedule.id: 'media'})
+
+        name = 'scheduler.tasks.process_scheduled_message'
+        self.assertEqual(route_task(name, [], {'schedule_id': 'x', 'route': 'media'}, {}), {'queue': 'send_media'})
+        self.assertEqual(route_task(name, [], {'schedule_id': 'x'}, {}), {'queue': 'send_text'})
+        batch = 'scheduler.tasks.process_scheduled_batch'
+        self.assertEqual(route_task(batch, [], {'items': [], 'route': 'high'}, {}), {'queue': 'send_high'})
+        self.assertIsNone(route_task('scheduler.tasks.cleanup_old_logs', [], {}, {}))
+
+    def test_template_media_change_reroutes_periodic_tasks(self):
+        template = MessageTemplate.objects.create(title='Aviso', content='Oi')
+        other = MessageTemplate.objects.create(title='Outro', content='Oi')
+        contact = Contact.objects.create(name='Ana', phone_number='5511999990000')
+
+        def schedule(message_template, **fields):
+            return ScheduledMessage.objects.create(
+                title='Envio', message_template=message_template, contact=contact, frequency='daily',
+                start_date=timezone.now() + timedelta(days=1), **fields,
+            )
+
+        def routes():
+            return {
+                task.name: json.loads(task.kwargs)['route']
+                for task in PeriodicTask.objects.filter(name__startswith='whatsapp-schedule-')
+            }
+
+        with self.settings(SCHEDULER_DISPATCH_MODE='periodic_task'):
+            normal, high, untouched = schedule(template), schedule(template, priority='high'), schedule(other)
+            paused = schedule(template, status='paused')
+            self.assertEqual(set(routes().values()), {'text', 'high'})
+
+            # Alterar outro campo, ou gravar só outros campos, não ressincroniza
+            template.title = 'Aviso novo'
+            with self.assertNumQueries(1):
+                template.save(update_fields=['title'])
+            template = MessageTemplate.objects.get(id=template.id)
+            template.media_type = 'image'
+            with self.assertNumQueries(1):
+                template.save(update_fields=['title'])
+            self.assertEqual(routes()[task_name(normal.id)], 'text')
+
+            template.save()
+        # O pausado não tem tarefa: a rota é calculada quando ele for retomado
+        self.assertEqual(routes(), {
+            task_name(normal.id): 'media', task_name(high.id): 'high', task_name(untouched.id): 'text',
+        })
+        with self.settings(SCHEDULER_DISPATCH_MODE='periodic_task'):
+            paused = ScheduledMessage.objects.get(id=paused.id)
+            paused.status = 'active'
+            paused.save()
+        self.assertEqual(routes()[task_name(paused.id)], 'media')
+
+        # No modo dispatcher a rota é calculada a cada tick, direto do banco
+        with self.settings(SCHEDULER_DISPATCH_MODE='dispatcher'):
+            template.media_type = 'text'
+            template.save()
+        self.assertEqual(routes()[task_name(normal.id)], 'media')
+        self.assertEqual(routes_for_ids([normal.id]), {normal.id: 'text'})
+
+
+class EvolutionStubTests(SimpleTestCase):
+    """Evolution API falsa usada pelo teste de carga: respostas, erros simulados e throttling."""
+
+    def setUp(self):
+        self.stub = EvolutionStubServer(groups=5, seed=0).start()
+        self.addCleanup(self.stub.stop)
+        self.service = EvolutionAPIService(mock.Mock(base_url=self.stub.base_url, api_key='k', instance_name='stub'))
+
+    def test_send_text_returns_message_key(self):
+        response = self.service.send_text_message('5511999990000', 'Oi')
+        self.assertTrue(response['success'])
+        self.assertTrue(response['data']['key']['id'])
+        self.assertEqual(response['data']['key']['remoteJid'], '5511999990000@s.whatsapp.net')
+        self.assertEqual(self.service.check_instance_status()['data']['instance']['state'], 'open')
+        self.assertEqual(len(parse_groups(self.service.fetch_groups()['data'])), 5)
+
+    def test_simulated_errors_and_throttling(self):
+        self.stub.error_rate = 1.0
+        response = self.service.send_text_message('5511999990000', 'Oi')
+        self.assertEqual((response['success'], response['status_code']), (False, 500))
+
+        self.stub.error_rate, self.stub.rate_limit = 0.0, 1
+        statuses = [self.service.send_text_message('5511999990000', 'Oi')['status_code'] for _ in range(3)]
+        self.assertIn(429, statuses)
+        self.assertEqual(self.stub.stats()['throttled'], statuses.count(429))
+
+
+class LoadTestSendTests(TestCase):
+    """Teste de carga ponta a ponta: percentis calculados por mensagem, não por lote."""
+
+    def test_latency_percentiles_are_per_message(self):
+        stdout = io.StringIO()
+        with mock.patch('scheduler.tasks.precheck_numbers.delay'):
+            call_command('load_test_send', messages=6, instances=1, batch_size=3, latency_ms=0, jitter_ms=0,
+                         json=True, stdout=stdout)
+        report = json.loads(stdout.getvalue())
+        self.assertEqual((report['sends'], report['batches']), (6, 2))
+        self.assertEqual(report['latency_samples'], 6)
+        # Cada mensagem leva menos que o lote inteiro em que foi enviada
+        self.assertLessEqual(report['latency_ms']['max'], report['batch_ms']['max'])
+        self.assertFalse(ScheduledMessage.objects.exists())
+
+
+class BenchmarkSuiteTests(TestCase):
+    """Suite de microbenchmarks: baseline JSON e detecção de regressões."""
+
+    def test_compare_flags_slower_or_chattier_benchmarks(self):
+        baseline = {'a': {'us_per_op': 10.0, 'queries_per_op': 0}, 'b': {'us_per_op': 10.0, 'queries_per_op': 2}}
+        results = {'a': {'us_per_op': 13.0, 'queries_per_op': 0}, 'b': {'us_per_op': 9.0, 'queries_per_op': 3},
+                   'new': {'us_per_op': 1.0, 'queries_per_op': 0}}
+        self.assertEqual(
+            [(name, regressed) for name, _, _, _, regressed in compare(results, baseline, threshold=0.2)],
+            [('a', True), ('b', True)],
+        )
+
+    def test_save_and_compare_baseline(self):
+        with tempfile.TemporaryDirectory() as directory:
+            path = os.path.join(directory, 'baseline.json')
+            options = {'scale': 0.01, 'rounds': 1, 'stdout': open(os.devnull, 'w')}
+            self.addCleanup(options['stdout'].close)
+            call_command('run_benchmarks', save=path, **options)
+            with open(path) as baseline:
+                results = json.load(baseline)['results']
+            self.assertIn('periodic_task_signal', results)
+            self.assertGreater(results['periodic_task_signal']['queries_per_op'], 0)
+            # O que o benchmark gravou no banco foi desfeito
+            self.assertFalse(ScheduledMessage.objects.exists())
+
+            call_command('run_benchmarks', 'format_phone_number', compare=path, threshold=100, **options)
+            with self.assertRaises(CommandError):
+                call_command('run_benchmarks', 'nao_existe', **options)
+
+
+class MetricsTests(TestCase):
+    """Métricas Prometheus: latência da Evolution API, envios, tempo de fila, atraso e consultas por task."""
+
+    @staticmethod
+    def sample(name, **labels):
+        return metrics.REGISTRY.get_sample_value(name, labels) or 0
+
+    def test_evolution_latency_per_endpoint_and_instance(self):
+        labels = {'endpoint': 'message/sendText', 'instance': 'metricas'}
+        before = self.sample('whatsapp_evolution_request_seconds_count', **labels)
+        with EvolutionStubServer() as stub:
+            service = EvolutionAPIService(mock.Mock(base_url=stub.base_url, api_key='k', instance_name='metricas'))
+            service.send_text_message('5511999990000', 'Oi')
+        self.assertEqual(self.sample('whatsapp_evolution_request_seconds_count', **labels), before + 1)
+        self.assertGreaterEqual(self.sample('whatsapp_evolution_requests_total', status_code='201', **labels), 1)
+
+    def test_pooled_session_counts_opened_and_reused_connections(self):
+        before = (self.sample('whatsapp_evolution_http_connections_total', state='opened'),
+                  self.sample('whatsapp_evolution_http_connections_total', state='reused'))
+        reset_session()
+        self.addCleanup(reset_session)
+        with EvolutionStubServer() as stub:
+            service = EvolutionAPIService(mock.Mock(base_url=stub.base_url, api_key='k', instance_name='metricas'))
+            for _ in range(3):
+                self.assertTrue(service.send_text_message('5511999990000', 'Oi')['success'])
+        self.assertEqual(self.sample('whatsapp_evolution_http_connections_total', state='opened'), before[0] + 1)
+        self.assertEqual(self.sample('whatsapp_evolution_http_connections_total', state='reused'), before[1] + 2)
+
+    def test_send_task_records_outcome_lag_and_queries(self):
+        template = MessageTemplate.objects.create(title='Template', content='Olá')
+        contact = Contact.objects.create(name='Contato', phone_number='5511988887777')
+        schedule = ScheduledMessage.objects.create(
+            title='Agendamento', message_template=template, contact=contact, recipient_type='contact',
+            frequency='daily', start_date=timezone.now() - timedelta(minutes=1),
+        )
+        task = 'scheduler.tasks.process_scheduled_message'
+        before = (
+            self.sample('whatsapp_sends_total', status='sent', instance='principal'),
+            self.sample('whatsapp_schedule_firing_lag_seconds_count', frequency='daily'),
+            self.sample('whatsapp_task_db_queries_count', task=task),
+            self.sample('whatsapp_task_db_queries_sum', task=task),
+        )
+        with mock.patch('scheduler.tasks.instance_router') as router:
+            router.reserve.return_value = (None, 0)
+            router.send.return_value = ({'success': True, 'data': {'key': {'id': 'MSG'}}}, mock.Mock(instance_name='principal'))
+            process_scheduled_message.apply(kwargs={'schedule_id': str(schedule.id)})
+
+        self.assertEqual(self.sample('whatsapp_sends_total', status='sent', instance='principal'), before[0] + 1)
+        self.assertEqual(self.sample('whatsapp_schedule_firing_lag_seconds_count', frequency='daily'), before[1] + 1)
+        self.assertEqual(self.sample('whatsapp_task_db_queries_count', task=task), before[2] + 1)
+        self.assertGreater(self.sample('whatsapp_task_db_queries_sum', task=task), before[3])
+
+    def test_queue_wait_from_published_header_or_eta(self):
+        headers = {}
+        metrics.stamp_published_at(headers=headers)
+        published_at = headers[metrics.PUBLISHED_AT_HEADER] - 3
+        request = mock.Mock(published_at=published_at, eta=None)
+        self.assertAlmostEqual(metrics._queue_wait(request), 3, delta=0.5)
+        request.eta = datetime.fromtimestamp(published_at + 2, tz=dt_timezone.utc).isoformat()
+        self.assertAlmostEqual(metrics._queue_wait(request), 1, delta=0.5)
@@ -6,7 +6,11 @@ from .views import (
     ContactViewSet, GroupViewSet, MessageTemplateViewSet,
     ScheduledMessageViewSet, MessageLogViewSet, EvolutionConfigViewSet,
     DashboardStatsView, # Importa a nova view do dashboard
-    health_check
+    DashboardTimeseriesView,
+    RateLimitStatusView,
+    NumberValidityStatusView,
+    health_check,
+    evolution_webhook,
 )
 
 # O Router cria automaticamente as URLs para todos os ViewSets
@@ -27,4 +31,16 @@ urlpatterns = [
 
     # NOVO: Endpoint para estatísticas do Dashboard
     path('dashboard/stats/', DashboardStatsView.as_view(), name='dashboard-stats'),
+
+    # Série histórica de envios (consolidados por minuto/hora/dia)
+    path('dashboard/timeseries/', DashboardTimeseriesView.as_view(), name='dashboard-timeseries'),
+
+    # Nível atual dos buckets de rate limit por instância
+    path('dashboard/rate-limits/', RateLimitStatusView.as_view(), name='dashboard-rate-limits'),
+
+    # Cache de validade de números no WhatsApp
+    path('dashboard/number-validity/', NumberValidityStatusView.as_view(), name='dashboard-number-validity'),
+
+    # Webhooks da Evolution API (recibos de entrega/leitura), aplicados em lote
+    path('webhooks/evolution/', evolution_webhook, name='evolution-webhook'),
 ]
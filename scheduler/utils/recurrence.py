@@ -0,0 +1,105 @@
+# scheduler/utils/recurrence.py
+"""
+Motor de recorrência dos agendamentos.
+
+Calcula a próxima execução em tempo constante (sem laços dia a dia ou ano a ano)
+para as frequências daily, weekly, monthly e yearly, com as mesmas regras de
+ScheduledMessage.calculate_next_execution. Também oferece uma API em lote, que
+recebe colunas de parâmetros, para recalcular milhares de next_execution de uma vez.
+"""
+import calendar
+from datetime import datetime, timedelta
+from typing import Iterator, List, Optional, Sequence
+
+
+def _at_start_time(value: datetime, start_date: datetime) -> datetime:
+    return value.replace(hour=start_date.hour, minute=start_date.minute, second=0, microsecond=0)
+
+
+def _next_leap_year(year: int) -> int:
+    """Primeiro ano bissexto >= year."""
+    year += (4 - year % 4) % 4
+    if not calendar.isleap(year):
+        # Anos de século não divisíveis por 400 (ex.: 2100) não são bissextos
+        year += 4
+    return year
+
+
+def next_occurrence(frequency: str, start_date: datetime, base: datetime,
+                    day_of_week: Optional[int] = None, day_of_month: Optional[int] = None) -> Optional[datetime]:
+    """
+    Próxima execução estritamente depois do dia de `base`, no horário de `start_date`.
+    Retorna None para 'once' ou quando faltam/são inválidos os parâmetros da frequência.
+    """
+    if frequency == 'daily':
+        return _at_start_time(base + timedelta(days=1), start_date)
+
+    if frequency == 'weekly':
+        if day_of_week is None or not 0 <= day_of_week <= 6:
+            return None
+        days_ahead = (day_of_week - base.weekday() - 1) % 7 + 1
+        return _at_start_time(base + timedelta(days=days_ahead), start_date)
+
+    if frequency == 'monthly':
+        if not day_of_month or day_of_month < 1:
+            return None
+        day = min(day_of_month, calendar.monthrange(base.year, base.month)[1])
+        if day > base.day:
+            return _at_start_time(base.replace(day=day), start_date)
+        year, month = (base.year + 1, 1) if base.month == 12 else (base.year, base.month + 1)
+        day = min(day_of_month, calendar.monthrange(year, month)[1])
+        return _at_start_time(base.replace(year=year, month=month, day=day), start_date)
+
+    if frequency == 'yearly':
+        month, day = start_date.month, start_date.day
+        year = base.year
+        if month == 2 and day == 29:
+            if not calendar.isleap(year):
+                if base.month > month:
+                    year += 1
+            elif (month, day) <= (base.month, base.day):
+                year += 1
+            year = _next_leap_year(year)
+        elif (month, day) <= (base.month, base.day):
+            year += 1
+        return base.replace(year=year, month=month, day=day, hour=start_date.hour,
+                            minute=start_date.minute, second=0, microsecond=0)
+
+    return None
+
+
+def iter_occurrences(frequency: str, start_date: datetime, first: datetime,
+                     day_of_week: Optional[int] = None, day_of_month: Optional[int] = None) -> Iterator[datetime]:
+    """Gera `first` e as execuções seguintes, encadeando next_occurrence (O(1) por ocorrência)."""
+    current = first
+    while current is not None:
+        yield current
+        current = next_occurrence(frequency, start_date, current, day_of_week, day_of_month)
+
+
+def next_occurrences(frequency: str, start_date: datetime, base: datetime, count: int,
+                     day_of_week: Optional[int] = None, day_of_month: Optional[int] = None) -> List[datetime]:
+    """As próximas `count` execuções depois de `base`."""
+    occurrences = []
+    current = base
+    for _ in range(count):
+        current = next_occurrence(frequency, start_date, current, day_of_week, day_of_month)
+        if current is None:
+            break
+        occurrences.append(current)
+    return occurrences
+
+
+def next_occurrence_batch(frequencies: Sequence[str], start_dates: Sequence[datetime], bases: Sequence[datetime],
+                          days_of_week: Sequence[Optional[int]], days_of_month: Sequence[Optional[int]]
+                          ) -> List[Optional[datetime]]:
+    """
+    Versão em lote de next_occurrence: recebe uma coluna por parâmetro (todas do
+    mesmo tamanho) e devolve a coluna de próximas execuções, em uma única passada.
+    """
+    compute = next_occurrence
+    return [
+        compute(frequency, start_date, base, day_of_week, day_of_month)
+        for frequency, start_date, base, day_of_week, day_of_month
+        in zip(frequencies, start_dates, bases, days_of_week, days_of_month)
+    ]
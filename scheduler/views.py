@@ -2,28 +2,77 @@
 
 from rest_framework import viewsets
 from rest_framework.decorators import action
+from rest_framework.exceptions import ValidationError
+from rest_framework.parsers import FileUploadParser, MultiPartParser
 from rest_framework.response import Response
 from rest_framework.views import APIView
+from django.conf import settings
 from django.utils import timezone
+from django.utils.dateparse import parse_datetime
 from django.http import JsonResponse
-from django.db.models import Count
+from django.views.decorators.csrf import csrf_exempt
+from django.views.decorators.http import require_POST
+import hmac
+import uuid
+from collections import Counter
+from datetime import timedelta
+from redis.exceptions import RedisError
 
 from .models import (
     Contact, Group, MessageTemplate, ScheduledMessage, MessageLog, EvolutionConfig
 )
 from .serializers import (
     ContactSerializer, GroupSerializer, MessageTemplateSerializer,
-    ScheduledMessageSerializer, MessageLogSerializer, EvolutionConfigSerializer
+    ScheduledMessageSerializer, MessageLogSerializer, EvolutionConfigSerializer, expanded_relations
 )
+from .services.bulk_schedules import bulk_create_schedules, bulk_delete_schedules, bulk_set_status
+from .services.contact_import import FORMATS as IMPORT_FORMATS, detect_format, import_contacts
+from .services.dashboard_counters import dashboard_counters
+from .services.group_sync import sync_groups
+from .services.number_validity import number_validity
+from .services.rate_limiter import rate_limiter
+from .services.rollups import GRANULARITIES, choose_granularity, timeseries
+from .services.timeline import get_timeline, BUCKETS
+from .services import webhooks
 
 # --- ViewSets para o CRUD completo via API ---
 
+def parse_datetime_param(request, name):
+    """Lê um parâmetro de data/hora ISO 8601 da query string (ingênuo = fuso do projeto)."""
+    value = request.query_params.get(name)
+    if not value:
+        return None
+    parsed = parse_datetime(value)
+    if parsed is None:
+        raise ValidationError({name: 'Data/hora inválida (use ISO 8601).'})
+    if timezone.is_naive(parsed):
+        parsed = timezone.make_aware(parsed)
+    return parsed
+
+
 class ContactViewSet(viewsets.ModelViewSet):
     """
     API endpoint para gerenciar Contatos.
     """
     queryset = Contact.objects.all().order_by('name')
     serializer_class = ContactSerializer
+    ordering = ('name', 'id')
+
+    @action(detail=False, methods=['post'], url_path='import', parser_classes=[MultiPartParser, FileUploadParser])
+    def import_contacts(self, request):
+        """
+        Importa contatos em massa de um arquivo CSV ou JSONL (campo `file`), com upsert
+        pelo número de telefone. O formato vem de `file_format` ou da extensão do arquivo.
+        """
+        upload = request.FILES.get('file')
+        if upload is None:
+            raise ValidationError({'file': 'Envie o arquivo CSV ou JSONL no campo "file".'})
+        file_format = request.query_params.get('file_format') or detect_format(upload.name)
+        if file_format not in IMPORT_FORMATS:
+            raise ValidationError({'file_format': f"Use um de: {', '.join(IMPORT_FORMATS)}."})
+
+        report = import_contacts(upload, file_format)
+        return Response(report)
 
 class GroupViewSet(viewsets.ModelViewSet):
     """
@@ -31,6 +80,16 @@ class GroupViewSet(viewsets.ModelViewSet):
     """
     queryset = Group.objects.all().order_by('name')
     serializer_class = GroupSerializer
+    ordering = ('name', 'id')
+
+    @action(detail=False, methods=['post'])
+    def sync(self, request):
+        """
+        Sincroniza os grupos com os de todas as instâncias Evolution (cria, renomeia e
+        desativa em lote). Com {"force": true} aplica a diferença mesmo sem mudança nas listas.
+        """
+        force = str(request.data.get('force', request.query_params.get('force', ''))).lower() in ('1', 'true')
+        return Response(sync_groups(force=force))
 
 class MessageTemplateViewSet(viewsets.ModelViewSet):
     """
@@ -38,6 +97,7 @@ class MessageTemplateViewSet(viewsets.ModelViewSet):
     """
     queryset = MessageTemplate.objects.all().order_by('title')
     serializer_class = MessageTemplateSerializer
+    ordering = ('title', 'id')
 
 class ScheduledMessageViewSet(viewsets.ModelViewSet):
     """
@@ -45,13 +105,20 @@ class ScheduledMessageViewSet(viewsets.ModelViewSet):
     """
     queryset = ScheduledMessage.objects.all().order_by('-created_at')
     serializer_class = ScheduledMessageSerializer
+    ordering = ('-created_at', '-id')
 
-    @action(detail=False, methods=['get'])
+    def get_queryset(self):
+        # Só faz o JOIN das relações que vão ser serializadas aninhadas (?expand=)
+        related = expanded_relations(self.request, ScheduledMessageSerializer.expandable_fields)
+        queryset = super().get_queryset()
+        return queryset.select_related(*sorted(related)) if related else queryset
+
+    @action(detail=False, methods=['get'], ordering=('next_execution', 'id'))
     def upcoming(self, request):
         """
         Retorna uma lista de agendamentos ativos que ainda serão executados.
         """
-        upcoming_schedules = ScheduledMessage.objects.filter(
+        upcoming_schedules = self.get_queryset().filter(
             status='active',
             next_execution__gte=timezone.now()
         ).order_by('next_execution')
@@ -64,12 +131,12 @@ class ScheduledMessageViewSet(viewsets.ModelViewSet):
         serializer = self.get_serializer(upcoming_schedules, many=True)
         return Response(serializer.data)
 
-    @action(detail=False, methods=['get'])
+    @action(detail=False, methods=['get'], ordering=('next_execution', 'id'))
     def overdue(self, request):
         """
         Retorna uma lista de agendamentos ativos que estão atrasados.
         """
-        overdue_schedules = ScheduledMessage.objects.filter(
+        overdue_schedules = self.get_queryset().filter(
             status='active',
             next_execution__lt=timezone.now()
         ).order_by('next_execution')
@@ -82,12 +149,104 @@ class ScheduledMessageViewSet(viewsets.ModelViewSet):
         serializer = self.get_serializer(overdue_schedules, many=True)
         return Response(serializer.data)
 
+    @action(detail=False, methods=['post'], url_path='bulk-create')
+    def bulk_create(self, request):
+        """
+        Cria vários agendamentos de uma vez (lista no corpo ou em "items").
+        Devolve um resultado por item; os inválidos não impedem a criação dos demais.
+        """
+        items = request.data.get('items') if isinstance(request.data, dict) else request.data
+        if not isinstance(items, list) or not items:
+            raise ValidationError({'items': 'Envie uma lista não vazia de agendamentos.'})
+        self._check_bulk_size(items)
+        return self._bulk_response(bulk_create_schedules(items))
+
+    @action(detail=False, methods=['post'], url_path='bulk-pause')
+    def bulk_pause(self, request):
+        """Pausa os agendamentos ativos informados em "ids"."""
+        return self._bulk_response(bulk_set_status(self._bulk_ids(request), 'paused', from_statuses=['active']))
+
+    @action(detail=False, methods=['post'], url_path='bulk-resume')
+    def bulk_resume(self, request):
+        """Retoma os agendamentos pausados informados em "ids"."""
+        return self._bulk_response(bulk_set_status(self._bulk_ids(request), 'active', from_statuses=['paused']))
+
+    @action(detail=False, methods=['post'], url_path='bulk-delete')
+    def bulk_delete(self, request):
+        """Exclui os agendamentos informados em "ids"."""
+        return self._bulk_response(bulk_delete_schedules(self._bulk_ids(request)))
+
+    def _check_bulk_size(self, items):
+        if len(items) > settings.BULK_SCHEDULE_MAX_ITEMS:
+            raise ValidationError({'items': f'Máximo de {settings.BULK_SCHEDULE_MAX_ITEMS} itens por requisição.'})
+
+    def _bulk_ids(self, request):
+        ids = request.data.get('ids') if isinstance(request.data, dict) else None
+        if not isinstance(ids, list) or not ids:
+            raise ValidationError({'ids': 'Envie uma lista não vazia de IDs.'})
+        self._check_bulk_size(ids)
+        return ids
+
+    def _bulk_response(self, results):
+        summary = Counter(item['result'] for item in results)
+        return Response({'summary': summary, 'results': results})
+
+    @action(detail=False, methods=['get'])
+    def timeline(self, request):
+        """
+        Expande as recorrências dos agendamentos ativos em envios previstos numa janela
+        (?start=&end=, padrão: próximos 7 dias). Com ?bucket=hour|day devolve a contagem
+        por intervalo; sem bucket, a lista das primeiras ?limit= ocorrências.
+        """
+        bucket = request.query_params.get('bucket') or None
+        if bucket and bucket not in BUCKETS:
+            raise ValidationError({'bucket': f"Use um de: {', '.join(BUCKETS)}."})
+
+        # Sem ?start=, a janela padrão começa na hora cheia, para que consultas próximas
+        # gerem a mesma chave e reaproveitem o cache; um start informado vale como veio
+        window_start = parse_datetime_param(request, 'start') or timezone.now().replace(minute=0, second=0, microsecond=0)
+        window_end = parse_datetime_param(request, 'end') or window_start + timedelta(days=7)
+        if window_end <= window_start:
+            raise ValidationError({'end': 'Deve ser posterior a start.'})
+        if window_end - window_start > timedelta(days=settings.TIMELINE_MAX_DAYS):
+            raise ValidationError({'end': f'A janela máxima é de {settings.TIMELINE_MAX_DAYS} dias.'})
+
+        try:
+            limit = min(int(request.query_params.get('limit', 1000)), 10000)
+        except ValueError:
+            raise ValidationError({'limit': 'Deve ser um número inteiro.'})
+
+        return Response(get_timeline(window_start, window_end, bucket, limit))
+
 class MessageLogViewSet(viewsets.ReadOnlyModelViewSet):
     """
     Logs são apenas para leitura via API.
     """
     queryset = MessageLog.objects.all().order_by('-sent_at')
     serializer_class = MessageLogSerializer
+    ordering = ('-sent_at', '-id')
+
+    def get_queryset(self):
+        """
+        Filtros opcionais: ?schedule=<id>, ?status=, ?sent_after= e ?sent_before= (ISO 8601).
+        Combinados com o cursor, usam os índices (status, sent_at) e (scheduled_message, sent_at).
+        """
+        queryset = super().get_queryset()
+        params = self.request.query_params
+        if params.get('schedule'):
+            try:
+                queryset = queryset.filter(scheduled_message_id=uuid.UUID(params['schedule']))
+            except ValueError:
+                raise ValidationError({'schedule': 'ID inválido.'})
+        if params.get('status'):
+            queryset = queryset.filter(status=params['status'])
+        sent_after = parse_datetime_param(self.request, 'sent_after')
+        if sent_after:
+            queryset = queryset.filter(sent_at__gte=sent_after)
+        sent_before = parse_datetime_param(self.request, 'sent_before')
+        if sent_before:
+            queryset = queryset.filter(sent_at__lt=sent_before)
+        return queryset
 
 class EvolutionConfigViewSet(viewsets.ModelViewSet):
     """
@@ -95,6 +254,7 @@ class EvolutionConfigViewSet(viewsets.ModelViewSet):
     """
     queryset = EvolutionConfig.objects.all().order_by('instance_name')
     serializer_class = EvolutionConfigSerializer
+    ordering = ('instance_name', 'id')
 
 # --- Views Específicas para Dashboard e Outros ---
 
@@ -103,20 +263,100 @@ class DashboardStatsView(APIView):
     Retorna estatísticas agregadas para o dashboard.
     """
     def get(self, request, format=None):
-        schedule_stats = ScheduledMessage.objects.values('status').annotate(count=Count('status'))
-        log_stats = MessageLog.objects.values('status').annotate(count=Count('status'))
-        
-        data = {
-            'schedule_summary': {item['status']: item['count'] for item in schedule_stats},
-            'log_summary': {item['status']: item['count'] for item in log_stats},
-            'total_schedules': ScheduledMessage.objects.count(),
-            'total_logs': MessageLog.objects.count()
-        }
-        return Response(data)
+        # Contadores incrementais no Redis (reconciliados periodicamente com o banco)
+        return Response(dashboard_counters.snapshot())
+
+class DashboardTimeseriesView(APIView):
+    """
+    Série histórica de envios, falhas, entregas e leituras a partir dos consolidados.
+    Parâmetros: ?start=&end= (padrão: últimas 24h), ?granularity=minute|hour|day (padrão:
+    a mais fina que cabe em ?points=), ?points= (downsampling) e ?schedule= ou ?instance=.
+    """
+    def get(self, request, format=None):
+        window_end = parse_datetime_param(request, 'end') or timezone.now()
+        window_start = parse_datetime_param(request, 'start') or window_end - timedelta(days=1)
+        if window_end <= window_start:
+            raise ValidationError({'end': 'Deve ser posterior a start.'})
+
+        try:
+            max_points = int(request.query_params.get('points', settings.TIMESERIES_MAX_POINTS))
+        except ValueError:
+            raise ValidationError({'points': 'Deve ser um número inteiro.'})
+        max_points = max(1, min(max_points, settings.TIMESERIES_MAX_POINTS))
+
+        granularity = request.query_params.get('granularity') or choose_granularity(
+            window_start, window_end, max_points
+        )
+        if granularity not in GRANULARITIES:
+            raise ValidationError({'granularity': f"Use um de: {', '.join(GRANULARITIES)}."})
+
+        dimension, key = 'all', ''
+        if request.query_params.get('schedule'):
+            dimension, key = 'schedule', request.query_params['schedule']
+        elif request.query_params.get('instance'):
+            dimension, key = 'instance', request.query_params['instance']
+
+        return Response(timeseries(window_start, window_end, granularity, max_points, dimension, key))
+
+class RateLimitStatusView(APIView):
+    """
+    Retorna o nível atual dos buckets de rate limit (tokens disponíveis por instância).
+    """
+    def get(self, request, format=None):
+        if not rate_limiter.enabled:
+            return Response({'enabled': False})
+        try:
+            levels = rate_limiter.get_levels()
+        except RedisError as e:
+            return Response({'enabled': True, 'error': str(e)}, status=503)
+        return Response({'enabled': True, **levels})
+
+class NumberValidityStatusView(APIView):
+    """
+    Estatísticas do cache de validade de números no WhatsApp (acertos, faltas,
+    números verificados e envios pulados por número inválido).
+    """
+    def get(self, request, format=None):
+        if not number_validity.enabled:
+            return Response({'enabled': False})
+        try:
+            stats = number_validity.stats()
+        except RedisError as e:
+            return Response({'enabled': True, 'error': str(e)}, status=503)
+        return Response({'enabled': True, **stats})
 
 def health_check(request):
     """Health check simples para monitoramento."""
     return JsonResponse({
         'status': 'healthy',
         'timestamp': timezone.now().isoformat()
-    })
\ No newline at end of file
+    })
+
+
+@csrf_exempt
+@require_POST
+def evolution_webhook(request):
+    """
+    Recebe os webhooks da Evolution API. Só empilha o corpo no Redis e responde 202;
+    a task apply_webhook_events aplica os eventos em lote. Exige o valor de
+    EVOLUTION_WEBHOOK_TOKEN no header X-Webhook-Token ou em ?token=; sem o token
+    configurado, o endpoint fica desativado.
+    """
+    expected = settings.EVOLUTION_WEBHOOK_TOKEN
+    if not expected:
+        return JsonResponse({'detail': 'Webhook desativado: defina EVOLUTION_WEBHOOK_TOKEN.'}, status=403)
+    received = request.headers.get('X-Webhook-Token') or request.GET.get('token') or ''
+    if not hmac.compare_digest(received.encode(), expected.encode()):
+        return JsonResponse({'detail': 'Token inválido.'}, status=401)
+    if not request.body:
+        return JsonResponse({'detail': 'Corpo vazio.'}, status=400)
+    try:
+        queued = webhooks.enqueue(request.body)
+    except (RedisError, webhooks.WebhookQueueFull) as e:
+        # 503 faz a Evolution reenviar o evento mais tarde
+        return JsonResponse({'detail': str(e)}, status=503)
+    if queued == 1:
+        # Fila estava vazia: agenda a aplicação do lote que vai se formar
+        from .tasks import apply_webhook_events
+        apply_webhook_events.apply_async(countdown=settings.WEBHOOK_APPLY_DELAY_SECONDS)
+    return JsonResponse({'queued': True}, status=202)
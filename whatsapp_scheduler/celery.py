@@ -14,6 +14,25 @@ app = Celery('whatsapp_scheduler')
 # Ex: CELERY_BROKER_URL, CELERY_RESULT_BACKEND
 app.config_from_object('django.conf:settings', namespace='CELERY')
 
+# Conecta os signals de métricas (carimbo de publicação, tempo de fila, consultas por
+# task e o /metrics dos workers) em todo processo que publica ou executa tasks
+import scheduler.services.metrics  # noqa: E402,F401
+
+
+def route_task(name, args, kwargs, options, task=None, **kw):
+    """
+    Roteador do Celery (CELERY_TASK_ROUTES): cada envio de agendamento vai para a fila
+    da rota indicada no kwarg `route` (prioridade e mídia; ver
+    scheduler/services/send_routing.py), para que envios curtos não esperem atrás de
+    broadcasts e uploads. As demais tasks ficam na fila padrão.
+    """
+    if name in ('scheduler.tasks.process_scheduled_message', 'scheduler.tasks.process_scheduled_batch',
+                'scheduler.tasks.send_deferred_message'):
+        from django.conf import settings
+        route = (kwargs or {}).get('route') or 'text'
+        return {'queue': settings.SEND_QUEUES.get(route, settings.SEND_QUEUES['text'])}
+    return None
+
 # ESTA É A LINHA MAIS IMPORTANTE:
 # O Celery irá procurar automaticamente por arquivos tasks.py em todos os apps
 # listados no INSTALLED_APPS do seu projeto Django.
@@ -25,9 +25,12 @@ INSTALLED_APPS = [
     'corsheaders',
     'scheduler',
     'django_celery_beat',
+    'django_prometheus',
 ]
 
 MIDDLEWARE = [
+    # Métricas das requisições (/metrics); o par Before/After envolve todos os outros
+    'django_prometheus.middleware.PrometheusBeforeMiddleware',
     'corsheaders.middleware.CorsMiddleware',
     'django.middleware.security.SecurityMiddleware',
     'django.contrib.sessions.middleware.SessionMiddleware',
@@ -36,6 +39,7 @@ MIDDLEWARE = [
     'django.contrib.auth.middleware.AuthenticationMiddleware',
     'django.contrib.messages.middleware.MessageMiddleware',
     'django.middleware.clickjacking.XFrameOptionsMiddleware',
+    'django_prometheus.middleware.PrometheusAfterMiddleware',
 ]
 
 ROOT_URLCONF = 'whatsapp_scheduler.urls'
@@ -63,7 +67,8 @@ WSGI_APPLICATION = 'whatsapp_scheduler.wsgi.application'
 # ===================================================================
 DATABASES = {
     'default': {
-        'ENGINE': 'django.db.backends.mysql',
+        # Backend MySQL do django-prometheus: conta consultas e erros do banco em /metrics
+        'ENGINE': 'django_prometheus.db.backends.mysql',
         'NAME': 'whatsapp_scheduler',
         'USER': 'gexbot_user',
         'PASSWORD': 'root', # Use a senha correta do seu DB
@@ -98,12 +103,19 @@ STATIC_ROOT = os.path.join(BASE_DIR, 'staticfiles')
 # Media files
 MEDIA_URL = '/media/'
 MEDIA_ROOT = os.path.join(BASE_DIR, 'media')
+# Limite (bytes, já em base64) do cache de mídias preparadas para envio. É por processo:
+# cada filho prefork do worker tem o seu, então o pior caso por container é
+# --concurrency x limite (8 x 16 MiB = 128 MiB no celery_worker_send)
+MEDIA_CACHE_MAX_BYTES = config('MEDIA_CACHE_MAX_BYTES', default=16 * 1024 * 1024, cast=int)
+# Planos de renderização de templates ({name}, {date}...) mantidos em cache por processo
+TEMPLATE_RENDER_CACHE_SIZE = config('TEMPLATE_RENDER_CACHE_SIZE', default=1024, cast=int)
 
 DEFAULT_AUTO_FIELD = 'django.db.models.BigAutoField'
 
 # REST Framework
 REST_FRAMEWORK = {
-    'DEFAULT_PAGINATION_CLASS': 'rest_framework.pagination.PageNumberPagination',
+    # Cursor (keyset) sobre a ordenação de cada view: custo constante em qualquer página
+    'DEFAULT_PAGINATION_CLASS': 'scheduler.pagination.KeysetPagination',
     'PAGE_SIZE': 20,
     'DEFAULT_RENDERER_CLASSES': ['rest_framework.renderers.JSONRenderer',],
     'DEFAULT_PARSER_CLASSES': [
@@ -118,6 +130,25 @@ REST_FRAMEWORK = {
 # CORS
 CORS_ALLOW_ALL_ORIGINS = True
 
+# Cache (Redis) compartilhado entre web e workers
+CACHES = {
+    'default': {
+        'BACKEND': 'django.core.cache.backends.redis.RedisCache',
+        'LOCATION': config('CACHE_URL', default='redis://redis:6379/1'),
+    }
+}
+
+# Linha do tempo de envios previstos (/api/schedules/timeline/)
+TIMELINE_CACHE_SECONDS = config('TIMELINE_CACHE_SECONDS', default=300, cast=int)
+TIMELINE_MAX_DAYS = config('TIMELINE_MAX_DAYS', default=31, cast=int)
+
+# Importação em massa de contatos: linhas por upsert e máximo de erros detalhados no relatório
+CONTACT_IMPORT_CHUNK_SIZE = config('CONTACT_IMPORT_CHUNK_SIZE', default=1000, cast=int)
+CONTACT_IMPORT_MAX_ERRORS = config('CONTACT_IMPORT_MAX_ERRORS', default=1000, cast=int)
+
+# Operações em massa de agendamentos (/api/schedules/bulk-*/): itens por requisição
+BULK_SCHEDULE_MAX_ITEMS = config('BULK_SCHEDULE_MAX_ITEMS', default=1000, cast=int)
+
 # Celery
 CELERY_BROKER_URL = config('CELERY_BROKER_URL', default='redis://redis:6379/0')
 CELERY_RESULT_BACKEND = config('CELERY_RESULT_BACKEND', default='redis://redis:6379/0')
@@ -129,11 +160,141 @@ CELERY_ENABLE_UTC = False
 CELERY_BROKER_CONNECTION_RETRY_ON_STARTUP = True
 CELERY_BEAT_SCHEDULER = 'django_celery_beat.schedulers:DatabaseScheduler'
 
+# Filas: os envios são distribuídos por rota (whatsapp_scheduler.celery.route_task) e as
+# demais tasks (manutenção, webhooks, sincronizações) usam a fila padrão.
+CELERY_TASK_DEFAULT_QUEUE = 'default'
+SEND_QUEUES = {
+    'high': 'send_high',    # agendamentos de prioridade alta
+    'text': 'send_text',    # textos comuns
+    'media': 'send_media',  # imagens, vídeos e documentos (uploads pesados)
+    'bulk': 'send_bulk',    # prioridade baixa
+}
+CELERY_TASK_ROUTES = ('whatsapp_scheduler.celery.route_task',)
+# Mensagens reservadas por processo do worker; 1 evita que envios curtos fiquem presos
+# atrás de tarefas longas já reservadas pelo mesmo processo
+CELERY_WORKER_PREFETCH_MULTIPLIER = config('CELERY_WORKER_PREFETCH_MULTIPLIER', default=1, cast=int)
+# Porta do /metrics de cada worker (0 desativa). Com PROMETHEUS_MULTIPROC_DIR definido no
+# ambiente, soma as métricas de todos os processos filhos (ver scheduler/services/metrics.py)
+CELERY_METRICS_PORT = config('CELERY_METRICS_PORT', default=9808, cast=int)
+CELERY_BEAT_SCHEDULE = {}
+
+# Modo de disparo dos agendamentos:
+#   'periodic_task' -> uma PeriodicTask do django_celery_beat por ScheduledMessage (padrão)
+#   'dispatcher'    -> um único tick do beat por minuto varre ScheduledMessage.next_execution
+# Ao trocar para 'dispatcher', rode `python manage.py migrate_to_dispatcher`.
+# Ao voltar para 'periodic_task', rode `python manage.py migrate_to_periodic_tasks` (o DatabaseScheduler
+# mantém a PeriodicTask dispatch-due-messages no banco e os agendamentos seriam disparados duas vezes).
+SCHEDULER_DISPATCH_MODE = config('SCHEDULER_DISPATCH_MODE', default='periodic_task')
+SCHEDULER_DISPATCH_BATCH_SIZE = config('SCHEDULER_DISPATCH_BATCH_SIZE', default=500, cast=int)
+# Tempo (segundos) após o qual um agendamento despachado e não finalizado pode ser despachado de novo
+SCHEDULER_DISPATCH_CLAIM_TTL = config('SCHEDULER_DISPATCH_CLAIM_TTL', default=600, cast=int)
+# Agendamentos vencidos por task de envio (process_scheduled_batch), enviados em paralelo
+SCHEDULER_SEND_BATCH_SIZE = config('SCHEDULER_SEND_BATCH_SIZE', default=50, cast=int)
+# Antecedência (segundos) aceita entre o disparo e o next_execution da ocorrência (diferença de relógios)
+SCHEDULER_OCCURRENCE_TOLERANCE_SECONDS = config('SCHEDULER_OCCURRENCE_TOLERANCE_SECONDS', default=60, cast=int)
+
+if SCHEDULER_DISPATCH_MODE == 'dispatcher':
+    CELERY_BEAT_SCHEDULE['dispatch-due-messages'] = {
+        'task': 'scheduler.tasks.dispatch_due_messages',
+        'schedule': 60.0,
+    }
+
 # Evolution API Configuration
 EVOLUTION_API_BASE_URL = config('EVOLUTION_API_BASE_URL')
 EVOLUTION_API_KEY = config('EVOLUTION_API_KEY')
 EVOLUTION_INSTANCE_NAME = config('EVOLUTION_INSTANCE_NAME')
 
+# Sessão HTTP (keep-alive) compartilhada por processo para a Evolution API
+EVOLUTION_HTTP_POOL_CONNECTIONS = config('EVOLUTION_HTTP_POOL_CONNECTIONS', default=10, cast=int)  # hosts distintos
+EVOLUTION_HTTP_POOL_SIZE = config('EVOLUTION_HTTP_POOL_SIZE', default=20, cast=int)  # conexões por host
+EVOLUTION_HTTP_CONNECT_TIMEOUT = config('EVOLUTION_HTTP_CONNECT_TIMEOUT', default=5.0, cast=float)
+EVOLUTION_HTTP_READ_TIMEOUT = config('EVOLUTION_HTTP_READ_TIMEOUT', default=30.0, cast=float)
+EVOLUTION_HTTP_MAX_RETRIES = config('EVOLUTION_HTTP_MAX_RETRIES', default=3, cast=int)
+EVOLUTION_HTTP_BACKOFF_FACTOR = config('EVOLUTION_HTTP_BACKOFF_FACTOR', default=0.5, cast=float)
+
+# Motor de envio assíncrono dos lotes do dispatcher: envios simultâneos por instância Evolution
+EVOLUTION_ASYNC_CONCURRENCY = config('EVOLUTION_ASYNC_CONCURRENCY', default=20, cast=int)
+
+# Balanceamento entre as instâncias cadastradas em EvolutionConfig
+# Estratégias: 'weighted_round_robin', 'least_outstanding', 'sticky' (mesmo destinatário -> mesma instância)
+EVOLUTION_ROUTER_STRATEGY = config('EVOLUTION_ROUTER_STRATEGY', default='weighted_round_robin')
+EVOLUTION_ROUTER_REFRESH_SECONDS = config('EVOLUTION_ROUTER_REFRESH_SECONDS', default=30, cast=int)
+# Por quanto tempo uma instância que falhou fica fora do rodízio (até a verificação de status)
+EVOLUTION_ROUTER_DOWN_SECONDS = config('EVOLUTION_ROUTER_DOWN_SECONDS', default=60, cast=int)
+
+CELERY_BEAT_SCHEDULE['refresh-evolution-instances'] = {
+    'task': 'scheduler.tasks.refresh_evolution_instances',
+    'schedule': 60.0,
+}
+
+# Contadores do dashboard (Redis): intervalo da reconciliação com o banco, em segundos
+DASHBOARD_COUNTERS_RECONCILE_SECONDS = config('DASHBOARD_COUNTERS_RECONCILE_SECONDS', default=600, cast=int)
+CELERY_BEAT_SCHEDULE['reconcile-dashboard-counters'] = {
+    'task': 'scheduler.tasks.reconcile_dashboard_counters',
+    'schedule': float(DASHBOARD_COUNTERS_RECONCILE_SECONDS),
+}
+
+# Consolidação dos logs em séries por minuto/hora/dia (/api/dashboard/timeseries/)
+SEND_ROLLUP_INTERVAL_SECONDS = config('SEND_ROLLUP_INTERVAL_SECONDS', default=60, cast=int)
+# Margem para logs de transações ainda abertas antes de avançar o checkpoint
+SEND_ROLLUP_GRACE_SECONDS = config('SEND_ROLLUP_GRACE_SECONDS', default=120, cast=int)
+SEND_ROLLUP_MINUTE_RETENTION_DAYS = config('SEND_ROLLUP_MINUTE_RETENTION_DAYS', default=7, cast=int)
+TIMESERIES_MAX_POINTS = config('TIMESERIES_MAX_POINTS', default=1000, cast=int)
+CELERY_BEAT_SCHEDULE['rollup-message-logs'] = {
+    'task': 'scheduler.tasks.rollup_message_logs',
+    'schedule': float(SEND_ROLLUP_INTERVAL_SECONDS),
+}
+
+# Cache de validade de números no WhatsApp (chat/whatsappNumbers), em segundos.
+# O resultado negativo expira antes: o número pode passar a usar o WhatsApp.
+NUMBER_VALIDITY_ENABLED = config('NUMBER_VALIDITY_ENABLED', default=True, cast=bool)
+NUMBER_VALIDITY_TTL = config('NUMBER_VALIDITY_TTL', default=7 * 24 * 3600, cast=int)
+NUMBER_VALIDITY_NEGATIVE_TTL = config('NUMBER_VALIDITY_NEGATIVE_TTL', default=24 * 3600, cast=int)
+# Números por consulta à API (e por task de pré-verificação)
+NUMBER_VALIDITY_BATCH_SIZE = config('NUMBER_VALIDITY_BATCH_SIZE', default=500, cast=int)
+
+# Sincronização dos grupos com o fetchAllGroups das instâncias (segundos)
+GROUP_SYNC_INTERVAL_SECONDS = config('GROUP_SYNC_INTERVAL_SECONDS', default=900, cast=int)
+# Timeout de leitura do fetchAllGroups, que pode demorar em contas com milhares de grupos
+GROUP_SYNC_TIMEOUT = config('GROUP_SYNC_TIMEOUT', default=60.0, cast=float)
+CELERY_BEAT_SCHEDULE['sync-evolution-groups'] = {
+    'task': 'scheduler.tasks.sync_evolution_groups',
+    'schedule': float(GROUP_SYNC_INTERVAL_SECONDS),
+}
+
+# Webhooks da Evolution (/api/webhooks/evolution/). O token é exigido no header
+# X-Webhook-Token ou em ?token=; vazio desativa o endpoint. Os eventos ficam numa
+# fila no Redis e são aplicados em lote.
+EVOLUTION_WEBHOOK_TOKEN = config('EVOLUTION_WEBHOOK_TOKEN', default='')
+# Com a fila cheia o endpoint responde 503 e a Evolution reenvia depois
+WEBHOOK_QUEUE_MAX_LENGTH = config('WEBHOOK_QUEUE_MAX_LENGTH', default=100000, cast=int)
+# Por quanto tempo um recibo sem log (evolution_message_id ainda não gravado) é tentado de novo
+WEBHOOK_UNMATCHED_TTL_SECONDS = config('WEBHOOK_UNMATCHED_TTL_SECONDS', default=600, cast=int)
+WEBHOOK_BATCH_SIZE = config('WEBHOOK_BATCH_SIZE', default=5000, cast=int)
+WEBHOOK_MAX_BATCHES = config('WEBHOOK_MAX_BATCHES', default=20, cast=int)
+# Espera após o primeiro evento de uma fila vazia, para acumular o lote
+WEBHOOK_APPLY_DELAY_SECONDS = config('WEBHOOK_APPLY_DELAY_SECONDS', default=1.0, cast=float)
+CELERY_BEAT_SCHEDULE['apply-webhook-events'] = {
+    'task': 'scheduler.tasks.apply_webhook_events',
+    'schedule': config('WEBHOOK_APPLY_INTERVAL_SECONDS', default=30.0, cast=float),
+}
+
+# Buffer de escrita dos MessageLog (bulk_create/bulk_update) dentro de cada task
+MESSAGE_LOG_FLUSH_SIZE = config('MESSAGE_LOG_FLUSH_SIZE', default=500, cast=int)
+MESSAGE_LOG_FLUSH_INTERVAL = config('MESSAGE_LOG_FLUSH_INTERVAL', default=2.0, cast=float)
+
+# Redis usado pelos serviços do scheduler (rate limit, contadores...). Por padrão, o próprio broker.
+SCHEDULER_REDIS_URL = config('SCHEDULER_REDIS_URL', default=CELERY_BROKER_URL)
+SCHEDULER_REDIS_SOCKET_TIMEOUT = config('SCHEDULER_REDIS_SOCKET_TIMEOUT', default=2.0, cast=float)
+
+# Rate limit (token bucket no Redis). Taxa em mensagens/segundo; 0 desativa o bucket.
+EVOLUTION_RATE_LIMIT_INSTANCE_RATE = config('EVOLUTION_RATE_LIMIT_INSTANCE_RATE', default=1.0, cast=float)
+EVOLUTION_RATE_LIMIT_INSTANCE_BURST = config('EVOLUTION_RATE_LIMIT_INSTANCE_BURST', default=10, cast=int)
+EVOLUTION_RATE_LIMIT_RECIPIENT_RATE = config('EVOLUTION_RATE_LIMIT_RECIPIENT_RATE', default=0.2, cast=float)
+EVOLUTION_RATE_LIMIT_RECIPIENT_BURST = config('EVOLUTION_RATE_LIMIT_RECIPIENT_BURST', default=3, cast=int)
+# Quantas vezes uma task pode ser reagendada por falta de tokens
+EVOLUTION_RATE_LIMIT_MAX_DEFERRALS = config('EVOLUTION_RATE_LIMIT_MAX_DEFERRALS', default=100, cast=int)
+
 # Logging
 LOGGING = {
     'version': 1,
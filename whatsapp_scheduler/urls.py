@@ -11,6 +11,8 @@ urlpatterns = [
     path('admin/', admin.site.urls),
     path('api/', include('scheduler.urls')),
     path('api-token-auth/', views.obtain_auth_token, name='api_token_auth'),
+    # /metrics para o Prometheus (bloqueado no nginx; coletado direto em web:8000)
+    path('', include('django_prometheus.urls')),
 ]
 
 if settings.DEBUG: